@@ -1,113 +1,142 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import base64
-from scipy.stats import spearmanr
-from scipy.stats import pearsonr
+from cms_stars.data import load_data, dataset_columns
+from cms_stars.profiling import rerun_profiler
+from cms_stars.warmup import PAGES, warm_up
+#each page imports its own modules (plotly, scipy, ...) when it is shown, see the start of each page below
 
 #main section text
 st.title("CMS Star Ratings")
 
-#select box to show different pages of the app
-page = st.sidebar.selectbox("Select Page",
-    ['Star Rating Explorer', 'Star Measure Details (2022)','Correlations Dashboard', 'Contract Star Details'], index=0)
+#select box to show different pages of the app, a page can also be opened with ?page=<name>
+page = st.sidebar.selectbox("Select Page", PAGES,
+    index=PAGES.index(st.query_params['page']) if st.query_params.get('page') in PAGES else 0)
 
 #use session state to switch between pages
 st.session_state.page = page
 
+#timings of each stage of this rerun, only recorded when profiling is turned on (see cms_stars/profiling.py)
+profiler = rerun_profiler(page, st.query_params)
+
 #initialize measures dictionary for simulations later
 if 'measures' not in st.session_state:
     st.session_state.measures = {}
 
-#@st.cache(persist=True)
-
-# define a function that loads data
-def load_data(DATA_URL):
-    # read data
-    data = pd.read_csv(DATA_URL)
-    
-    # any modification to the read-in dataset can be put here
-    return data
+# function to show the stage timings of a profiler and append them to the log, when profiling is turned on
+#fragments cannot write to the sidebar, so their timings are shown in their own body
+def show_profile(profiler, container, label="Profiling"):
+    if not profiler.enabled:
+        return
+    with container.expander(label):
+        st.markdown(f"Rerun: {profiler.total() * 1000:.0f} ms")
+        st.dataframe(profiler.table().style.format({'ms': '{:.1f}', 'process_rss_mb': '{:+.1f}'}, na_rep='N/A'), hide_index=True)
+        st.caption("process_rss_mb: change in the server process's resident memory during the stage, including other sessions' allocations")
+    profiler.write_log()
 
 # function to show the treemap
-def show_treemap(df, size):
-    extra_cols = ['contract_id', 'contract_name', 'marketing_name', 'parent_org_name',
-                  'overall_star', 'part_c_star', 'part_d_star',
-                  'top_states', size, 'org_type_name','SNP']
-
-    #create the plotly treemap object
-    fig = px.treemap(
-        data_frame = df,
-        path=['parent_org_name', 'contract_id'],     # how the blocks are organized   
-        values = size,      # value determining block size
-        custom_data = extra_cols,
-        color='Rating',
-        color_continuous_scale ='rdylgn',
-        range_color = [0,5]
-    )
-
-    #basic display formatting
-    fig.update_traces(root_color="lightgrey")
-    fig.update_layout(margin = dict(t=10, l=10, r=10, b=10))
-
-    #set up hover display
-    fig.update_traces(
-        hovertemplate ='<b>%{customdata[0]} - %{customdata[1]}</b><br><br>' +
-            'Marketing Name: %{customdata[2]}<br>'
-            'Parent: %{customdata[3]}<br>' +
-            'Overall: %{customdata[4]}<br>' +
-            'Part C: %{customdata[5]}<br>' +
-            'Part D: %{customdata[6]}<br>' +
-            'States: %{customdata[7]}<br>' +
-            'Enrollment: %{customdata[8]}<br>' +
-            'Organization type: %{customdata[9]}<br>' +
-            'SNP: %{customdata[10]}<br>'
-    )
-    #customize hoverlabel appearance
-    fig.update_layout(
-        hoverlabel=dict(
-            bgcolor="white",
-            font_size=16,
-            font_family="Arial"
-        )  
-    )
+def show_treemap(fig):
+    with profiler.span('render treemap'):
+        st.plotly_chart(fig)
+    
+# function to show the share of enrollment of each state as a bar chart
+def show_state_shares(shares):
+    fig = go.Figure(go.Bar(x=shares.index, y=shares.to_numpy(), hovertemplate='%{x}: %{y:.1%}<extra></extra>'))
+    fig.update_layout(yaxis_tickformat='.0%', yaxis_range=[0, 1], margin=dict(t=10, l=10, r=10, b=10))
     st.plotly_chart(fig)
 
 # function to display PDF
-def displayPDF(file):
-    # Opening file from file path
-    with open(file, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
+def displayPDF(file, page=None):
+    #with static serving on, the browser fetches the PDF from the server instead of it being embedded in the page
+    static_serving = st.get_option('server.enableStaticServing')
 
-    # Embedding PDF in HTML
-    pdf_display = F'<iframe src="data:application/pdf;base64,{base64_pdf}" width="700" height="1000" type="application/pdf"></iframe>'
-    
     # return file to display
-    return pdf_display
+    return pdf_iframe(file, static_serving, page)
+
+#open a measure's PDF at a page, from a search result
+def open_pdf_page(measure, page):
+    st.session_state.pdf_measure = measure
+    st.session_state.pdf_page = page
+
+#a measure picked from the list opens at the first page
+def clear_pdf_page():
+    st.session_state.pdf_page = None
+
+#shared layout of the correlation scatter plots, so each figure only carries its own data
+SCATTER_TEMPLATE = dict(layout=dict(
+    height=450,
+    margin=dict(t=60, l=10, r=10, b=10),
+    hovermode='closest',
+    hoverlabel=dict(bgcolor="white")
+))
+
+#most points sent to the browser for one scatter plot
+MAX_SCATTER_POINTS = 2000
+
+#number of scatter plots shown at a time in each group of predictors
+SCATTER_PAGE_SIZE = 4
+
+#build a WebGL scatter plot of a measure against a predictor
+def scatter_figure(df, x, y, hover, max_points=MAX_SCATTER_POINTS):
+    #rows missing either value are not plotted, so don't send them
+    tmp_df = df[[x, y] + hover].dropna(subset=[x, y])
+
+    #cap the payload with a fixed sample so the plot does not change between reruns
+    if len(tmp_df) > max_points:
+        tmp_df = tmp_df.sample(max_points, random_state=0)
+
+    hovertemplate = (f'{x}: %{{x}}<br>{y}: %{{y}}<br>' +
+                     '<br>'.join(f'{h}: %{{customdata[{i}]}}' for i, h in enumerate(hover)) + '<extra></extra>')
+    fig = go.Figure(go.Scattergl(
+        x=tmp_df[x].to_numpy(),
+        y=tmp_df[y].to_numpy(),
+        mode='markers',
+        customdata=tmp_df[hover].astype(str).to_numpy(),
+        hovertemplate=hovertemplate
+    ))
+    fig.update_layout(template=SCATTER_TEMPLATE, title=y + " VS " + x, xaxis_title=x, yaxis_title=y)
+    return fig
 
 #display scatter plot of correlations between a measure and a predictor
-def show_scatter(df, x, y, hover):
-    title= y + " VS " + x
-    fig=px.scatter(df, x= x, y=y, title=title, hover_data=hover)
+def show_scatter(df, x, y, hover, correlations):
+    with profiler.span('scatter figure'):
+        fig = scatter_figure(df, x, y, hover)
     st.plotly_chart(fig)
     
-    tmp_df = df[[x,y]].dropna() 
-    
-    pearson = pearsonr(tmp_df[x], tmp_df[y])
-    spearman = spearmanr(df[x], df[y], nan_policy='omit')
-    st.markdown(f"__Pearson Correlation:__ {pearson[0]:.4f} (p-value: {pearson[1]:.4f}) __Spearman Correlation:__ {spearman[0]:.4f} (p-value: {spearman[1]:.4f})")
+    #correlations are precomputed for every measure and predictor, only look them up
+    pearson_r, pearson_p, spearman_r, spearman_p, n = correlations.pair(y, x)
+    st.markdown(f"__Pearson Correlation:__ {pearson_r:.4f} (p-value: {pearson_p:.4f}) __Spearman Correlation:__ {spearman_r:.4f} (p-value: {spearman_p:.4f})")
     st.markdown("""---""")
 
+#display one page of the scatter plots of a group of predictors, only loading the predictors on that page
+def show_scatter_group(DATA_URL, cols, measure, hover, correlations, key):
+    n_pages = (len(cols) + SCATTER_PAGE_SIZE - 1) // SCATTER_PAGE_SIZE
+    page = 1
+    if n_pages > 1:
+        page = st.radio('Page', range(1, n_pages + 1), horizontal=True, key='scatter_page_' + key,
+            format_func=lambda p: f"{p} of {n_pages}")
+    page_cols = cols[(page - 1) * SCATTER_PAGE_SIZE: page * SCATTER_PAGE_SIZE]
+
+    with profiler.span('load data'):
+        df = load_data(DATA_URL, columns=hover + [measure] + page_cols)
+    for c in page_cols:
+        show_scatter(df, c, measure, hover, correlations)
+
+#display the predictors most correlated with a measure
+def show_strongest_predictors(correlations, measure, top=10):
+    table = correlations.strongest_predictors(measure, method='spearman', correction='fdr_bh').head(top)
+    table = table.rename(columns={'r': 'spearman', 'p_adjusted': 'p-value (BH adjusted)'})
+    st.dataframe(table.style.format({'spearman': '{:.4f}', 'p': '{:.4f}', 'p-value (BH adjusted)': '{:.4f}', 'n': '{:.0f}'}),
+                 hide_index=True)
+
 def style_table_details(styler):
     styler.format({"score": "{:.1f}", "star": "{:.0f}"}, na_rep= "N/A")
     styler.background_gradient(axis=None, vmin=1, vmax=5, cmap="RdYlGn", subset='star')
     return styler
 
 def show_measures_table(df):
-    st.table(df.style.pipe(style_table_details))
+    with profiler.span('measures table'):
+        st.table(df.style.pipe(style_table_details))
     
 def style_table_rec(styler):
     styler.format({"score": "{:.1f}", "star": "{:.0f}", "weight":"{:.0f}", "lower":"{:.1f}", "upper": "{:.1f}", "penetration": "{:.1f}%"})
@@ -117,6 +146,14 @@ def style_table_rec(styler):
 def show_recommendations(df):
     st.table(df.style.pipe(style_table_rec))
     
+def style_table_plans(styler):
+    styler.format({"Target": "{:.1f}", "Effort": "{:.2f}", "Part C": "{:.1f}", "Part D": "{:.1f}", "Overall": "{:.1f}"}, na_rep="N/A")
+    styler.background_gradient(axis=None, vmin=1, vmax=5, cmap="RdYlGn", subset=['Target'])
+    return styler
+
+def show_plans(df):
+    st.table(df.style.pipe(style_table_plans))
+
 def style_table_results(styler):
     styler.format({"Rounded": "{:.1f}", "Raw": "{:.2f}", "Actual":"{:.1f}"})
     styler.background_gradient(axis=None, vmin=1, vmax=5, cmap="RdYlGn", subset=['Rounded','Actual'])
@@ -125,59 +162,224 @@ def style_table_results(styler):
 def show_star_results(df):
     st.table(df.style.pipe(style_table_results))
 
+def show_star_probabilities(df):
+    st.table(df.style.format("{:.0%}", subset=df.columns[1:]).background_gradient(axis=None, vmin=0, vmax=1, cmap="Greens", subset=df.columns[1:]))
+
 #update the session state value to allow star simulations
 def update_star(measure, star):
     st.session_state.measures[measure] = star
+    #only this measure's contribution to the simulated stars changes
+    if 'simulation' in st.session_state:
+        st.session_state.simulation.set_star(measure, star)
 
 #remove all session state values to reset star simulation
 def clear_simulation():
-    #for key in st.session_state.measures.keys():
-    #    del st.session_state[key]
-    del st.session_state.measures
+    #reset instead of deleting, a rerun of only the simulation panel does not go through the initialization above
+    st.session_state.measures = {}
+    if 'simulation' in st.session_state:
+        del st.session_state.simulation
     
-def create_simulated_measures_df(df):
+def get_simulation(df, key):
+    """
+    Given a df of a single contract and year's measure stars, return the session's StarSimulation for it with the
+    measure stars to simulate applied. The simulation is only rebuilt when the selected contract or year changes.
     """
-    Given a df of a single contract and year's measure stars, return a df updated with the measure stars to simulate.
+    sim = st.session_state.get('simulation')
+    if sim is None or sim.key != key:
+        sim = StarSimulation(df, key=key)
+        for measure, star in st.session_state.measures.items():
+            sim.set_star(measure, star)
+        st.session_state.simulation = sim
+    return sim
+    
+def get_star_probabilities(df, predicted, cutpoints_url, year, pred_year, key):
     """
+    Given a df of a single contract and year's measure stars and the predicted score of each measure for pred_year,
+    return star_probabilities() for pred_year. The draws are only rerun when the selected contract or year changes.
+    """
+    cached = st.session_state.get('star_probabilities')
+    if cached is None or cached[0] != key:
+        drift = cutpoint_drift(cutpoints_url, year)
+        cached = (key, star_probabilities(df, predicted, drift, pred_year))
+        st.session_state.star_probabilities = cached
+    return cached[1]
+    
+#simulation panel of the Contract Star Details page
+#a fragment: its widgets only rerun this panel, so the latency of a simulation is only the star math
+@st.fragment
+def show_simulation(df_filtered, measure_list, contract, year, details_url):
+    ### allow simulation for how changes in specific measure stars could impact overall star rating
+    
+    #a fragment rerun does not run the rest of the page, so it gets its own profiler and panel
+    profiler = rerun_profiler(f"{page} / simulation", st.query_params)
+    
+    st.subheader("Simulations: See how specific measure changes impact overall and summary star")
+    st.markdown("""
+    - Choose the measure to add to the simulation
+    - Use the number input to select the desired star
+    - Click Add Measure to Simulation to store the modified measure star and impact the simulated calculations
+    """)
+    
+    #select measure, only Part C/D measures if contract has that part
+    measure = st.selectbox('Select Measure for Simulations', measure_list, key='4', index=0,
+        help="The selected measure can have its measure star altered to simulate changes to star rating")
+    
+    #select the star value to simulate
+    simulate_value = st.number_input("Set Selected Measure's Star to: ", min_value=1, max_value=5, value=5, key='Simulated value')
+    
+    #confirm and store the star value
+    st.button('Add Measure to Simulation', on_click=update_star, kwargs={'measure':measure, 'star':simulate_value}, key='Store simulated value')
+    
     
-    for key in st.session_state.measures.keys():
-        df.loc[df['measure'] == key, 'star'] = st.session_state.measures[key]
+    # display all currently simulated measures
+    st.markdown("**Simulating the following measure changes**")
+    
+    if len(st.session_state.measures.keys()) == 0:
+        st.markdown("No measure changes currently selected")
+    else:
+        for key in st.session_state.measures.keys():
+            message = key + " = " + str(st.session_state.measures[key])
+            st.markdown(message)
+    
+    #clear and reset all simulated values
+    st.button('Clear and Reset Simulated Measures', on_click=clear_simulation, key='Reset simulated value')
+    
+    #calculate simulated  star rating
+    st.markdown("**Calculations**")
+    
+    #without simulated changes the stars are looked up in the precomputed table of every contract and year
+    with profiler.span('simulation'):
+        if len(st.session_state.measures.keys()) == 0:
+            contract_stars = star_table(details_url).loc[(contract, year)]
+            results = {t: (contract_stars[t + '_raw'], contract_stars[t + '_rounded']) for t in STAR_TYPE_NAMES}
+        else:
+            sim = get_simulation(df_filtered, (contract, year))
+            results = {t: sim.result(t) for t in STAR_TYPE_NAMES}
+    
+    #a row for each star type the contract has an actual star for
+    calc_result_df = star_results(df_filtered, results)
+    
+    if len(calc_result_df) > 0:
+        show_star_results(calc_result_df)
         
-    return df
+        st.markdown("""
+        **Legend**
+        - Rounded = raw star rounded to the nearest 0.5 star
+        - Raw = unrounded weighted average of individual measure stars using all available measures and then overridden by the simulated measure stars as specified
+        - Actual = actual star assigned by CMS for the selected contract and year
+        """)
+        
+        st.markdown("""
+        The actual star ratings are adjusted with a reward factor that and a Categorical Adjustment Index (CAI) after the weighted average of measure stars. The reward factor can increase the star as a reward for having both high and stable relative performance. The CAI add or subtract from the star rating to adjust for the within-contract disparity in performance for Low Income Subsidy/Dual Eligible and disabled beneficiaries.
+        """)
+        
+        st.markdown("The above calculations do not take into account these adjustments and therefore can be different from the actual Star Rating.")
+    else:
+        st.markdown("Plan does not have enough data to receive overall and summary stars")
     
-#calculate the overall or summary star rating
-def overall_summary_star(df, star_type='overall', star_col='star', weight_col='weight'):
-    """
-    Given a dataframe df for a single contract and year, calculate the chosen star_type (overall, part_c, part_d) using
-    weighted average of the individual measure stars.
+    show_profile(profiler, st, "Profiling: simulation")
+
+#historical trend panel of the Contract Star Details page, a fragment rerun on its own when the measure changes
+@st.fragment
+def show_trend(df, index, df_cutpoints, contract, measure_list, use_PDP):
+    ### display historical trend and cut points boundary for selected measure
+    profiler = rerun_profiler(f"{page} / trend", st.query_params)
+    st.subheader("Measure Historical Trend")
+    st.markdown("Display how the current contract performed on the selected measure over the past few years.")
+    st.markdown("""
+    Also includes the predicted 2023 measure score created using machine learning models. The predicted score appears in a lighter shade of blue and can be compared against the actual 2023 measure score in dark blue.
+    """)
     
-    Returns both the raw weighted average star and the star rounded to the nearest 0.5
-    """
+    measure = st.selectbox('Select Measure to View Trends', measure_list, key='trend_measure', index=0,
+        help="Select the measure to view historical trends on.")
     
-    #for overall star rating, don't double count these measures
-    if star_type == 'overall':
-        df = df[df['measure'] != 'D-Members Choosing to Leave the Plan']
-        df = df[df['measure'] != 'D-Complaints about the Drug Plan']
-    #for part c summary star, keep only part c measures
-    elif star_type == 'part_c':
-        df = df[df['is_part_c'] == 1]
-    #for part d summary star, keep only part d measures
-    elif star_type == 'part_d':
-        df = df[df['is_part_d'] == 1]
+    ##### measure specific info
+    df_contract_measure = df.iloc[index.rows(contract_id=contract, measure=measure)]
     
-    #remove measures where star was not assigned
-    df = df.dropna(subset = star_col)
+    measure_cutpoints = df_cutpoints[(df_cutpoints['measure'] == measure) & (df_cutpoints['is_PDP'] == use_PDP)]
     
-    #calculate weighted average
-    raw_star = np.average(df[star_col], weights= df[weight_col])
+    # if higher is better
+    if measure_cutpoints['higher_is_better'].iloc[0] == 1:
+        star_order = range(1,5)
+        star_color = {1:'orange',
+            2:'yellow',
+            3:'yellowgreen',
+            4:'green'}
+    else:
+        star_order = range(5,1,-1)
+        star_color = {2:'orange',
+            3:'yellow',
+            4:'yellowgreen',
+            5:'green'}
+        
+    #show graph
+    fig = go.Figure()
+
+    for star in star_order:
+        #filter to specific star
+        star_cutpoints = measure_cutpoints[measure_cutpoints['star'] == star]
+        
+        #set up cutpoints to create 0.5 difference between the year of the cutpoint
+        newest = star_cutpoints[star_cutpoints['year'] == star_cutpoints['year'].max()]
+        newest['year'] = newest['year'] + 1
+        star_cutpoints = pd.concat([star_cutpoints, newest])
+        star_cutpoints['year'] = star_cutpoints['year'] - 0.5
+        
+        #add line for star cut points and fill the boundary
+        fig.add_trace(go.Scatter(x=star_cutpoints['year'], y=star_cutpoints['upper'],
+                        mode='lines', line=dict(shape='vh', dash='dash', color=star_color[star]),
+                        fill='tonexty', name=str(star) + ' star',
+                        hovertemplate='Upper bound: %{y}')
+                        )
+
+    #line graph of the contract's measure scores
+    fig.add_trace(go.Scatter(x=df_contract_measure['year'], y=df_contract_measure['score'],
+                        mode='lines+markers', line=dict(color='darkblue', width=4),
+                        marker=dict(size=12), name='Measure score',
+                        hovertemplate='Year: %{x}<br>' +
+                        'Score: %{y}')
+                        )
     
-    #perform rounding to nearest 0.5
-    rounded_star = round(raw_star * 2) / 2
+    #predicted scores of the contract and measure, from every prediction year that has a file
+    pred_x, pred_y = [], []
+    for pred_year in prediction_years():
+        pred_score = prediction_store(pred_year).get(contract, measure)
+        #the contract/measure cell could be missing or null
+        if not np.isnan(pred_score):
+            pred_x.append(pred_year)
+            pred_y.append(pred_score)
+
+    if pred_x:
+        #line graph of the contract's predicted measure scores
+        fig.add_trace(go.Scatter(x=pred_x, y=pred_y,
+                            mode='lines+markers', line=dict(color='cornflowerblue', width=4),
+                            marker=dict(size=10), name='Predicated score',
+                            hovertemplate='Year: %{x}<br>' +
+                            'Predicted Score: %{y}')
+                            )
+    else:
+        st.markdown("No predicted score available for selected contract and measure.")
+        
+    #add title                  
+    fig.update_layout(
+        title="Historical Trend for " + measure,
+        xaxis_title="Year",
+        yaxis_title="Measure Score"
+    )
+
+    with profiler.span('render trend chart'):
+        st.plotly_chart(fig)
     
-    return raw_star, rounded_star
+    show_profile(profiler, st, "Profiling: trend")
 
 ### start of page for the Star Rating Explorer (treemap)
 if st.session_state.page == 'Star Rating Explorer':
+    with profiler.span('imports'):
+        import plotly.graph_objects as go
+        from cms_stars.filter_index import PLAN_TYPES, QUARTILES, explorer_index
+        from cms_stars.states import state_enrollment
+        from cms_stars.treemap import explorer_treemap
+    
     st.markdown("""Every year, CMS rates Part C and Part D health plan contracts on a 5 star quality rating system. Higher rated plans are more attractive to patients and can lead to increased enrollment and plans that receive at least 4 stars receive additional quality bonus payments from Medicare, so there is strong financial incensive for a health plant to improve their star rating.
     """)
     
@@ -187,62 +389,51 @@ if st.session_state.page == 'Star Rating Explorer':
     #sidebar text
     st.sidebar.title("Filters")
 
-    df = load_data("data/visualization_data.csv")
+    data_url = "data/visualization_data.csv"
+    
+    #sparse state enrollment and row positions for every filter combination, built once per dataset version
+    with profiler.span('filter index'):
+        store = state_enrollment(data_url)
+        index = explorer_index(data_url)
+    states = store.states
     
-    min_year = int(df['year'].min())
-    max_year = int(df['year'].max())
+    min_year = int(min(index.postings['year']))
+    max_year = int(max(index.postings['year']))
     
     #pick the year
     year = st.sidebar.slider("Year", min_value = min_year, max_value = max_year, value = max_year,
         help="Select the year you want to view the Star Ratings for.")
         
     #pick the plan type
-    plan_type = st.sidebar.selectbox('Plan Type', ['MA-PD', 'MA only', 'PDP', 'All'], index=3, key='1',
+    plan_type = st.sidebar.selectbox('Plan Type', list(PLAN_TYPES) + ['All'], index=3, key='1',
         help="Select the type of plans you want to view and compare.")
         
     states_list = ['All']
-    states_list.extend(df.columns[13:68])
+    states_list.extend(states)
     
     #pick the state
     state = st.sidebar.selectbox('State', states_list, index=0, key='3',
         help="Select the state to view only contracts with enrollment in that state.")    
         
     #pick the quartile of enrollment
-    quartile = st.sidebar.selectbox('Enrollment size quartile', ['Top 25%', '50-75%', '25-50%', 'Bottom 25%', 'All'], index=0, key='2',
+    quartile = st.sidebar.selectbox('Enrollment size quartile', list(QUARTILES), index=0, key='2',
         help="Select the quartile (25% range) of health plan contracts to view and compare based on enrollment size.")
 
-        
-    #apply filters
-    df_filtered = df[df['year'] == year]
-    
-    if plan_type !='All':
-        if plan_type =='MA-PD':
-            df_filtered = df_filtered[(df_filtered['has_part_c'] == 1) & (df_filtered['has_part_d'] == 1)]
-        elif plan_type =='MA only':
-            df_filtered = df_filtered[(df_filtered['has_part_c'] == 1) & (df_filtered['has_part_d'] == 0)]
-        elif plan_type =='PDP':
-            df_filtered = df_filtered[(df_filtered['has_part_c'] == 0) & (df_filtered['has_part_d'] == 1)]
-    
-    #if state is selected, filter list and also change the enrollment size to size within the selected state
-    if state != 'All':
-        df_filtered = df_filtered[df_filtered[state] > 0]
-        size = state
-    else:
-        size = 'total_enrollment'
-    
-    which_q = {'Top 25%': [3],
-                '50-75%': [2],
-                '25-50%': [1],
-                'Bottom 25%': [0],
-                'All': [0,1,2,3]}
-
-    df_filtered = df_filtered.loc[pd.qcut(df_filtered[size], q=4, labels=[0,1,2,3]).isin(which_q[quartile])]
+    #fold small contracts into one box per parent organization
+    fold = st.sidebar.checkbox('Group small contracts', False, key='fold',
+        help="Show the contracts of each parent organization that are too small to see as one 'Other contracts' box.")
+    min_share = None
+    if fold:
+        min_share = st.sidebar.slider('Group contracts below (% of enrollment shown)', min_value=0.01, max_value=1.0,
+            value=0.1, step=0.01, key='fold_share') / 100
 
-    #make sure there are no 0s for the Total enrollment which is needed for the treemap to draw boxes
-    df_filtered = df_filtered[df_filtered[size] != 0]
+    #the figure of each filter combination is built once and shared by every session
+    #the index already excludes contracts without enrollment (in the selected state)
+    with profiler.span('treemap figure'):
+        fig = explorer_treemap(data_url, year, plan_type, state, quartile, min_share)
 
     #show treemap visualization
-    show_treemap(df_filtered, size)
+    show_treemap(fig)
     
     #info to understand the visualization
     st.markdown(
@@ -254,6 +445,7 @@ if st.session_state.page == 'Star Rating Explorer':
     - Each contract is organized under their parent organization
       - The color and size of the parent organization's box  will reflect the average color and the sum of enrollment size from contracts under the organization.
       - Hovering over a parent organization will be missing all information besides enrollment number, since those details are not available at the organization level. As a result, the other fields will appear as "?"
+    - With "Group small contracts" checked, a parent organization's contracts below the selected share of the enrollment shown are combined into one "Other contracts" box, colored by their enrollment-weighted average star rating
     - Hovering over the contract will reveal additional details
       - Full name of the contract
       - Marketing name
@@ -263,9 +455,23 @@ if st.session_state.page == 'Star Rating Explorer':
       - Organization type
       - SNP = whether the contract is a Special Needs Plan that is specifically designed to provide targeted care to special needs individuals
 	""")
+
+    #share of each state's enrollment in highly rated contracts, for the selected year and plan type
+    if st.sidebar.checkbox('Show enrollment in 4+ star plans by state', False, key='state_share'):
+        with profiler.span('state shares'):
+            rows = index.rows(year=year, plan_type=plan_type)
+            rating = load_data(data_url, columns=['Rating'])['Rating'].to_numpy()
+            shares = store.share_by_state(rows, rating[rows] >= 4).sort_values(ascending=False)
+        st.subheader("Enrollment in 4+ star plans by state")
+        st.markdown("Share of each state's enrollment in the selected plan type that is in contracts with a star rating of at least 4.")
+        show_state_shares(shares)
     
 ### start of page for Star measure details (2022)
 elif st.session_state.page == 'Star Measure Details (2022)':
+    with profiler.span('imports'):
+        from cms_stars.pdf_search import pdf_search
+        from cms_stars.pdfs import pdf_iframe, pdf_path, pdf_thumbnail, thumbnails_available
+    
     st.markdown("""
     This page allows you to view the detailed documentation of the each measure for the year 2022.
     
@@ -315,25 +521,54 @@ elif st.session_state.page == 'Star Measure Details (2022)':
     }
     
     measures = measure_to_pdf.keys()
+    pdf_to_measure = {pdf: m for m, pdf in measure_to_pdf.items()}
+
+    #full-text search of the PDFs, each result opens the measure at its best matching page
+    query = st.sidebar.text_input("Search the measure PDFs", key='pdf_query',
+        help="Find the measures whose documentation mentions these words.")
+    if query:
+        with profiler.span('pdf search'):
+            search = pdf_search()
+        if search is None:
+            st.sidebar.info("The search index has not been built. Run `python -m cms_stars.pdf_search` to build it.")
+        else:
+            hits = search.search_documents(query, year=2022)
+            hits = hits[hits['file'].isin(pdf_to_measure.keys())]
+            if len(hits) == 0:
+                st.sidebar.write("No matches")
+            for hit in hits.itertuples():
+                st.sidebar.button(f"{pdf_to_measure[hit.file]} (page {hit.page})", key='pdf_hit_' + hit.file,
+                    on_click=open_pdf_page, args=(pdf_to_measure[hit.file], hit.page))
 
     #user selects which measure to look at
-    measure = st.sidebar.radio("Select the measure you want to explore", options=measures, index=0)
+    measure = st.sidebar.radio("Select the measure you want to explore", options=measures, index=0,
+        key='pdf_measure', on_change=clear_pdf_page)
 
     #construct file path for PDF
-    filepath = "measure_pdfs_2022/" + measure_to_pdf[measure]
+    filepath = pdf_path(measure_to_pdf[measure])
+
+    #first page preview while the full document loads, when a PDF renderer is installed
+    if thumbnails_available():
+        with profiler.span('pdf thumbnail'):
+            thumbnail = pdf_thumbnail(filepath)
+        st.image(thumbnail, caption="First page preview")
 
     #display the PDF
-    st.markdown(displayPDF(filepath), unsafe_allow_html=True)
+    with profiler.span('pdf iframe'):
+        pdf_html = displayPDF(filepath, st.session_state.get('pdf_page'))
+    st.markdown(pdf_html, unsafe_allow_html=True)
     
 ### start of page for Correlations dashboard 
 elif st.session_state.page == 'Correlations Dashboard':
+    with profiler.span('imports'):
+        import plotly.graph_objects as go
+        from cms_stars.correlations import correlation_matrices
+    
     st.markdown("""
     This page of shows how a specific measure correlates with additional data sources for the purpose of identifying significant correlations that could be used as predictors in machine learning models. Select the desired measure in the sidebar and then toggle the groups of data sources to show correlation plots.
     
     The Y axis are the selected measure's scores, while the X axis are the additional predictor's values. For predictors only available at the state level, the Y axis is the weighted average of all contracts in each state based on the contract's enrollment size in each state.
     """)
-    df = load_data("data/visualization_data_correlations.csv")
-
     measure_list = ['C-Breast Cancer Screening', 'C-Colorectal Cancer Screening',
        'C-Care for Older Adults - Pain Assessment',
        'C-Osteoporosis Management in Women who had a Fracture',
@@ -382,16 +617,8 @@ elif st.session_state.page == 'Correlations Dashboard':
     
     #filters for census data
     demo_cols = ['american_indian_alaska_native', 'asian', 'black', 'hawaiian_pacific_islander', 'white', 'population']
-    if st.sidebar.checkbox('Show Demographics correlations', False, key = '2'):
-        st.subheader("Demographics correlations")
-        for c in demo_cols:
-            show_scatter(df, c, measure, hover_data)
     
     income_cols = ['personal_income', 'income_per_capita']
-    if st.sidebar.checkbox('Show Income correlations', False, key = '3'):
-        st.subheader("Income correlations")
-        for c in income_cols:
-            show_scatter(df, c, measure, hover_data)
     
     #filters for various disease indicators
     #arthritis
@@ -404,10 +631,6 @@ elif st.session_state.page == 'Correlations Dashboard':
        'Arthritis among adults aged >= 18 years who have diabetes',
        'Arthritis among adults aged >= 18 years',
        'Work limitation due to arthritis among adults aged 18-64 years who have doctor-diagnosed arthritis']
-    if st.sidebar.checkbox('Show Arthritis indicators correlations', False, key = '4'):
-        st.subheader("Arthrtis correlations")
-        for c in arthritis_cols:
-            show_scatter(df, c, measure, hover_data)
             
     #diabetes
     diabetes_cols = ['Hospitalization with diabetes as a listed diagnosis',
@@ -427,10 +650,6 @@ elif st.session_state.page == 'Correlations Dashboard':
        'Prevalence of diagnosed diabetes among adults aged >= 18 years',
        'Dilated eye examination among adults aged >= 18 years with diagnosed diabetes',
        'Pneumococcal vaccination among noninstitutionalized adults aged >= 65 years with diagnosed diabetes']
-    if st.sidebar.checkbox('Show Diabetes indicators correlations', False, key = '5'):
-        st.subheader("Diabetes correlations")
-        for c in diabetes_cols:
-            show_scatter(df, c, measure, hover_data)
     
     #cancer
     cancer_cols=['Invasive cancer of the female breast, incidence',
@@ -439,20 +658,12 @@ elif st.session_state.page == 'Correlations Dashboard':
        'Cancer of the colon and rectum (colorectal), incidence',
        'Mammography use among women aged 50-74 years',
        'Fecal occult blood test, sigmoidoscopy, or colonoscopy among adults aged 50-75 years']
-    if st.sidebar.checkbox('Show Cancer indicators correlations', False, key = '6'):
-        st.subheader("Cancer correlations")
-        for c in cancer_cols:
-            show_scatter(df, c, measure, hover_data)
     
     #kidney disease   
     kidney_cols = ['Mortality with end-stage renal disease',
        'Incidence of treated end-stage renal disease attributed to diabetes',
        'Incidence of treated end-stage renal disease',
        'Prevalence of chronic kidney disease among adults aged >= 18 years']
-    if st.sidebar.checkbox('Show Kidney Disease indicators correlations', False, key = '7'):
-        st.subheader("Kidney disease correlations")
-        for c in kidney_cols:
-            show_scatter(df, c, measure, hover_data)
     
     #cardiovascular disease
     cardio_cols = ['Hospitalization for heart failure among Medicare-eligible persons aged >= 65 years',
@@ -471,24 +682,43 @@ elif st.session_state.page == 'Correlations Dashboard':
        'Pneumococcal vaccination among noninstitutionalized adults aged 18-64 years with a history of coronary heart disease',
        'Pneumococcal vaccination among noninstitutionalized adults aged >= 65 years with a history of coronary heart disease',
        'Awareness of high blood pressure among adults aged >= 18 years']
-    if st.sidebar.checkbox('Show Cardiovascular Disease indicators correlations', False, key = '8'):
-        st.subheader("Cardiovascular disease correlations")
-        for c in cardio_cols:
-            show_scatter(df, c, measure, hover_data)
     
     #osteoporosis
     osteo_cols = ['Osteoporosis-All Females', 'Osteoporosis-Females 65 and older']
-    if st.sidebar.checkbox('Show Osteoporosis correlations', False, key = '9'):
-        st.subheader("Osteoporosis correlations")
-        for c in osteo_cols:
-            show_scatter(df, c, measure, hover_data)
     
     #annual flu vaccination
     flu_cols = ['seasonal influenca vaccine coverage for 65 and older']
-    if st.sidebar.checkbox('Show Flu vaccine coverage correlations', False, key = '10'):
-        st.subheader("Flu vaccine coverage correlations")
-        for c in flu_cols:
-            show_scatter(df, c, measure, hover_data)
+
+    #groups of predictors: (checkbox label, checkbox key, subheader, columns)
+    predictor_groups = [
+        ('Show Demographics correlations', '2', "Demographics correlations", demo_cols),
+        ('Show Income correlations', '3', "Income correlations", income_cols),
+        ('Show Arthritis indicators correlations', '4', "Arthrtis correlations", arthritis_cols),
+        ('Show Diabetes indicators correlations', '5', "Diabetes correlations", diabetes_cols),
+        ('Show Cancer indicators correlations', '6', "Cancer correlations", cancer_cols),
+        ('Show Kidney Disease indicators correlations', '7', "Kidney disease correlations", kidney_cols),
+        ('Show Cardiovascular Disease indicators correlations', '8', "Cardiovascular disease correlations", cardio_cols),
+        ('Show Osteoporosis correlations', '9', "Osteoporosis correlations", osteo_cols),
+        ('Show Flu vaccine coverage correlations', '10', "Flu vaccine coverage correlations", flu_cols)
+    ]
+
+    #correlations of every measure with every predictor, computed once per dataset version
+    correlations_url = "data/visualization_data_correlations.csv"
+    all_predictors = [c for g in predictor_groups for c in g[3]]
+    with profiler.span('correlation matrices'):
+        correlations = correlation_matrices(correlations_url, measure_list, all_predictors)
+
+    st.subheader("Strongest predictors")
+    st.markdown("Predictors ranked by the absolute Spearman correlation with the selected measure. P-values are adjusted for testing all predictors (Benjamini-Hochberg).")
+    with profiler.span('strongest predictors'):
+        show_strongest_predictors(correlations, measure)
+    st.markdown("""---""")
+
+    for label, key, subheader, cols in predictor_groups:
+        if st.sidebar.checkbox(label, False, key=key):
+            st.subheader(subheader)
+            with profiler.span(subheader):
+                show_scatter_group(correlations_url, cols, measure, hover_data, correlations, key)
 
     #disenrollment reasons
     reason_cols = ['Problems Getting Needed Care, Coverage, and Cost Information',
@@ -498,68 +728,74 @@ elif st.session_state.page == 'Correlations Dashboard':
        'Problems with Prescription Drug Benefits and Coverage']
     if st.sidebar.checkbox('Show Disenrollment Reasons correlations', False, key = '11'):
         st.subheader("Disenrollment reasons correlations")
-        df_reasons = load_data("data/visualization_data_correlations_disenrollment.csv")
-        for c in reason_cols:
-            show_scatter(df_reasons, c, measure, ['year', 'contract_id'])
+        reasons_url = "data/visualization_data_correlations_disenrollment.csv"
+        reason_measures = [m for m in measure_list if m in dataset_columns(reasons_url)]
+        if measure in reason_measures:
+            with profiler.span('disenrollment correlation matrices'):
+                reason_correlations = correlation_matrices(reasons_url, reason_measures, reason_cols)
+            show_scatter_group(reasons_url, reason_cols, measure, ['year', 'contract_id'], reason_correlations, '11')
+        else:
+            st.info("Disenrollment reasons are not available for this measure.")
 
 ### start of page for Contract Star Details
 elif st.session_state.page == 'Contract Star Details':
-    df = load_data("data/visualization_data_contract_details.csv")
-    df_cutpoints = load_data("data/visualization_data_cutpoints.csv")
-    
-    min_year = int(df['year'].min())
-    max_year = int(df['year'].max())
+    with profiler.span('imports'):
+        import plotly.graph_objects as go
+        from cms_stars.cutpoints import cutpoint_index
+        from cms_stars.drift import DRAWS, cutpoint_drift, star_probabilities
+        from cms_stars.filter_index import PLAN_TYPES, filter_index
+        from cms_stars.predictions import prediction_store, prediction_years
+        from cms_stars.report import (STAR_TYPE_NAMES, contract_measures, improvement_plans, measure_tables,
+                                      planner_star_type, probability_tables, recommendations, star_results)
+        from cms_stars.simulation import StarSimulation
+        from cms_stars.stars import star_table
+    
+    details_url = "data/visualization_data_contract_details.csv"
+    cutpoints_url = "data/visualization_data_cutpoints.csv"
+    with profiler.span('load data'):
+        df = load_data(details_url)
+        df_cutpoints = load_data(cutpoints_url)
+    with profiler.span('cut point index'):
+        cut_index = cutpoint_index(cutpoints_url)
+    
+    #row positions for each year, parent org, plan type, contract and measure, built once per dataset version
+    with profiler.span('filter index'):
+        index = filter_index(details_url, ['year', 'parent_org_name', 'contract_id', 'measure'])
+    
+    min_year = int(min(index.postings['year']))
+    max_year = int(max(index.postings['year']))
     #pick the year
     year = st.sidebar.slider("Year", min_value = min_year, max_value = max_year, value=max_year,
         help="Select the year you want to view the Star Ratings for.")
     
-    df_filtered = df[df['year'] == year]
-    
     #filter contracts by parent org
     parent_list = ['All']
-    parent_list.extend(df_filtered['parent_org_name'].unique())
+    parent_list.extend(index.values('parent_org_name', year=year))
     
     parent = st.sidebar.selectbox('Parent Organization', parent_list, index=0, key='1',
         help="Filter contract selection by parent organization.")
-    
-    if parent != "All":
-        df_filtered = df_filtered[df_filtered['parent_org_name'] == parent]
-    
 
     #pick the plan type
-    plan_type = st.sidebar.selectbox('Plan Type', ['MA-PD', 'MA only', 'PDP', 'All'], index=3, key='100',
+    plan_type = st.sidebar.selectbox('Plan Type', list(PLAN_TYPES) + ['All'], index=3, key='100',
         help="Select the type of plans you want to view and compare.")
     
-    if plan_type !='All':
-        if plan_type =='MA-PD':
-            df_filtered = df_filtered[(df_filtered['has_part_c'] == 1) & (df_filtered['has_part_d'] == 1)]
-        elif plan_type =='MA only':
-            df_filtered = df_filtered[(df_filtered['has_part_c'] == 1) & (df_filtered['has_part_d'] == 0)]
-        elif plan_type =='PDP':
-            df_filtered = df_filtered[(df_filtered['has_part_c'] == 0) & (df_filtered['has_part_d'] == 1)]
+    df_filtered = df.iloc[index.rows(year=year, parent_org_name=parent, plan_type=plan_type)]
     
     #select contract
     contracts = df_filtered[['contract_id','contract_name']].drop_duplicates()
-    contracts_list = contracts['contract_id'] + ' - ' + contracts['contract_name']
+    contracts_list = contracts['contract_id'].astype(str) + ' - ' + contracts['contract_name'].astype(str)
     
     select_contract = st.sidebar.selectbox('Select Contract', contracts_list, key='3', index=0,
         help="Select the contract.")
     
     contract = select_contract.split(' - ')[0]
-    df_filtered = df_filtered[df_filtered['contract_id'] == contract]
+    df_filtered = df.iloc[index.rows(year=year, contract_id=contract)]
     
     
-    #select measure
+    #measures of the simulation and trend panels
     #only allow Part C/D measures if contract has that part
-    if (df_filtered['has_part_c'].iloc[0] == 1) and (df_filtered['has_part_d'].iloc[0] == 0):
-        measure_list = df_filtered[df_filtered['is_part_c'] == 1]['measure'].unique()
-    elif (df_filtered['has_part_c'].iloc[0] == 0) and (df_filtered['has_part_d'].iloc[0] == 1):
-        measure_list = df_filtered[df_filtered['is_part_d'] == 1]['measure'].unique()
-    else:
-        measure_list = df_filtered['measure'].unique()
+    measure_list = contract_measures(df_filtered)
     
-    measure = st.sidebar.selectbox('Select Measure to View Trends and for Simulations', measure_list, key='4', index=0,
-        help="Select the measure to view historical trends on. The selected measure can also have its measure star altered to simulate changes to star rating")
     
     #info about the contract
     st.subheader("Display CMS measure details for " + select_contract)
@@ -599,8 +835,6 @@ elif st.session_state.page == 'Contract Star Details':
     # Inject CSS with Markdown
     st.markdown(hide_table_row_index, unsafe_allow_html=True)
     
-    cols = ['domain_id', 'domain_name', 'measure', 'score', 'star']
-    
     ### display Part C/D measures if the plan type has the corresponding part
     st.subheader("Measure Performance for Selected Contract and Year")
     st.markdown("""
@@ -611,26 +845,14 @@ elif st.session_state.page == 'Contract Star Details':
     """)
     st.markdown("**Note:** It is possible for the selected contract to not receive a score for one or more measures, in which case N/A will be displayed")
     
-    if df_filtered['has_part_c'].iloc[0] == 1:
-        st.subheader("Part C measures")
-        df_c = df_filtered[df_filtered['is_part_c'] == 1]
-        df_c = df_c[cols].sort_values(by='domain_id')
-        
-        #show each domain's measures
-        for d in df_c['domain_id'].unique():
-            df_domain = df_c[df_c['domain_id'] == d]
-            st.markdown("Domain " + d + " - " + df_domain['domain_name'].iloc[0])
-            show_measures_table(df_domain[['measure', 'score', 'star']])
-    if df_filtered['has_part_d'].iloc[0] == 1:
-        st.subheader("Part D measures")
-        df_d = df_filtered[df_filtered['is_part_d'] == 1]
-        df_d = df_d[cols].sort_values(by='domain_id')
-
-        #show each domain's measures
-        for d in df_d['domain_id'].unique():
-            df_domain = df_d[df_d['domain_id'] == d]
-            st.markdown("Domain " + d + " - " + df_domain['domain_name'].iloc[0])
-            show_measures_table(df_domain[['measure', 'score', 'star']])
+    #show each domain's measures, under the heading of its part
+    current_part = None
+    for part, domain, table in measure_tables(df_filtered):
+        if part != current_part:
+            st.subheader(part + " measures")
+            current_part = part
+        st.markdown(domain)
+        show_measures_table(table)
     
     ### display recommended measures to focus on for improving star rating
     st.subheader("Recommendations: Top measures to focus on")
@@ -654,103 +876,19 @@ elif st.session_state.page == 'Contract Star Details':
       - Measures related to patient experience (comes from CAHPS surveys) rely on significance testing in addition to cut points when assigning stars, so it is possible for the score to be outside the cut points of the assigned star, resulting in over 100% or negative penetration
     """)
     
-    #filter out measures not scored (if no score, we cannot know if it is worth recommending)
-    recommended = df_filtered.dropna(subset='score')
-    #filter to measures with less than 5 stars
-    recommended = recommended[recommended['star'] < 5]
-    #sort highest weighted measures to the top then sort highest penetration to the top
-    recommended = recommended.sort_values(by=['weight', 'penetration'], ascending=False)
-    
     #display recommendations
-    show_recommendations(recommended[['measure', 'score', 'star', 'weight', 'lower', 'upper','penetration']])
+    with profiler.span('recommendations'):
+        show_recommendations(recommendations(df_filtered, cut_index))
     
+    ### cheapest combination of measure improvements to reach each star
+    st.subheader("Improvement Planner: Least effort path to each star")
     
-    ### allow simulation for how changes in specific measure stars could impact overall star rating
+    #plan for the overall star if the contract has both parts, otherwise for its summary star
+    planner_type = planner_star_type(df_filtered)
     
-    st.subheader("Simulations: See how specific measure changes impact overall and summary star")
-    st.markdown("""
-    - Choose the measure to add to the simulation from the sidebar
-    - Use the number input to select the desired star
-    - Click Add Measure to Simulation to store the modified measure star and impact the simulated calculations
-    """)
-    
-    #select the star value to simulate
-    simulate_value = st.number_input("Set Selected Measure's Star to: ", min_value=1, max_value=5, value=5, key='Simulated value')
-    
-    #confirm and store the star value
-    st.button('Add Measure to Simulation', on_click=update_star, kwargs={'measure':measure, 'star':simulate_value}, key='Store simulated value')
-    
-    
-    # display all currently simulated measures
-    st.markdown("**Simulating the following measure changes**")
-    
-    if len(st.session_state.measures.keys()) == 0:
-        st.markdown("No measure changes currently selected")
-    else:
-        for key in st.session_state.measures.keys():
-            message = key + " = " + str(st.session_state.measures[key])
-            st.markdown(message)
-    
-    #clear and reset all simulated values
-    st.button('Clear and Reset Simulated Measures', on_click=clear_simulation, key='Reset simulated value')
-    
-    #calculate simulated  star rating
-    st.markdown("**Calculations**")
-    
-    sim_df = create_simulated_measures_df(df_filtered)
-    
-    #create pandas df of results
-    list_df_results = []
-    
-    #add a row for each star type
-    if np.isnan(single_contract['part_c_star']) == False:
-        raw, rounded = overall_summary_star(sim_df, 'part_c')
-        tmp_result_df = pd.DataFrame({'Star Type': ['Part C Summary Star Rating'], 'Rounded': [rounded], 'Raw': [raw], 'Actual':[single_contract['part_c_star']]})
-        list_df_results.append(tmp_result_df)
-        
-    if np.isnan(single_contract['part_d_star']) == False:
-        raw, rounded = overall_summary_star(sim_df, 'part_d')
-        tmp_result_df = pd.DataFrame({'Star Type': ['Part D Summary Star Rating'], 'Rounded': [rounded], 'Raw': [raw], 'Actual':[single_contract['part_d_star']]})
-        list_df_results.append(tmp_result_df)
-        
-    if np.isnan(single_contract['overall_star']) == False:
-        raw, rounded = overall_summary_star(sim_df, 'overall')
-        tmp_result_df = pd.DataFrame({'Star Type': ['Overall Star Rating'], 'Rounded': [rounded], 'Raw': [raw], 'Actual':[single_contract['overall_star']]})
-        list_df_results.append(tmp_result_df)
-    
-    #put the df together, and reset index to get around error with the styler
-    if len(list_df_results) > 0:
-        calc_result_df = pd.concat(list_df_results)
-        calc_result_df = calc_result_df.reset_index(drop=True)
-        show_star_results(calc_result_df)
-        
-        st.markdown("""
-        **Legend**
-        - Rounded = raw star rounded to the nearest 0.5 star
-        - Raw = unrounded weighted average of individual measure stars using all available measures and then overridden by the simulated measure stars as specified
-        - Actual = actual star assigned by CMS for the selected contract and year
-        """)
-        
-        st.markdown("""
-        The actual star ratings are adjusted with a reward factor that and a Categorical Adjustment Index (CAI) after the weighted average of measure stars. The reward factor can increase the star as a reward for having both high and stable relative performance. The CAI add or subtract from the star rating to adjust for the within-contract disparity in performance for Low Income Subsidy/Dual Eligible and disabled beneficiaries.
-        """)
-        
-        st.markdown("The above calculations do not take into account these adjustments and therefore can be different from the actual Star Rating.")
-    else:
-        st.markdown("Plan does not have enough data to receive overall and summary stars")
-    
-    
-
-    
-    
-    ##### measure specific info
-    df_contract_measure = df[(df['contract_id'] == contract) & (df['measure'] == measure)]
-    
-    ### display historical trend and cut points boundary for selected measure
-    st.subheader("Measure Historical Trend")
-    st.markdown("Display how the current contract performed on the selected measure over the past few years.")
-    st.markdown("""
-    Also includes the predicted 2023 measure score created using machine learning models. The predicted score appears in a lighter shade of blue and can be compared against the actual 2023 measure score in dark blue.
+    st.markdown(f"""For each {STAR_TYPE_NAMES[planner_type]} that can be reached, this is the combination of measure star increases that gets there with the least effort.
+    The effort of raising a measure is the distance from its score to the cut point of the new star, relative to the distance between its 2 star and 5 star cut points (so taking a measure from the 2 star cut point to the 5 star cut point costs 1).
+    Measures without a score are not considered.
     """)
     
     #use PDP cut points if contract has no part C but has part D
@@ -759,77 +897,41 @@ elif st.session_state.page == 'Contract Star Details':
     else:
         use_PDP = 0
     
-    measure_cutpoints = df_cutpoints[(df_cutpoints['measure'] == measure) & (df_cutpoints['is_PDP'] == use_PDP)]
+    with profiler.span('improvement plans'):
+        plans_df = improvement_plans(df_filtered, cut_index, year, planner_type)
     
-    # if higher is better
-    if measure_cutpoints['higher_is_better'].iloc[0] == 1:
-        star_order = range(1,5)
-        star_color = {1:'orange',
-            2:'yellow',
-            3:'yellowgreen',
-            4:'green'}
+    if len(plans_df) > 0:
+        show_plans(plans_df)
     else:
-        star_order = range(5,1,-1)
-        star_color = {2:'orange',
-            3:'yellow',
-            4:'yellowgreen',
-            5:'green'}
-        
-    #show graph
-    fig = go.Figure()
-
-    for star in star_order:
-        #filter to specific star
-        star_cutpoints = measure_cutpoints[measure_cutpoints['star'] == star]
-        
-        #set up cutpoints to create 0.5 difference between the year of the cutpoint
-        newest = star_cutpoints[star_cutpoints['year'] == star_cutpoints['year'].max()]
-        newest['year'] = newest['year'] + 1
-        star_cutpoints = pd.concat([star_cutpoints, newest])
-        star_cutpoints['year'] = star_cutpoints['year'] - 0.5
-        
-        #add line for star cut points and fill the boundary
-        fig.add_trace(go.Scatter(x=star_cutpoints['year'], y=star_cutpoints['upper'],
-                        mode='lines', line=dict(shape='vh', dash='dash', color=star_color[star]),
-                        fill='tonexty', name=str(star) + ' star',
-                        hovertemplate='Upper bound: %{y}')
-                        )
-
-    #line graph of the contract's measure scores
-    fig.add_trace(go.Scatter(x=df_contract_measure['year'], y=df_contract_measure['score'],
-                        mode='lines+markers', line=dict(color='darkblue', width=4),
-                        marker=dict(size=12), name='Measure score',
-                        hovertemplate='Year: %{x}<br>' +
-                        'Score: %{y}')
-                        )
+        st.markdown("No measure improvements can raise the star rating for the selected contract.")
     
-    df_pred = pd.read_csv("data/Complete_2023_pred.csv", index_col=0)
-    #st.table(df_pred)\
     
-    #use try catch since there are cases where the contract does not have a cell for the measure
-    try:
-        #also check if NaN since the contract/measure cell could be null
-        if np.isnan(df_pred.loc[contract, measure]) == False:
-            pred_x= [2023]
-            pred_y= [df_pred.loc[contract, measure]]
-            
-            #line graph of the contract's predicted 2023 measure score
-            fig.add_trace(go.Scatter(x=pred_x, y=pred_y,
-                                mode='lines+markers', line=dict(color='cornflowerblue', width=4),
-                                marker=dict(size=10), name='Predicated score',
-                                hovertemplate='Year: %{x}<br>' +
-                                'Predicted Score: %{y}')
-                                )
+    show_simulation(df_filtered, measure_list, contract, year, details_url)
+    
+    ### probabilities of next year's stars, from the predicted scores and how the cut points could move
+    pred_year = year + 1
+    store = prediction_store(pred_year)
+    if store is not None:
+        st.subheader(f"Star Probabilities for {pred_year}")
+        st.markdown(f"""The chance of each star in {pred_year} given the contract's predicted measure scores, from {DRAWS:,} simulations of how the cut points could move.
+        The year-over-year movement of each measure's cut points is estimated from their history. Measures without a predicted score keep their current star.
+        """)
+        predicted = store.lookup(df_filtered['contract_id'].astype(str), df_filtered['measure'].astype(str))
+        if np.isnan(predicted).all():
+            st.markdown("No predicted scores available for selected contract.")
         else:
-            st.markdown("No predicted score available for selected contract and measure.")
-    except KeyError:
-        st.markdown("No predicted score available for selected contract and measure.")
-        
-    #add title                  
-    fig.update_layout(
-        title="Historical Trend for " + measure,
-        xaxis_title="Year",
-        yaxis_title="Measure Score"
-    )
+            with profiler.span('star probabilities'):
+                measure_probs, summary_probs = get_star_probabilities(df_filtered, predicted, cutpoints_url, year, pred_year, (contract, year))
+            probs_df, measure_probs_df = probability_tables(measure_probs, summary_probs)
+            show_star_probabilities(probs_df)
+            
+            st.markdown("**Measure star probabilities**")
+            show_star_probabilities(measure_probs_df)
+
+    show_trend(df, index, df_cutpoints, contract, measure_list, use_PDP)
+
+### once the first page is shown, warm up the other pages' modules and data in the background
+warm_up(page)
 
-    st.plotly_chart(fig)
\ No newline at end of file
+### timings of this rerun's stages, when profiling is turned on
+show_profile(profiler, st.sidebar)
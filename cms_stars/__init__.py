@@ -0,0 +1,6 @@
+"""
+Data and computation layer for the CMS Star Ratings Streamlit app.
+
+Everything in this package is independent of the Streamlit widgets in app.py so that the same
+functions can be shared between the interactive pages and offline scripts.
+"""
@@ -0,0 +1,321 @@
+"""
+Benchmarks of each page's data path on synthetic data at several scales.
+
+The synthetic datasets have the schemas of the files in data/ and are made by repeating the real rows:
+contract datasets get scale times as many contracts (new contract ids, scores jittered around the
+originals) and the state-level correlations dataset gets scale times as many state-year rows (the copies
+get new years). Everything runs in memory on the pipeline classes the app builds through derived(), so
+the timings cover the data path only: figures are built but never rendered.
+
+    python -m cms_stars.benchmark                      # 1x and 10x, compared with the baseline
+    python -m cms_stars.benchmark --scales 1 10 100 --pages explorer
+    python -m cms_stars.benchmark --save-baseline      # make these results the new baseline
+
+100x is opt-in: the contract page then works on about 16 million detail rows and needs more than 6 GB of
+memory. Each page's datasets are made only for its own benchmarks and dropped before the next page.
+
+Results are written as JSON (benchmarks/latest.json) after every page, so the pages and scales that
+finished are kept when a later one fails. When a baseline exists (benchmarks/baseline.json), every
+benchmark slower than the baseline by more than the tolerance is reported as a regression and the command
+exits with status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from cms_stars.correlations import CorrelationMatrices
+from cms_stars.cutpoints import CutPointIndex
+from cms_stars.data import load_data
+from cms_stars.filter_index import ExplorerIndex, FilterIndex
+from cms_stars.report import recommendations
+from cms_stars.schema import is_state_column
+from cms_stars.simulation import StarSimulation
+from cms_stars.states import StateEnrollment
+from cms_stars.stars import summary_star_table
+from cms_stars.treemap import treemap_figure
+
+ENROLLMENT_URL = "data/visualization_data.csv"
+DETAILS_URL = "data/visualization_data_contract_details.csv"
+CUTPOINTS_URL = "data/visualization_data_cutpoints.csv"
+CORRELATIONS_URL = "data/visualization_data_correlations.csv"
+
+#100x is opt-in (--scales 1 10 100), see above
+SCALES = (1, 10)
+
+BASELINE_PATH = 'benchmarks/baseline.json'
+OUTPUT_PATH = 'benchmarks/latest.json'
+
+RESULTS_VERSION = 1
+
+#a benchmark is a regression when it is this many times slower than the baseline
+TOLERANCE = 1.5
+
+#timing runs of each benchmark, the best and median are reported
+REPEAT = 5
+
+#share of the enrollment shown below which contracts are folded in the folded treemap benchmark
+FOLD_SHARE = 0.001
+
+#size of the jitter added to the scores of repeated rows, relative to each column's standard deviation
+JITTER = 0.1
+
+
+def _tile(series, scale):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(np.tile(series.cat.codes.to_numpy(), scale), series.cat.categories)
+    return np.tile(series.to_numpy(), scale)
+
+
+def _relabel(series, scale):
+    #copy k of a label gets the suffix _k, the first copy keeps the original labels
+    series = series.astype(str).astype('category')
+    categories = series.cat.categories
+    labels = list(categories) + [f"{c}_{k}" for k in range(1, scale) for c in categories]
+    codes = series.cat.codes.to_numpy().astype(np.int64)
+    codes = np.concatenate([codes + k * len(categories) for k in range(scale)])
+    return pd.Categorical.from_codes(codes, labels)
+
+
+def synthetic(df, scale, key, jitter_cols=(), seed=0):
+    """
+    Given a real dataset df, return a synthetic one with scale times as many rows and the same column types.
+    key is the column that tells the copies apart: a text column (e.g. contract_id) gets new labels in
+    every copy, a number column (e.g. year) is shifted past its range in every copy. jitter_cols get normal
+    noise in every copy but the first.
+    """
+    if scale == 1:
+        return df
+    data = {c: _tile(df[c], scale) for c in df.columns}
+    if pd.api.types.is_numeric_dtype(df[key]):
+        values = df[key].to_numpy()
+        span = values.max() - values.min() + 1
+        data[key] = np.concatenate([values + k * span for k in range(scale)]).astype(values.dtype)
+    else:
+        data[key] = _relabel(df[key], scale)
+
+    rng = np.random.default_rng(seed)
+    n = len(df)
+    for c in jitter_cols:
+        #np.tile made a new array, so the noise can be added in place
+        values = data[c]
+        #columns without any value get no noise
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            sd = np.nan_to_num(np.nanstd(df[c].to_numpy(dtype=np.float64))) * JITTER
+        values[n:] += rng.normal(0.0, sd, len(values) - n).astype(values.dtype)
+    return pd.DataFrame(data, copy=False)
+
+
+def _synthetic_correlations(scale, seed):
+    correlations = load_data(CORRELATIONS_URL)
+    predictor_cols = [c for c in correlations.columns if c not in ('year', 'state_id')]
+    return synthetic(correlations, scale, 'year', predictor_cols, seed=seed)
+
+
+#dataset -> function of (scale, seed) making it
+DATASETS = {
+    'enrollment': lambda scale, seed: synthetic(load_data(ENROLLMENT_URL), scale, 'contract_id', seed=seed),
+    'details': lambda scale, seed: synthetic(load_data(DETAILS_URL), scale, 'contract_id', ['score'], seed=seed),
+    'correlations': _synthetic_correlations,
+    #cut points are per measure and year, they do not grow with the number of contracts
+    'cutpoints': lambda scale, seed: load_data(CUTPOINTS_URL),
+}
+
+
+def synthetic_datasets(scale, datasets=None, seed=0):
+    """
+    The datasets named in datasets (default: every dataset the benchmarks use) at scale: {name: df}.
+    """
+    return {name: DATASETS[name](scale, seed) for name in datasets or DATASETS}
+
+
+def _sample_contract(details):
+    #the latest year's first contract with both parts
+    year = details['year'].max()
+    both = details[(details['year'] == year) & (details['has_part_c'] == 1) & (details['has_part_d'] == 1)]
+    return year, both['contract_id'].iloc[0]
+
+
+def explorer_benchmarks(data):
+    """
+    Star Rating Explorer: the filter index (every plan type, state and quartile), one filter, the treemap figure.
+    """
+    df = data['enrollment']
+    states = [c for c in df.columns if is_state_column(c)]
+    store = StateEnrollment(df, states)
+    index = ExplorerIndex(df, store)
+    year = int(df['year'].max())
+    df_filtered = df.iloc[index.explorer_rows(year)]
+    return {
+        'state_enrollment': lambda: StateEnrollment(df, states),
+        'explorer_index': lambda: ExplorerIndex(df, store),
+        'explorer_filter': lambda: df.iloc[index.explorer_rows(year, 'MA-PD', 'All', 'Top 25%')],
+        'top_states': lambda: store.top_states(index.explorer_rows(year)),
+        'treemap_figure': lambda: treemap_figure(df_filtered, 'total_enrollment'),
+        'treemap_figure_folded': lambda: treemap_figure(df_filtered, 'total_enrollment', FOLD_SHARE),
+    }
+
+
+def correlations_benchmarks(data):
+    """
+    Correlations Dashboard: Pearson and Spearman correlations of every measure and predictor.
+    """
+    df = data['correlations']
+    measures = [c for c in df.columns if c.startswith(('C-', 'D-'))]
+    predictors = [c for c in df.columns if c not in measures and c not in ('year', 'state_id')]
+    matrices = CorrelationMatrices(df, measures, predictors)
+    return {
+        'correlation_matrices': lambda: CorrelationMatrices(df, measures, predictors),
+        'strongest_predictors': lambda: matrices.strongest_predictors(measures[0]),
+    }
+
+
+def contract_benchmarks(data):
+    """
+    Contract Star Details: the filter index, one contract's rows, its recommendations and a simulation, and
+    the star table of every contract.
+    """
+    df = data['details']
+    columns = ['year', 'parent_org_name', 'contract_id', 'measure']
+    index = FilterIndex(df, columns)
+    cut_index = CutPointIndex(data['cutpoints'])
+    year, contract = _sample_contract(df)
+    df_contract = df.iloc[index.rows(year=year, contract_id=contract)]
+    measure = df_contract['measure'].iloc[0]
+
+    def simulate():
+        sim = StarSimulation(df_contract)
+        sim.set_star(measure, 5)
+        return [sim.result(t) for t in ('part_c', 'part_d', 'overall')]
+
+    return {
+        'contract_index': lambda: FilterIndex(df, columns),
+        'contract_filter': lambda: df.iloc[index.rows(year=year, contract_id=contract)],
+        'recommendations': lambda: recommendations(df_contract, cut_index),
+        'simulation': simulate,
+        'star_table': lambda: summary_star_table(df),
+    }
+
+
+#page -> (dataset it is scaled by, datasets its benchmarks use, its benchmarks)
+PAGES = {
+    'explorer': ('enrollment', ['enrollment'], explorer_benchmarks),
+    'correlations': ('correlations', ['correlations'], correlations_benchmarks),
+    'contract': ('details', ['details', 'cutpoints'], contract_benchmarks),
+}
+
+
+def time_call(fn, repeat=REPEAT):
+    """
+    Best and median seconds per call of fn, over repeat runs of as many calls as fit in about 0.2 seconds.
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    times = np.array(timer.repeat(repeat=repeat, number=number)) / number
+    return float(times.min()), float(np.median(times)), number
+
+
+def run(scales=SCALES, pages=None, repeat=REPEAT, output=None):
+    """
+    Time every benchmark of pages (default: every page) at every scale. Returns a list of result dicts, which
+    are also written to output (if given) after every page.
+    """
+    results = []
+    for scale in scales:
+        for page, (dataset, datasets, build) in PAGES.items():
+            if pages and page not in pages:
+                continue
+            data = synthetic_datasets(scale, datasets)
+            start = time.perf_counter()
+            benchmarks = build(data)
+            setup = time.perf_counter() - start
+            for name, fn in benchmarks.items():
+                best, median, number = time_call(fn, repeat)
+                results.append({'page': page, 'benchmark': name, 'scale': scale, 'rows': len(data[dataset]),
+                                'best_s': best, 'median_s': median, 'calls': number})
+                print(f"{scale:>4}x {page:<13} {name:<22} {best * 1000:>10.2f} ms", file=sys.stderr)
+            print(f"{scale:>4}x {page:<13} {'(setup)':<22} {setup * 1000:>10.2f} ms", file=sys.stderr)
+            del benchmarks, data
+            if output:
+                write_results(results, output)
+    return results
+
+
+def machine_info():
+    """
+    Where the results were measured.
+    """
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'pandas': pd.__version__}
+
+
+def write_results(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'version': RESULTS_VERSION, 'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                   'machine': machine_info(), 'results': results}, f, indent=1)
+
+
+def read_results(path):
+    """
+    The results saved at path, None if there are none (or they were written by another version).
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        saved = json.load(f)
+    return saved if saved.get('version') == RESULTS_VERSION else None
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Given results and saved baseline results, return a df of the benchmarks measured in both with the best
+    time of each, their ratio and whether it is a regression (more than tolerance times slower).
+    """
+    key = ['page', 'benchmark', 'scale']
+    current = pd.DataFrame(results, columns=key + ['best_s'])
+    before = pd.DataFrame(baseline['results'], columns=key + ['best_s'])
+    both = current.merge(before, on=key, suffixes=('', '_baseline'))
+    both['ratio'] = both['best_s'] / both['best_s_baseline']
+    both['regression'] = both['ratio'] > tolerance
+    return both
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each page's data path on synthetic data.")
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES), help="data sizes, as multiples of data/")
+    parser.add_argument('--pages', nargs='+', choices=list(PAGES), help="pages to benchmark (default: all)")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="timing runs of each benchmark")
+    parser.add_argument('--output', default=OUTPUT_PATH, help="where to write the results")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="results to compare with")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="slowdown ratio reported as a regression")
+    parser.add_argument('--save-baseline', action='store_true', help="also write the results as the baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.pages, args.repeat, args.output)
+    print(f"{args.output}: {len(results)} results")
+
+    baseline = read_results(args.baseline)
+    if args.save_baseline:
+        write_results(results, args.baseline)
+        print(f"{args.baseline}: saved as the baseline")
+    elif baseline is not None:
+        comparison = compare(results, baseline, args.tolerance)
+        print(comparison.to_string(index=False, formatters={'ratio': '{:.2f}x'.format}))
+        regressions = comparison[comparison['regression']]
+        if len(regressions):
+            print(f"{len(regressions)} regressions (more than {args.tolerance}x slower than {args.baseline})")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Write columnar, memory-mappable copies of the app's CSV datasets.
+
+    python -m cms_stars.convert            # convert every data/*.csv
+    python -m cms_stars.convert data/visualization_data.csv
+
+Each CSV is parsed once here, typed with its schema (cms_stars/schema.py) and stored as an uncompressed
+Arrow IPC file in data/arrow/. load_data() picks these copies up automatically and falls back to the CSV
+when a copy is missing or older than it.
+"""
+import argparse
+import glob
+import os
+
+import pyarrow as pa
+import pyarrow.ipc
+
+from cms_stars.data import columnar_path
+from cms_stars.schema import read_csv
+
+
+def convert_csv(csv_path):
+    """
+    Convert a single CSV to its columnar copy and return the path written.
+    """
+    #store the declared types so loading the copy needs no conversion
+    frame = read_csv(csv_path)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+
+    out_path = columnar_path(csv_path)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    #write to a temporary file first so a running app never memory-maps a half written file
+    tmp_path = out_path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, out_path)
+
+    return out_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write columnar copies of the app's CSV datasets.")
+    parser.add_argument('csv', nargs='*', help='CSV files to convert (default: every data/*.csv)')
+    args = parser.parse_args(argv)
+
+    paths = args.csv or sorted(glob.glob('data/*.csv'))
+    for csv_path in paths:
+        out_path = convert_csv(csv_path)
+        print(f"{csv_path} -> {out_path} ({os.path.getsize(csv_path):,} -> {os.path.getsize(out_path):,} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Bulk correlation engine for the Correlations Dashboard.
+
+Computes the Pearson and Spearman correlations (with p-values and pairwise complete counts) of every
+measure against every predictor in one vectorized pass, instead of calling scipy's pearsonr/spearmanr for
+each pair. On the float64 columns the dataset is loaded with, results match scipy with missing values
+dropped pairwise (nan_policy='omit'). Ranks are taken on float64 values: columns rounded to float32 on the
+way in would tie values that differ and move the Spearman results, and casting them back does not undo it.
+
+Each column is ranked only once: its values are turned into dense ranks, and the average ranks within the
+rows a pair has in common are then counted from those dense ranks for all pairs at the same time.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from cms_stars.data import derived, load_data
+
+#number of predictors handled together when ranking, bounds memory to rows x measures x chunk
+_CHUNK = 16
+
+
+def _as_matrix(df, cols):
+    #ranked in float64, like scipy
+    return df[list(cols)].to_numpy(dtype=np.float64)
+
+
+def _dense_ranks(values):
+    """
+    Dense rank (0, 1, 2, ... for increasing distinct values) of each entry of each column, -1 for NaN.
+    """
+    ranks = np.full(values.shape, -1, dtype=np.int64)
+    for c in range(values.shape[1]):
+        col = values[:, c]
+        valid = ~np.isnan(col)
+        _, ranks[valid, c] = np.unique(col[valid], return_inverse=True)
+    return ranks
+
+
+def _subset_ranks(dense, mask):
+    """
+    Given dense ranks (rows x k) and a mask (rows x k) of the rows to keep in each column, return the
+    average rank (1 based, ties averaged like scipy.stats.rankdata) of every kept entry within its column's
+    kept rows, NaN elsewhere.
+    """
+    n_rows, k = dense.shape
+    col = np.broadcast_to(np.arange(k), (n_rows, k))
+    key = col * n_rows + np.where(mask, dense, 0)
+    counts = np.bincount(key[mask], minlength=k * n_rows).reshape(k, n_rows)
+    before = np.cumsum(counts, axis=1) - counts
+    ranks = before[col, np.where(mask, dense, 0)] + (counts[col, np.where(mask, dense, 0)] + 1) / 2
+    return np.where(mask, ranks, np.nan)
+
+
+def _pearson_masked(a, b, mask):
+    """
+    Pearson r and count of each column pair of a and b (rows x k each) over the rows in mask.
+    """
+    n = mask.sum(axis=0).astype(np.float64)
+    a = np.where(mask, a, 0.0)
+    b = np.where(mask, b, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = np.where(mask, a - a.sum(axis=0) / n, 0.0)
+        b = np.where(mask, b - b.sum(axis=0) / n, 0.0)
+        r = (a * b).sum(axis=0) / np.sqrt((a * a).sum(axis=0) * (b * b).sum(axis=0))
+    return np.clip(r, -1.0, 1.0), n
+
+
+def _p_values(r, n):
+    """
+    Two-sided p-value of correlations r over n pairs (t-test with n - 2 degrees of freedom, as in scipy).
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dof = n - 2
+        t = r * np.sqrt(dof / ((1.0 - r) * (1.0 + r)))
+        p = 2 * stats.t.sf(np.abs(t), dof)
+    p = np.where(np.abs(r) == 1.0, 0.0, p)
+    return np.where((n > 2) & ~np.isnan(r), p, np.nan)
+
+
+class CorrelationMatrices:
+    """
+    Pearson and Spearman correlations of measures (rows) against predictors (columns). Each attribute is a
+    df indexed by measure with one column per predictor: pearson_r, pearson_p, spearman_r, spearman_p and
+    n (rows where both the measure and the predictor are present).
+    """
+    def __init__(self, df, measures, predictors):
+        measures, predictors = list(measures), list(predictors)
+        Y = _as_matrix(df, measures)
+        X = _as_matrix(df, predictors)
+        My, Mx = ~np.isnan(Y), ~np.isnan(X)
+        Dy, Dx = _dense_ranks(Y), _dense_ranks(X)
+
+        shape = (len(measures), len(predictors))
+        n = np.zeros(shape)
+        pearson = np.zeros(shape)
+        spearman = np.zeros(shape)
+
+        #every (measure, predictor) pair of a chunk of predictors is one column of rows x (measures * chunk)
+        for start in range(0, len(predictors), _CHUNK):
+            cols = slice(start, start + _CHUNK)
+            k = X[:, cols].shape[1]
+            mask = (My[:, :, None] & Mx[:, None, cols]).reshape(len(Y), -1)
+            y = np.repeat(Y, k, axis=1)
+            x = np.tile(X[:, cols], len(measures))
+            r, count = _pearson_masked(y, x, mask)
+            pearson[:, cols] = r.reshape(len(measures), k)
+            n[:, cols] = count.reshape(len(measures), k)
+
+            ry = _subset_ranks(np.repeat(Dy, k, axis=1), mask)
+            rx = _subset_ranks(np.tile(Dx[:, cols], len(measures)), mask)
+            r, _ = _pearson_masked(ry, rx, mask)
+            spearman[:, cols] = r.reshape(len(measures), k)
+
+        frame = lambda values: pd.DataFrame(values, index=measures, columns=predictors)
+        self.n = frame(n)
+        self.pearson_r = frame(pearson)
+        self.pearson_p = frame(_p_values(pearson, n))
+        self.spearman_r = frame(spearman)
+        self.spearman_p = frame(_p_values(spearman, n))
+
+    def pair(self, measure, predictor):
+        """
+        (pearson r, pearson p, spearman r, spearman p, n) of one measure and predictor.
+        """
+        return (self.pearson_r.at[measure, predictor], self.pearson_p.at[measure, predictor],
+                self.spearman_r.at[measure, predictor], self.spearman_p.at[measure, predictor],
+                self.n.at[measure, predictor])
+
+    def strongest_predictors(self, measure, method='spearman', correction='fdr_bh'):
+        """
+        Predictors of measure ranked by absolute correlation, with p-values adjusted for testing every
+        predictor (correction = 'fdr_bh' for Benjamini-Hochberg, 'bonferroni', or None).
+        """
+        r = getattr(self, method + '_r').loc[measure]
+        p = getattr(self, method + '_p').loc[measure]
+        result = pd.DataFrame({'predictor': r.index, 'r': r.to_numpy(), 'p': p.to_numpy(),
+                               'n': self.n.loc[measure].to_numpy()})
+        result['p_adjusted'] = adjust_p_values(result['p'].to_numpy(), correction)
+        result = result.dropna(subset=['r'])
+        return result.reindex(result['r'].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+
+def adjust_p_values(p, correction='fdr_bh'):
+    """
+    Adjust p-values for multiple testing. NaNs are ignored and kept.
+    """
+    p = np.asarray(p, dtype=np.float64)
+    adjusted = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    m = valid.sum()
+    if correction is None or m == 0:
+        return p.copy()
+    pv = p[valid]
+    if correction == 'bonferroni':
+        adjusted[valid] = np.minimum(pv * m, 1.0)
+    elif correction == 'fdr_bh':
+        order = np.argsort(pv)
+        scaled = pv[order] * m / np.arange(1, m + 1)
+        #enforce monotonicity from the largest p-value down
+        scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+        result = np.empty(m)
+        result[order] = np.minimum(scaled, 1.0)
+        adjusted[valid] = result
+    else:
+        raise ValueError(f"Unknown correction: {correction}")
+    return adjusted
+
+
+def _build_correlations(DATA_URL, measures, predictors):
+    df = load_data(DATA_URL, columns=list(measures) + list(predictors))
+    return CorrelationMatrices(df, measures, predictors)
+
+
+def correlation_matrices(DATA_URL, measures, predictors):
+    """
+    CorrelationMatrices of measures against predictors in the dataset at DATA_URL, computed once per
+    dataset version and shared by every session.
+    """
+    return derived(DATA_URL, 'correlations', _build_correlations, DATA_URL, tuple(measures), tuple(predictors))
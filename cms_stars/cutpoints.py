@@ -0,0 +1,144 @@
+"""
+Cut point index: measure star assignment and penetration for whole arrays of scores.
+
+The cut points of every (year, measure, is_PDP) are stored as rows of small matrices, so stars can be
+assigned to any number of contract-measure-year scores in one vectorized call instead of per-row lookups.
+This module is also the single place where penetration (how far a score has moved through its star's cut
+point range) is calculated.
+"""
+import numpy as np
+import pandas as pd
+
+from cms_stars.data import derived, load_data
+
+STARS = [1, 2, 3, 4, 5]
+
+
+def penetration(score, lower, upper, higher_is_better):
+    """
+    Percent of the star's cut point range the score has covered.
+      - higher is better: (score - lower) / (upper - lower) * 100
+      - lower is better: (upper - score) / (upper - lower) * 100
+    Works on scalars and arrays. NaN where the range is empty.
+    """
+    score, lower, upper = (np.asarray(a, dtype=np.float64) for a in (score, lower, upper))
+    higher_is_better = np.asarray(higher_is_better) == 1
+    width = upper - lower
+    covered = np.where(higher_is_better, score - lower, upper - score)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(width != 0, covered / width * 100, np.nan)
+
+
+def use_pdp_cutpoints(has_part_c, has_part_d):
+    """
+    1 where a contract uses the PDP cut points (no Part C but has Part D), 0 otherwise.
+    """
+    return ((np.asarray(has_part_c) == 0) & (np.asarray(has_part_d) == 1)).astype(np.int8)
+
+
+class CutPointIndex:
+    """
+    Cut points of every (year, measure, is_PDP) key.
+      - lower/upper: (keys x 5) bounds of each star
+      - thresholds: (keys x 4) score needed for 2, 3, 4 and 5 stars (lower bound when higher is better,
+        upper bound when lower is better), made monotonic to tolerate inconsistent rows
+      - higher_is_better: (keys,) flag
+    """
+    def __init__(self, df_cutpoints):
+        df = df_cutpoints.assign(measure=df_cutpoints['measure'].astype(str))
+        keys = df[['year', 'measure', 'is_PDP']].drop_duplicates().sort_values(['year', 'measure', 'is_PDP'])
+        self.keys = pd.MultiIndex.from_frame(keys)
+
+        key_id = self.keys.get_indexer(pd.MultiIndex.from_frame(df[['year', 'measure', 'is_PDP']]))
+        star = df['star'].to_numpy().astype(int)
+        self.lower = np.full((len(self.keys), len(STARS)), np.nan)
+        self.upper = np.full((len(self.keys), len(STARS)), np.nan)
+        self.lower[key_id, star - 1] = df['lower'].to_numpy(dtype=np.float64)
+        self.upper[key_id, star - 1] = df['upper'].to_numpy(dtype=np.float64)
+        self.higher_is_better = np.zeros(len(self.keys), dtype=bool)
+        self.higher_is_better[key_id] = df['higher_is_better'].to_numpy() == 1
+
+        hib = self.higher_is_better[:, None]
+        #the score must reach the lower bound of the star (higher is better) or get below its upper bound
+        thresholds = np.where(hib, self.lower[:, 1:], self.upper[:, 1:])
+        self.thresholds = np.where(hib, np.fmax.accumulate(thresholds, axis=1),
+                                   np.fmin.accumulate(thresholds, axis=1))
+
+    def key_ids(self, year, measure, use_PDP):
+        """
+        Row of each (year, measure, use_PDP) in the cut point matrices, -1 when there are no cut points.
+        """
+        lookup = pd.MultiIndex.from_arrays([np.asarray(year).astype(self.keys.levels[0].dtype),
+                                            np.asarray(measure).astype(str),
+                                            np.asarray(use_PDP).astype(self.keys.levels[2].dtype)])
+        return self.keys.get_indexer(lookup)
+
+    def assign_stars(self, year, measure, use_PDP, score):
+        """
+        Measure star of every score (arrays of equal length). NaN for missing scores and measures without
+        cut points. Each star is the number of star thresholds the score has passed plus one.
+        """
+        ids = self.key_ids(year, measure, use_PDP)
+        score = np.asarray(score, dtype=np.float64)
+        thresholds = self.thresholds[ids]
+        hib = self.higher_is_better[ids][:, None]
+        with np.errstate(invalid='ignore'):
+            passed = np.where(hib, score[:, None] >= thresholds, score[:, None] < thresholds)
+        stars = 1.0 + passed.sum(axis=1)
+        stars[(ids < 0) | np.isnan(score)] = np.nan
+        return stars
+
+    def bounds(self, year, measure, use_PDP, star):
+        """
+        Lower and upper cut point of each star (arrays of equal length), NaN when unknown.
+        """
+        ids = self.key_ids(year, measure, use_PDP)
+        star = np.asarray(star, dtype=np.float64)
+        known = (ids >= 0) & ~np.isnan(star)
+        lower = np.full(len(ids), np.nan)
+        upper = np.full(len(ids), np.nan)
+        col = np.where(known, star, 1).astype(int) - 1
+        lower[known] = self.lower[ids[known], col[known]]
+        upper[known] = self.upper[ids[known], col[known]]
+        return lower, upper
+
+    def measure_thresholds(self, year, use_PDP):
+        """
+        {measure: (higher_is_better, thresholds)} of every measure with complete cut points in year.
+        """
+        result = {}
+        for i, (key_year, measure, key_pdp) in enumerate(self.keys):
+            if key_year == year and key_pdp == use_PDP and not np.isnan(self.thresholds[i]).any():
+                result[measure] = (bool(self.higher_is_better[i]), self.thresholds[i])
+        return result
+
+    def score_measures(self, df, star_col='star'):
+        """
+        Given a df of contract measure scores (year, measure, score, has_part_c, has_part_d), return a df with
+        the star, lower, upper, penetration and higher_is_better of every row, from this index's cut points.
+        Pass the name of an existing star column as star_col to keep those stars and only compute the rest;
+        pass None to assign the stars from the scores.
+        """
+        use_PDP = use_pdp_cutpoints(df['has_part_c'], df['has_part_d'])
+        year, measure, score = df['year'].to_numpy(), df['measure'].to_numpy(), df['score'].to_numpy(dtype=np.float64)
+        if star_col is None:
+            star = self.assign_stars(year, measure, use_PDP, score)
+        else:
+            star = df[star_col].to_numpy(dtype=np.float64)
+        lower, upper = self.bounds(year, measure, use_PDP, star)
+        ids = self.key_ids(year, measure, use_PDP)
+        higher_is_better = np.where(ids >= 0, self.higher_is_better[ids], False).astype(np.int8)
+        return pd.DataFrame({'star': star, 'lower': lower, 'upper': upper,
+                             'penetration': penetration(score, lower, upper, higher_is_better),
+                             'higher_is_better': higher_is_better}, index=df.index)
+
+
+def _build_cutpoint_index(DATA_URL):
+    return CutPointIndex(load_data(DATA_URL))
+
+
+def cutpoint_index(DATA_URL):
+    """
+    The CutPointIndex of the cut points dataset at DATA_URL, built once per dataset version.
+    """
+    return derived(DATA_URL, 'cutpoint_index', _build_cutpoint_index, DATA_URL)
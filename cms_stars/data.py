@@ -0,0 +1,271 @@
+"""
+Process-wide dataset cache.
+
+Streamlit reruns app.py on every widget change, but imported modules stay loaded for the life of the
+server process. Datasets parsed here are therefore shared by every session, and each file is only parsed
+again when it actually changes on disk.
+
+If a columnar copy of a CSV exists (see cms_stars/convert.py) it is memory-mapped instead of parsing the
+CSV, and only the columns a page asks for are materialized.
+
+Sessions never get their own copy of a dataset, so the shared data must never change. pandas writes go to
+a private copy (copy-on-write), and the arrays behind the cached columns and the numpy arrays of derived
+objects are marked read-only, so a write that goes around pandas (through Series.array or an index's
+arrays) raises instead of changing what every other session sees. Per-session state such as simulated
+stars is kept as small overlays on top of the shared data (see cms_stars/simulation.py).
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cms_stars.schema import read_csv
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+#copy-on-write makes the shallow copies handed out below behave as isolated views (always on from pandas 3)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+#columnar copies are written to this folder next to the CSVs, with the same file name and this extension
+COLUMNAR_DIR = 'arrow'
+COLUMNAR_EXT = '.arrow'
+
+#path -> _Dataset, shared by every session in the process
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+class _Dataset:
+    """
+    One cached dataset: the columns materialized so far plus the file state they were read from.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.source = None
+        self.signature = None
+        self.digest = None
+        self.column_names = []
+        self.columns = {}
+        #memory-mapped arrow table when reading from a columnar copy, None when reading from CSV
+        self.table = None
+        #objects built from this version of the dataset (indexes, precomputed tables), see derived()
+        #reentrant, so one derived object can be built from another of the same dataset
+        self.derived_lock = threading.RLock()
+        self.derived = {}
+
+
+def columnar_path(DATA_URL):
+    """
+    Path of the columnar copy of the CSV at DATA_URL, e.g. data/arrow/visualization_data.arrow
+    """
+    folder, name = os.path.split(DATA_URL)
+    return os.path.join(folder, COLUMNAR_DIR, os.path.splitext(name)[0] + COLUMNAR_EXT)
+
+
+def file_signature(path):
+    """
+    Cheap check for file changes: modification time and size.
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Content hash of a file, read in chunks so large files are never held in memory twice.
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def read_only(series):
+    """
+    series backed by a read-only copy of its values. Numeric and categorical columns are frozen; other
+    extension types (strings) are returned as they are.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy().copy()
+        codes.flags.writeable = False
+        values = pd.Categorical.from_codes(codes, dtype=series.dtype)
+    elif isinstance(series.dtype, np.dtype):
+        values = series.to_numpy().copy()
+        values.flags.writeable = False
+    else:
+        return series
+    return pd.Series(values, index=series.index, name=series.name, copy=False)
+
+
+def freeze_arrays(obj, _seen=None):
+    """
+    Mark every numpy array reachable from obj (through attributes, dicts, lists and tuples) read-only.
+    Returns obj.
+    """
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen:
+        return obj
+    _seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        obj.flags.writeable = False
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            freeze_arrays(value, _seen)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            freeze_arrays(value, _seen)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, (pd.DataFrame, pd.Series, type)):
+        freeze_arrays(vars(obj), _seen)
+    return obj
+
+
+def _get_dataset(path):
+    with _datasets_lock:
+        if path not in _datasets:
+            _datasets[path] = _Dataset()
+        return _datasets[path]
+
+
+def _pick_source(path):
+    """
+    Use the columnar copy when pyarrow is available and the copy is at least as new as the CSV,
+    otherwise fall back to the CSV itself.
+    """
+    arrow_path = columnar_path(path)
+    if pa is not None and os.path.exists(arrow_path):
+        if not os.path.exists(path) or os.stat(arrow_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return arrow_path
+    return path
+
+
+def _open_arrow(path):
+    #memory-mapped, so nothing is read from disk until a column is actually used
+    return pyarrow.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def _refresh(path, dataset):
+    """
+    Re-read the file if it changed since it was cached. The mtime/size signature is checked first
+    and the content hash is only computed when the signature moved, so touching a file without changing
+    it does not trigger a new parse.
+    """
+    source = _pick_source(path)
+    signature = file_signature(source)
+    if source == dataset.source and signature == dataset.signature:
+        return
+
+    digest = file_digest(source)
+    if digest != dataset.digest:
+        if source.endswith(COLUMNAR_EXT):
+            dataset.table = _open_arrow(source)
+            dataset.column_names = list(dataset.table.column_names)
+            dataset.columns = {}
+        else:
+            #typed with the declared schema; columnar copies already store these types
+            frame = read_csv(source)
+            dataset.table = None
+            dataset.column_names = list(frame.columns)
+            dataset.columns = {c: read_only(frame[c]) for c in frame.columns}
+        dataset.digest = digest
+    dataset.source = source
+    dataset.signature = signature
+
+
+def _materialize(dataset, columns):
+    """
+    Convert the requested columns of a memory-mapped table to pandas, once per column.
+    """
+    missing = [c for c in columns if c not in dataset.columns]
+    if missing:
+        frame = dataset.table.select(missing).to_pandas()
+        for c in missing:
+            dataset.columns[c] = read_only(frame[c])
+
+
+def load_data(DATA_URL, columns=None):
+    """
+    Return the dataset stored at DATA_URL, parsing the file at most once per process (and again only if
+    its content changes). Pass columns to get only those columns; with a columnar copy on disk the other
+    columns are never read.
+
+    The returned frame is a read-only view of the shared copy: with copy-on-write, any modification made
+    by a caller is applied to a private copy and never reaches other sessions, and writing into the
+    underlying arrays directly raises.
+    """
+    path = os.path.abspath(DATA_URL)
+    dataset = _get_dataset(path)
+
+    with dataset.lock:
+        _refresh(path, dataset)
+        if columns is None:
+            columns = dataset.column_names
+        else:
+            unknown = [c for c in columns if c not in dataset.column_names]
+            if unknown:
+                raise KeyError(f"{unknown} not found in {DATA_URL}")
+        if dataset.table is not None:
+            _materialize(dataset, columns)
+        selected = {c: dataset.columns[c] for c in columns}
+
+    return pd.DataFrame(selected, copy=False)
+
+
+def dataset_columns(DATA_URL):
+    """
+    Column names of the dataset at DATA_URL, without materializing any column of a columnar copy.
+    """
+    path = os.path.abspath(DATA_URL)
+    dataset = _get_dataset(path)
+    with dataset.lock:
+        _refresh(path, dataset)
+        return list(dataset.column_names)
+
+
+def dataset_version(DATA_URL):
+    """
+    Content hash of the cached dataset at DATA_URL, loading it first if needed. Useful as a cache key for
+    results derived from the dataset.
+    """
+    path = os.path.abspath(DATA_URL)
+    dataset = _get_dataset(path)
+    with dataset.lock:
+        _refresh(path, dataset)
+        return dataset.digest
+
+
+def derived(DATA_URL, name, build, *args):
+    """
+    Return build(*args), computed once per version of the dataset at DATA_URL and shared by every
+    session. Use it for indexes and tables derived from a dataset: they are rebuilt automatically when
+    the file changes. name identifies what is built, together with args. The numpy arrays of the built
+    object are made read-only (see freeze_arrays), so it must not modify them after it is built.
+    """
+    path = os.path.abspath(DATA_URL)
+    dataset = _get_dataset(path)
+    version = dataset_version(DATA_URL)
+    key = (name,) + args
+
+    #built outside dataset.lock, since build usually calls load_data itself
+    with dataset.derived_lock:
+        cached = dataset.derived.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = freeze_arrays(build(*args))
+        dataset.derived[key] = (version, value)
+        return value
+
+
+def clear_cache():
+    """
+    Drop every cached dataset.
+    """
+    with _datasets_lock:
+        _datasets.clear()
@@ -0,0 +1,164 @@
+"""
+Monte Carlo simulation of cut point drift: probabilities of next year's measure, summary and overall stars.
+
+Each year CMS sets new cut points, so a predicted score does not say which star it will get. The
+year-over-year change of a measure's four star thresholds is modeled as a shift shared by all four plus
+independent noise per threshold, both normal and in units of the measure's spread (distance between its
+2 star and 5 star thresholds):
+  - shift: mean and standard deviation of the average change of the thresholds between consecutive years
+  - noise: standard deviation of each threshold's change around that shift
+Measures with only a few years of history have their estimates shrunk towards the ones pooled over every
+measure (towards no drift for the mean).
+
+Draws of every measure's thresholds are taken at once, as (draws x measures x 4) arrays, and the summary
+and overall stars of every draw are one matrix product with the measure weights.
+"""
+import numpy as np
+import pandas as pd
+
+from cms_stars.cutpoints import cutpoint_index, use_pdp_cutpoints
+from cms_stars.data import derived
+from cms_stars.stars import STAR_TYPES, round_star, star_type_mask
+
+#weight of the pooled estimates, in years of history
+PRIOR_YEARS = 2
+
+#changes of more than the whole spread in one year come from placeholder cut points (e.g. 100) and are left out
+MAX_CHANGE = 1.0
+
+DRAWS = 20000
+
+
+class CutPointDrift:
+    """
+    Drift model of every (measure, is_PDP) of a CutPointIndex, fit on every year up to base_year.
+    """
+    def __init__(self, cut_index, base_year=None):
+        self.cut_index = cut_index
+        keys = cut_index.keys.to_frame(index=False)
+        if base_year is not None:
+            keys = keys[keys['year'] <= base_year]
+        keys = keys.sort_values(['measure', 'is_PDP', 'year'])
+        thresholds = cut_index.thresholds[keys.index.to_numpy()]
+
+        #change of each threshold between consecutive years of a measure, in units of its spread
+        same = (keys['measure'].to_numpy()[1:] == keys['measure'].to_numpy()[:-1]) & \
+               (keys['is_PDP'].to_numpy()[1:] == keys['is_PDP'].to_numpy()[:-1])
+        gap = np.diff(keys['year'].to_numpy())
+        spread = np.abs(thresholds[:, 3] - thresholds[:, 0])
+        spread = np.where(spread > 0, spread, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change = np.diff(thresholds, axis=0) / (gap[:, None] * spread[:-1, None])
+            valid = same & ~np.isnan(change).any(axis=1) & (np.abs(change) <= MAX_CHANGE).all(axis=1)
+
+        changes = pd.DataFrame({'measure': keys['measure'].to_numpy()[1:][valid],
+                                'is_PDP': keys['is_PDP'].to_numpy()[1:][valid],
+                                'shift': change[valid].mean(axis=1)})
+        noise = change[valid] - changes['shift'].to_numpy()[:, None]
+        changes['noise_sq'] = (noise ** 2).sum(axis=1)
+
+        #pooled over every measure
+        pooled_shift_sd = changes['shift'].std() if len(changes) > 1 else 0.0
+        pooled_noise_var = changes['noise_sq'].sum() / max(3 * len(changes), 1)
+
+        groups = changes.groupby(['measure', 'is_PDP'])
+        n = groups.size()
+        mean_shift = groups['shift'].mean()
+        var_shift = groups['shift'].var().fillna(0.0)
+        noise_var = groups['noise_sq'].sum() / (3 * n)
+        model = pd.DataFrame({
+            'n': n,
+            'shift_mean': mean_shift * n / (n + PRIOR_YEARS),
+            'shift_sd': np.sqrt(((n - 1) * var_shift + PRIOR_YEARS * pooled_shift_sd ** 2) / (n - 1 + PRIOR_YEARS)),
+            'noise_sd': np.sqrt((n * noise_var + PRIOR_YEARS * pooled_noise_var) / (n + PRIOR_YEARS))})
+
+        #latest thresholds of every measure, the starting point of the drift
+        latest = keys.groupby(['measure', 'is_PDP']).tail(1)
+        self.base = pd.DataFrame({'measure': latest['measure'].to_numpy(), 'is_PDP': latest['is_PDP'].to_numpy(),
+                                  'year': latest['year'].to_numpy(), 'key_id': latest.index.to_numpy()})
+        self.base = self.base.join(model, on=['measure', 'is_PDP'])
+        self.base = self.base.fillna({'n': 0, 'shift_mean': 0.0, 'shift_sd': pooled_shift_sd,
+                                      'noise_sd': np.sqrt(pooled_noise_var)})
+        self.base = self.base.set_index(['measure', 'is_PDP'])
+
+    def draw_thresholds(self, measures, use_PDP, year, draws=DRAWS, rng=None):
+        """
+        Random thresholds of measures (with use_PDP cut points) in year: a (draws x measures x 4) array, the
+        higher_is_better flag of each measure, and which measures have cut points. Thresholds are drifted
+        from each measure's latest cut points by the number of years in between.
+        """
+        rng = np.random.default_rng(rng)
+        lookup = pd.MultiIndex.from_arrays([np.asarray(measures).astype(str), np.full(len(measures), use_PDP)])
+        rows = self.base.index.get_indexer(lookup)
+        known = rows >= 0
+        base = self.base.iloc[np.where(known, rows, 0)]
+
+        key_id = base['key_id'].to_numpy()
+        thresholds = self.cut_index.thresholds[key_id]
+        higher_is_better = self.cut_index.higher_is_better[key_id] & known
+        spread = np.abs(thresholds[:, 3] - thresholds[:, 0])
+        steps = np.maximum(year - base['year'].to_numpy(), 0)
+
+        #normal shift and noise, scaled by the years drifted (variance grows linearly with the steps)
+        shift = (base['shift_mean'].to_numpy() * steps +
+                 base['shift_sd'].to_numpy() * np.sqrt(steps) * rng.standard_normal((draws, len(rows))))
+        noise = (base['noise_sd'].to_numpy() * np.sqrt(steps))[None, :, None] * rng.standard_normal((draws, len(rows), 4))
+        drawn = thresholds[None] + (shift[:, :, None] + noise) * spread[None, :, None]
+
+        #thresholds stay in order
+        drawn = np.where(higher_is_better[None, :, None], np.maximum.accumulate(drawn, axis=2),
+                         np.minimum.accumulate(drawn, axis=2))
+        return drawn, higher_is_better, known & ~np.isnan(thresholds).any(axis=1)
+
+
+def star_probabilities(df, predicted, drift, year, draws=DRAWS, seed=0, star_col='star', weight_col='weight'):
+    """
+    Given a df of a single contract's latest measure stars, its predicted score of each measure for year
+    (predicted, aligned with df, NaN where there is none) and a CutPointDrift, simulate year's stars.
+
+    Measures with a predicted score and cut points get a star in every draw; the others keep their
+    current star. Returns
+      - a df with, per simulated measure, the probability of each star (columns 1 to 5)
+      - a dict of star type -> Series of the probability of each rounded star (NaN-free, index 1 to 5 by 0.5)
+    """
+    rng = np.random.default_rng(seed)
+    use_PDP = int(use_pdp_cutpoints(df['has_part_c'].iloc[0], df['has_part_d'].iloc[0]))
+    predicted = np.asarray(predicted, dtype=np.float64)
+
+    thresholds, higher_is_better, known = drift.draw_thresholds(df['measure'].to_numpy(), use_PDP, year, draws, rng)
+    simulated = known & ~np.isnan(predicted)
+
+    #star of every measure in every draw: 1 plus the number of thresholds passed
+    score = predicted[None, :, None]
+    passed = np.where(higher_is_better[None, :, None], score >= thresholds, score < thresholds)
+    stars = 1.0 + passed.sum(axis=2)
+    current = df[star_col].to_numpy(dtype=np.float64)
+    stars = np.where(simulated[None, :], stars, current[None, :])
+
+    measure_probs = pd.DataFrame({s: (stars[:, simulated] == s).mean(axis=0) for s in range(1, 6)},
+                                 index=df['measure'].to_numpy()[simulated])
+
+    weights = df[weight_col].to_numpy(dtype=np.float64)
+    summary_probs = {}
+    for star_type in STAR_TYPES:
+        #measures without a current star that are not simulated are left out
+        has_star = simulated | ~np.isnan(current)
+        w = np.where(star_type_mask(df, star_type) & has_star & ~np.isnan(weights), weights, 0.0)
+        if w.sum() <= 0:
+            continue
+        rounded = round_star(np.where(np.isnan(stars), 0.0, stars) @ w / w.sum())
+        levels = np.arange(1.0, 5.5, 0.5)
+        summary_probs[star_type] = pd.Series((rounded[:, None] == levels[None, :]).mean(axis=0), index=levels)
+    return measure_probs, summary_probs
+
+
+def _build_cutpoint_drift(DATA_URL, base_year):
+    return CutPointDrift(cutpoint_index(DATA_URL), base_year)
+
+
+def cutpoint_drift(DATA_URL, base_year=None):
+    """
+    The CutPointDrift of the cut points dataset at DATA_URL fit on the years up to base_year, built once per
+    dataset version.
+    """
+    return derived(DATA_URL, 'cutpoint_drift', _build_cutpoint_drift, DATA_URL, base_year)
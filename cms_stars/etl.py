@@ -0,0 +1,583 @@
+"""
+Incremental build of the app's datasets from the raw CMS Star Ratings files.
+
+The raw files of each rating year are downloaded from CMS into one folder per year:
+
+    raw/2023/summary_rating.csv   Star Ratings data table - Summary Rating (one row per contract)
+    raw/2023/measure_data.csv     Star Ratings data table - Measure Data (one score column per measure)
+    raw/2023/measure_stars.csv    Star Ratings data table - Measure Stars (same layout, measure stars)
+    raw/2023/cut_points*.csv      Star Ratings cut points, e.g. cut_points_part_c.csv and cut_points_part_d.csv
+    raw/2023/measures.csv         measure, domain_id and weight of every measure (from the Technical Notes)
+    raw/2023/enrollment.csv       monthly contract enrollment by state and county (CPSC), may be .zip or .gz
+
+and turned into the datasets the app reads in data/: visualization_data.csv (one row per contract and
+year), visualization_data_contract_details.csv (one row per contract, year and measure) and
+visualization_data_cutpoints.csv. The correlations datasets come from other sources (state health
+indicators, census figures, the disenrollment reasons survey), the predictions from cms_stars.forecast
+and the PDF index from cms_stars.pdf_search, so they are not built here.
+
+Each year is transformed on its own into staged parts (data/etl/<year>/<dataset>.csv) and a manifest
+records the content hash of every raw file a year was built from. A run only transforms the years whose
+raw files changed, in a process pool with one year per worker, and then joins the parts of every year
+into the datasets. Enrollment files have a row per plan and county and run to millions of rows, so they
+are read in chunks and summed by contract and state as they stream in.
+
+    python -m cms_stars.etl raw                 # rebuild the years whose raw files changed
+    python -m cms_stars.etl raw --years 2023 --force --workers 1
+
+Exits with status 1 when a year fails. A failed year keeps the parts and manifest entry of its last good
+build, so the datasets keep its last good rows (a year that never built is left out); it is tried again
+on the next run, and the datasets are only written again when some year built or the years changed.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from cms_stars.cutpoints import CutPointIndex
+from cms_stars.data import columnar_path, file_digest, file_signature
+from cms_stars.schema import STAR_SENTINELS
+from cms_stars.states import StateEnrollment
+
+#bump when a transform changes, so every year is built again with it
+ETL_VERSION = 1
+
+OUTPUT_DIR = 'data'
+#staged parts and the manifest, inside the output folder
+STAGE_DIR = 'etl'
+MANIFEST = 'manifest.json'
+
+ENROLLMENT_CHUNK_ROWS = 500_000
+
+#the raw files of a year: name -> glob pattern inside the year's folder
+RAW_FILES = {
+    'summary_rating': 'summary_rating.csv',
+    'measure_data': 'measure_data.csv',
+    'measure_stars': 'measure_stars.csv',
+    'cut_points': 'cut_points*.csv',
+    'measures': 'measures.csv',
+    'enrollment': 'enrollment.csv*',
+}
+
+#state enrollment columns of visualization_data.csv, in order
+STATES = ['AK', 'AL', 'AR', 'AS', 'AZ', 'CA', 'CO', 'CT', 'DC', 'DE', 'FL', 'GA', 'GU', 'HI', 'IA', 'ID', 'IL',
+          'IN', 'KS', 'KY', 'LA', 'MA', 'MD', 'ME', 'MI', 'MN', 'MO', 'MP', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH',
+          'NJ', 'NM', 'NV', 'NY', 'OH', 'OK', 'OR', 'PA', 'PR', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VI',
+          'VT', 'WA', 'WI', 'WV', 'WY']
+
+_CONTRACT_INFO = ['contract_id', 'contract_name', 'marketing_name', 'parent_org_name', 'org_type_name']
+_SUMMARY_STARS = ['part_c_star', 'part_d_star', 'overall_star']
+
+#columns of each dataset, in order
+COLUMNS = {
+    'visualization_data': ['year'] + _CONTRACT_INFO[:4] + _SUMMARY_STARS + ['SNP', 'org_type_name', 'has_part_c',
+                           'has_part_d', 'Rating'] + STATES + ['top_states', 'total_enrollment'],
+    'visualization_data_contract_details': ['year'] + _CONTRACT_INFO + _SUMMARY_STARS + [
+        'has_part_c', 'has_part_d', 'domain_id', 'domain_name', 'measure', 'score', 'star', 'weight', 'lower', 'upper',
+        'penetration', 'is_part_c', 'is_part_d'],
+    'visualization_data_cutpoints': ['year', 'star', 'lower', 'upper', 'higher_is_better', 'is_MAPD', 'is_PDP',
+                                     'measure'],
+}
+
+#raw column headers (see _normalize) of the summary rating table
+SUMMARY_COLUMNS = {
+    'contract id': 'contract_id',
+    'organization type': 'org_type_name',
+    'contract name': 'contract_name',
+    'organization marketing name': 'marketing_name',
+    'parent organization': 'parent_org_name',
+    'snp': 'SNP',
+    'part c summary': 'part_c_star',
+    'part d summary': 'part_d_star',
+    'overall': 'overall_star',
+    'overall rating': 'overall_star',
+}
+
+#raw column headers of the enrollment file
+ENROLLMENT_COLUMNS = {
+    'contract number': 'contract_id',
+    'contract id': 'contract_id',
+    'state': 'state',
+    'enrollment': 'enrollment',
+}
+
+#measure cells CMS fills for measures a contract does not report; those contract measures are left out
+NOT_REPORTED = ['', 'Not Applicable']
+
+#bounds of the open ended cut point ranges (< x for 1 star, >= y for 5 stars, ...)
+OPEN_LOWER = 0.0
+OPEN_UPPER = 100.0
+
+_CONTRACT_RE = re.compile(r'^[A-Z]\d{4}$')
+#raw measure headers, e.g. C01: Breast Cancer Screening
+_MEASURE_RE = re.compile(r'^\s*([CD])\d+\s*:\s*(.+?)\s*$')
+_STAR_ROW_RE = re.compile(r'^\s*([1-5])\s*star', re.IGNORECASE)
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def _normalize(header):
+    #lower case without years and punctuation, e.g. '2023 Part C Summary' -> 'part c summary'
+    header = re.sub(r'\b(19|20)\d{2}\b', ' ', header.replace('\ufeff', '').replace('\xef\xbb\xbf', '').lower())
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', header).split())
+
+
+def measure_name(header):
+    """
+    App name of a raw measure header, e.g. 'C01: Breast Cancer Screening' -> 'C-Breast Cancer Screening'.
+    Headers that are not measures are returned as None.
+    """
+    match = _MEASURE_RE.match(header)
+    if match is None:
+        return None
+    return f"{match.group(1)}-{' '.join(match.group(2).split())}"
+
+
+def _read_rows(path):
+    #CMS publishes some files as UTF-8 and others as Windows-1252
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            return list(csv.reader(f))
+    except UnicodeDecodeError:
+        with open(path, newline='', encoding='latin-1') as f:
+            return list(csv.reader(f))
+
+
+def read_cms_table(path):
+    """
+    Read a Star Ratings data table. The files start with title rows and have rows of measure dates and
+    domains around the header, so the header is the first row starting with CONTRACT_ID and only the rows
+    of a contract id are kept. Every value is text, stripped of surrounding spaces.
+    """
+    rows = _read_rows(path)
+    start = next((i for i, row in enumerate(rows) if row and _normalize(row[0]) == 'contract id'), None)
+    if start is None:
+        raise ValueError(f"{path}: no header row starting with CONTRACT_ID")
+    header = [h.strip() for h in rows[start]]
+    records = [[v.strip() for v in row[:len(header)]] + [''] * (len(header) - len(row))
+               for row in rows[start + 1:] if row and _CONTRACT_RE.match(row[0].strip())]
+    return pd.DataFrame(records, columns=header, dtype=object)
+
+
+def read_summary(path):
+    """
+    Contract information and summary stars of the summary rating table, one row per contract, with the
+    columns renamed to the app's names.
+    """
+    table = read_cms_table(path)
+    renamed = {c: SUMMARY_COLUMNS[_normalize(c)] for c in table.columns if _normalize(c) in SUMMARY_COLUMNS}
+    table = table.rename(columns=renamed)
+    missing = [c for c in _CONTRACT_INFO + _SUMMARY_STARS + ['SNP'] if c not in table.columns]
+    if missing:
+        raise ValueError(f"{path}: no column for {missing}")
+    return table[_CONTRACT_INFO + ['SNP'] + _SUMMARY_STARS].drop_duplicates('contract_id')
+
+
+def read_measure_table(path):
+    """
+    contract_id and one column per measure (named by measure_name()) of a measure data or measure stars table.
+    """
+    table = read_cms_table(path)
+    measures = {c: measure_name(c) for c in table.columns[1:] if measure_name(c) is not None}
+    table = table[[table.columns[0]] + list(measures)].rename(columns={table.columns[0]: 'contract_id', **measures})
+    return table.drop_duplicates('contract_id')
+
+
+def read_measures(path):
+    """
+    Domain and weight of every measure, indexed by measure_name(). The raw measure names may be given with or
+    without their C01: style id.
+    """
+    df = pd.read_csv(path, dtype={'measure': str, 'domain_id': str})
+    missing = [c for c in ['measure', 'domain_id', 'weight'] if c not in df.columns]
+    if missing:
+        raise ValueError(f"{path}: no column for {missing}")
+    df['measure'] = [measure_name(m) or m.strip() for m in df['measure']]
+    return df.drop_duplicates('measure').set_index('measure')[['domain_id', 'weight']]
+
+
+def cut_point_range(text):
+    """
+    Lower and upper bound of a cut point range, e.g. '>= 56 % to < 70 %' -> (56.0, 70.0). Ranges open on one
+    side ('< 56 %', '>= 84 %') are closed with OPEN_LOWER or OPEN_UPPER. (nan, nan) when text has no number.
+    """
+    numbers = [float(n) for n in _NUMBER_RE.findall(text.replace(',', ''))]
+    if not numbers:
+        return np.nan, np.nan
+    if len(numbers) > 1:
+        return min(numbers), max(numbers)
+    if text.strip().startswith('<'):
+        return OPEN_LOWER, numbers[0]
+    return numbers[0], OPEN_UPPER
+
+
+def read_cut_points(path, year):
+    """
+    Cut points of a cut points file, one row per measure and star. The file has a header row of measures and
+    a row per star ('1star' ... '5star') holding the score range of each measure. Part D files repeat the
+    rows in blocks led by a row whose first cell names the plans (MA-PD or PDP), which may also be the row of
+    measure names; Part D measures outside a block apply to both.
+    """
+    records, header, plans = [], None, None
+    for row in _read_rows(path):
+        first = row[0].strip().upper() if row else ''
+        #the plan label is checked on its own, it may share its row with the measure names
+        if measure_name(first) is None:
+            if 'MA-PD' in first or 'MAPD' in first:
+                plans = ['MAPD']
+            elif 'PDP' in first:
+                plans = ['PDP']
+        if any(measure_name(c) for c in row[1:]):
+            header = [measure_name(c) for c in row]
+        elif _STAR_ROW_RE.match(first) and header is not None:
+            star = int(_STAR_ROW_RE.match(first).group(1))
+            for measure, text in zip(header[1:], row[1:]):
+                if measure is None or not text.strip():
+                    continue
+                lower, upper = cut_point_range(text)
+                if measure.startswith('C-'):
+                    kinds = [(0, 0)]
+                else:
+                    kinds = [(int(p == 'MAPD'), int(p == 'PDP')) for p in (plans or ['MAPD', 'PDP'])]
+                records.extend({'year': year, 'star': star, 'lower': lower, 'upper': upper, 'is_MAPD': is_mapd,
+                                'is_PDP': is_pdp, 'measure': measure} for is_mapd, is_pdp in kinds)
+    return pd.DataFrame(records, columns=['year', 'star', 'lower', 'upper', 'is_MAPD', 'is_PDP', 'measure'])
+
+
+def cut_point_table(cut_points):
+    """
+    Given the cut point rows of a year, add whether each measure is higher is better (its 5 star range lies
+    above its 1 star range) and return them in the order and columns of visualization_data_cutpoints.csv.
+    Rows repeated with the same range are kept once; a measure, plan type and star given two different ranges
+    raises a ValueError.
+    """
+    keys = ['measure', 'is_MAPD', 'is_PDP']
+    cut_points = cut_points.drop_duplicates(keys + ['star', 'lower', 'upper'])
+    conflicts = cut_points[cut_points.duplicated(keys + ['star'], keep=False)]
+    if len(conflicts):
+        which = sorted(set(conflicts[keys].itertuples(index=False, name=None)))
+        raise ValueError(f"different cut points for the same star of (measure, is_MAPD, is_PDP) {which}")
+    middle = cut_points.assign(middle=(cut_points['lower'] + cut_points['upper']) / 2)
+    ends = middle.pivot_table(index=keys, columns='star', values='middle', aggfunc='first').reindex(columns=[1, 5])
+    higher = (ends[5] > ends[1]).astype(np.int8).rename('higher_is_better')
+    df = cut_points.join(higher, on=keys)
+    df = df.sort_values(['measure', 'star', 'is_MAPD', 'is_PDP'])
+    return df[COLUMNS['visualization_data_cutpoints']].reset_index(drop=True)
+
+
+def contract_state_enrollment(path, chunk_rows=ENROLLMENT_CHUNK_ROWS):
+    """
+    Enrollment of every contract in each of STATES, from a CPSC enrollment file read chunk_rows rows at a
+    time. Counts CMS suppresses (* for 10 or fewer members) are taken as 0 and other states are left out.
+    Returns a (contract_id x STATES) df of ints.
+    """
+    header = pd.read_csv(path, nrows=0, encoding='latin-1').columns
+    usecols = {c: ENROLLMENT_COLUMNS[_normalize(c)] for c in header if _normalize(c) in ENROLLMENT_COLUMNS}
+    if sorted(set(usecols.values())) != ['contract_id', 'enrollment', 'state']:
+        raise ValueError(f"{path}: needs contract number, state and enrollment columns")
+
+    totals = None
+    for chunk in pd.read_csv(path, usecols=list(usecols), dtype=str, chunksize=chunk_rows, encoding='latin-1'):
+        chunk = chunk.rename(columns=usecols)
+        enrollment = pd.to_numeric(chunk['enrollment'].str.replace(',', '').str.strip(), errors='coerce').fillna(0)
+        keys = [chunk['contract_id'].str.strip(), chunk['state'].str.strip().str.upper()]
+        counts = enrollment.groupby(keys).sum()
+        totals = counts if totals is None else totals.add(counts, fill_value=0)
+
+    if totals is None or len(totals) == 0:
+        return pd.DataFrame(columns=STATES, dtype=np.int64)
+    totals.index.names = ['contract_id', 'state']
+    return totals.unstack('state').reindex(columns=STATES).fillna(0).astype(np.int64)
+
+
+def summary_star_text(values, path):
+    """
+    Summary star cells as written to visualization_data.csv: stars as numbers, the STAR_SENTINELS as they are.
+    """
+    values = values.fillna('').str.strip().replace('', 'Not Applicable')
+    unknown = sorted(set(values[pd.to_numeric(values, errors='coerce').isna() & ~values.isin(STAR_SENTINELS)]))
+    if unknown:
+        raise ValueError(f"{path}: unknown summary star values {unknown}")
+    return values
+
+
+def measure_rows(summary, scores, stars, measures, cut_index, year):
+    """
+    One row per contract and measure it reports, in the columns of visualization_data_contract_details.csv.
+    Scores and stars CMS did not give (not enough data, plan too new, ...) are nulls; lower, upper and
+    penetration come from the contract's star in the year's cut points.
+    """
+    key = ['contract_id', 'measure']
+    score_text = scores.melt(id_vars='contract_id', var_name='measure', value_name='score_text')
+    star_text = stars.melt(id_vars='contract_id', var_name='measure', value_name='star_text')
+    df = score_text.merge(star_text, on=key, how='outer')
+    df = df[df['contract_id'].isin(summary['contract_id'])]
+    score_text, star_text = df['score_text'].fillna('').str.strip(), df['star_text'].fillna('').str.strip()
+    df = df[~(score_text.isin(NOT_REPORTED) & star_text.isin(NOT_REPORTED))]
+
+    df = df.assign(year=year,
+                   score=pd.to_numeric(df['score_text'].str.replace(r'[%,\s]', '', regex=True), errors='coerce'),
+                   star=pd.to_numeric(df['star_text'].str.strip(), errors='coerce'),
+                   is_part_c=df['measure'].str.startswith('C-').astype(np.int8),
+                   is_part_d=df['measure'].str.startswith('D-').astype(np.int8))
+    has_part = df.groupby('contract_id')[['is_part_c', 'is_part_d']].max()
+    df = df.join(has_part.rename(columns={'is_part_c': 'has_part_c', 'is_part_d': 'has_part_d'}), on='contract_id')
+    df = df.join(measures, on='measure')
+    df['domain_name'] = 'Domain ' + df['domain_id']
+
+    info = summary[_CONTRACT_INFO].assign(**{c: pd.to_numeric(summary[c], errors='coerce') for c in _SUMMARY_STARS})
+    df = df.merge(info, on='contract_id', how='left')
+    cuts = cut_index.score_measures(df)
+    df = df.assign(lower=cuts['lower'], upper=cuts['upper'], penetration=cuts['penetration'])
+    return df.sort_values(key)[COLUMNS['visualization_data_contract_details']].reset_index(drop=True)
+
+
+def contract_rows(summary, has_part, enrollment, year, path):
+    """
+    One row per contract in the columns of visualization_data.csv: contract information, summary stars, the
+    Rating shown in the explorer (overall star, else Part C, else Part D, else 0), whether it reports Part C
+    and Part D measures and its enrollment by state.
+    """
+    df = summary.assign(year=year, **{c: summary_star_text(summary[c], path) for c in _SUMMARY_STARS})
+    df = df.join(has_part, on='contract_id').fillna({'has_part_c': 0, 'has_part_d': 0})
+    stars = [pd.to_numeric(df[c], errors='coerce') for c in ('overall_star', 'part_c_star', 'part_d_star')]
+    df['Rating'] = stars[0].fillna(stars[1]).fillna(stars[2]).fillna(0.0)
+
+    states = enrollment.reindex(df['contract_id']).fillna(0).astype(np.int64).set_index(df.index)
+    df = pd.concat([df, states], axis=1)
+    df['total_enrollment'] = states.sum(axis=1)
+    df['top_states'] = StateEnrollment(df, STATES).top_states(np.arange(len(df)))
+    df = df.astype({'has_part_c': np.int8, 'has_part_d': np.int8})
+    return df.sort_values('contract_id')[COLUMNS['visualization_data']].reset_index(drop=True)
+
+
+def raw_files(folder):
+    """
+    {name: [paths]} of the raw files of a year's folder. Raises FileNotFoundError when one is missing.
+    """
+    files = {name: sorted(glob.glob(os.path.join(folder, pattern))) for name, pattern in RAW_FILES.items()}
+    missing = [RAW_FILES[name] for name, paths in files.items() if not paths]
+    if missing:
+        raise FileNotFoundError(f"{folder}: missing {missing}")
+    return files
+
+
+def transform_year(year, folder, chunk_rows=ENROLLMENT_CHUNK_ROWS):
+    """
+    Build the rows of year of every dataset from the raw files in folder. Returns {dataset: df}.
+    """
+    files = raw_files(folder)
+    summary_path = files['summary_rating'][0]
+    summary = read_summary(summary_path)
+    cut_points = cut_point_table(pd.concat([read_cut_points(p, year) for p in files['cut_points']], ignore_index=True))
+    details = measure_rows(summary, read_measure_table(files['measure_data'][0]),
+                           read_measure_table(files['measure_stars'][0]), read_measures(files['measures'][0]),
+                           CutPointIndex(cut_points), year)
+    has_part = details.groupby('contract_id')[['has_part_c', 'has_part_d']].max()
+    enrollment = contract_state_enrollment(files['enrollment'][-1], chunk_rows)
+    contracts = contract_rows(summary, has_part, enrollment, year, summary_path)
+    return {'visualization_data': contracts, 'visualization_data_contract_details': details,
+            'visualization_data_cutpoints': cut_points}
+
+
+def build_year(task):
+    """
+    Transform one year and stage its parts in stage_dir/<year>/. task is (year, folder, stage_dir, chunk_rows);
+    runs in a worker process. Returns {'year', 'contracts', 'measures', 'rows', 'seconds', 'error'}.
+    """
+    year, folder, stage_dir, chunk_rows = task
+    start = time.perf_counter()
+    result = {'year': year, 'contracts': 0, 'measures': 0, 'rows': 0, 'seconds': np.nan, 'error': None}
+    try:
+        tables = transform_year(year, folder, chunk_rows)
+        year_dir = os.path.join(stage_dir, str(year))
+        os.makedirs(year_dir, exist_ok=True)
+        #every part is written next to its final name before any replaces the last good build's, so readers
+        #never see a half written file and a failed write keeps all of the last good parts
+        paths = [os.path.join(year_dir, name + '.csv') for name in tables]
+        for path, df in zip(paths, tables.values()):
+            df.to_csv(path + '.tmp', index=False)
+        for path in paths:
+            os.replace(path + '.tmp', path)
+        details = tables['visualization_data_contract_details']
+        result.update(contracts=len(tables['visualization_data']), measures=details['measure'].nunique(),
+                      rows=len(details))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def raw_years(raw_dir):
+    """
+    {year: folder} of the year folders (named by a 4 digit year) in raw_dir.
+    """
+    return {int(name): os.path.join(raw_dir, name) for name in sorted(os.listdir(raw_dir))
+            if re.fullmatch(r'\d{4}', name) and os.path.isdir(os.path.join(raw_dir, name))}
+
+
+def read_manifest(stage_dir):
+    """
+    The manifest of the staged parts: {'years': {year: {'version': ETL_VERSION it was built with, 'files':
+    input_state() of its raw files}}, 'assembled': years in the datasets last written}.
+    """
+    path = os.path.join(stage_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {'years': {}, 'assembled': []}
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest['years'] = {int(y): built for y, built in manifest['years'].items()}
+    return manifest
+
+
+def write_manifest(stage_dir, manifest):
+    path = os.path.join(stage_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'years': {str(y): v for y, v in sorted(manifest['years'].items())},
+                   'assembled': manifest['assembled']}, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def input_state(folder, previous=None):
+    """
+    {file name: {'signature', 'digest'}} of every file in a year's folder. As in the dataset cache, the
+    content hash of a file is only computed again when its modification time or size moved.
+    """
+    previous = previous or {}
+    state = {}
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not os.path.isfile(path):
+            continue
+        signature = list(file_signature(path))
+        old = previous.get(name)
+        digest = old['digest'] if old is not None and old['signature'] == signature else file_digest(path)
+        state[name] = {'signature': signature, 'digest': digest}
+    return state
+
+
+def _staged(stage_dir, year):
+    return all(os.path.exists(os.path.join(stage_dir, str(year), name + '.csv')) for name in COLUMNS)
+
+
+def changed_years(years, manifest, stage_dir):
+    """
+    Given {year: folder}, return {year: current input_state()} of the years to build: years not built yet,
+    built by another ETL_VERSION, whose staged parts are gone or whose raw file contents changed.
+    """
+    changed = {}
+    for year, folder in years.items():
+        previous = manifest['years'].get(year, {'version': None, 'files': {}})
+        state = input_state(folder, previous['files'])
+        digests = {name: f['digest'] for name, f in state.items()}
+        same = digests == {name: f['digest'] for name, f in previous['files'].items()}
+        if not same or previous['version'] != ETL_VERSION or not _staged(stage_dir, year):
+            changed[year] = state
+    return changed
+
+
+def assemble(stage_dir, years, output=OUTPUT_DIR):
+    """
+    Join the staged parts of years into each dataset in output, streaming the files one after the other.
+    A columnar copy of a dataset (see cms_stars/convert.py) is written again when there is one.
+    Returns the paths written.
+    """
+    written = []
+    for name in COLUMNS:
+        path = os.path.join(output, name + '.csv')
+        parts = [os.path.join(stage_dir, str(y), name + '.csv') for y in sorted(years)]
+        with open(path + '.tmp', 'w', newline='') as out:
+            for i, part in enumerate(parts):
+                with open(part, newline='') as f:
+                    header = f.readline()
+                    if i == 0:
+                        out.write(header)
+                    shutil.copyfileobj(f, out)
+        os.replace(path + '.tmp', path)
+        if os.path.exists(columnar_path(path)):
+            from cms_stars.convert import convert_csv
+            convert_csv(path)
+        written.append(path)
+    return written
+
+
+def run_etl(raw_dir, output=OUTPUT_DIR, years=None, force=False, workers=None, chunk_rows=ENROLLMENT_CHUNK_ROWS):
+    """
+    Build the years (default: every year folder in raw_dir) whose raw files changed, or all of them with
+    force, then write the datasets from the staged parts of every year in raw_dir that has them (for a year
+    that failed, those of its last good build). Returns a df with one row per year (built, unchanged or
+    failed) and the paths of the datasets written.
+    """
+    stage_dir = os.path.join(output, STAGE_DIR)
+    os.makedirs(stage_dir, exist_ok=True)
+    folders = raw_years(raw_dir)
+    selected = {y: f for y, f in folders.items() if years is None or y in years}
+    manifest = read_manifest(stage_dir)
+    if force:
+        states = {y: input_state(f) for y, f in selected.items()}
+    else:
+        states = changed_years(selected, manifest, stage_dir)
+
+    tasks = [(year, folders[year], stage_dir, chunk_rows) for year in sorted(states)]
+    results = []
+
+    def finish(result):
+        if result['error'] is None:
+            manifest['years'][result['year']] = {'version': ETL_VERSION, 'files': states[result['year']]}
+            write_manifest(stage_dir, manifest)
+        results.append(dict(result, status='failed' if result['error'] else 'built'))
+        print(f"{result['year']}: {result['error'] or 'built'}", file=sys.stderr)
+
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            finish(build_year(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for future in as_completed([pool.submit(build_year, task) for task in tasks]):
+                finish(future.result())
+
+    results.extend({'year': y, 'status': 'unchanged'} for y in selected if y not in states)
+    #years whose folder is gone are dropped from the datasets; a year that failed keeps its last good parts
+    built = [y for y in folders if y in manifest['years'] and _staged(stage_dir, y)]
+    rebuilt = any(r['status'] == 'built' for r in results)
+    missing = not all(os.path.exists(os.path.join(output, name + '.csv')) for name in COLUMNS)
+    written = []
+    if built and (rebuilt or missing or built != manifest['assembled']):
+        written = assemble(stage_dir, built, output)
+        manifest['assembled'] = built
+        write_manifest(stage_dir, manifest)
+
+    summary = pd.DataFrame(results, columns=['year', 'status', 'contracts', 'measures', 'rows', 'seconds', 'error'])
+    summary = summary.astype({'contracts': 'Int64', 'measures': 'Int64', 'rows': 'Int64'})
+    return summary.sort_values('year').reset_index(drop=True), written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the app's datasets from the raw CMS Star Ratings files.")
+    parser.add_argument('raw', help="folder with one folder of raw files per year (raw/2023/...)")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="folder to write the datasets to")
+    parser.add_argument('--years', type=int, nargs='+', help="only check these years (default: every year folder)")
+    parser.add_argument('--force', action='store_true', help="build the years even if their raw files did not change")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--chunk-rows', type=int, default=ENROLLMENT_CHUNK_ROWS,
+                        help="rows of the enrollment files read at a time")
+    args = parser.parse_args(argv)
+
+    summary, written = run_etl(args.raw, args.output, args.years, args.force, args.workers, args.chunk_rows)
+    print(summary.round({'seconds': 1}).astype(object).fillna('').to_string(index=False))
+    for path in written:
+        print(f"{path}: {os.path.getsize(path):,} bytes")
+    if (summary['status'] == 'failed').any():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
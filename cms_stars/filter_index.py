@@ -0,0 +1,152 @@
+"""
+Precomputed row indexes for the sidebar filters.
+
+Instead of scanning the whole frame with boolean masks on every rerun, the row positions matching each
+filter value are computed once per dataset version. A filter combination is then resolved by intersecting
+a few small sorted position arrays, and the result is used with df.iloc.
+"""
+import numpy as np
+import pandas as pd
+
+from cms_stars.data import derived, load_data
+from cms_stars.states import state_enrollment
+
+#plan types offered in the sidebar, in terms of which parts the contract has
+PLAN_TYPES = {'MA-PD': (1, 1), 'MA only': (1, 0), 'PDP': (0, 1)}
+
+#enrollment quartiles offered in the sidebar and the quartile labels (0 = smallest) they keep
+QUARTILES = {'Top 25%': [3],
+             '50-75%': [2],
+             '25-50%': [1],
+             'Bottom 25%': [0],
+             'All': [0, 1, 2, 3]}
+
+
+def plan_types(df):
+    """
+    Given a df with has_part_c and has_part_d columns, return an array with the plan type of each row
+    ('MA-PD', 'MA only', 'PDP', or None for rows with neither part).
+    """
+    has_c = df['has_part_c'].to_numpy() == 1
+    has_d = df['has_part_d'].to_numpy() == 1
+    return np.select([has_c & has_d, has_c, has_d], ['MA-PD', 'MA only', 'PDP'], default=None)
+
+
+def enrollment_quartiles(values):
+    """
+    Label each value with its quartile (0 to 3) using the same bins as pd.qcut(values, q=4), except that
+    repeated bin edges do not raise an error.
+    """
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int8)
+    edges = np.quantile(values, [0.25, 0.5, 0.75])
+    #bins are closed on the right, like pd.qcut
+    return np.searchsorted(edges, values, side='left').astype(np.int8)
+
+
+class FilterIndex:
+    """
+    Row positions of a dataset for each value of a set of filter columns, plus the derived 'plan_type'
+    column when the dataset has has_part_c/has_part_d.
+    """
+    def __init__(self, df, columns):
+        self.n_rows = len(df)
+        self.columns = {}
+        self.postings = {}
+
+        for col in columns:
+            self.columns[col] = df[col].to_numpy()
+            self.postings[col] = df.groupby(col, observed=True, sort=False).indices
+
+        if 'has_part_c' in df.columns and 'has_part_d' in df.columns:
+            types = plan_types(df)
+            self.columns['plan_type'] = types
+            self.postings['plan_type'] = {t: np.flatnonzero(types == t) for t in PLAN_TYPES}
+
+    def rows(self, **filters):
+        """
+        Return the sorted row positions matching every filter, e.g. rows(year=2023, plan_type='PDP').
+        A filter value of 'All' or None does not filter.
+        """
+        result = None
+        for col, value in filters.items():
+            if value is None or value == 'All':
+                continue
+            positions = self.postings[col].get(value, np.empty(0, dtype=np.intp))
+            if result is None:
+                result = positions
+            else:
+                result = np.intersect1d(result, positions, assume_unique=True)
+
+        if result is None:
+            return np.arange(self.n_rows)
+        return result
+
+    def values(self, column, **filters):
+        """
+        Distinct values of column among the rows matching filters, in order of first appearance.
+        """
+        return pd.unique(self.columns[column][self.rows(**filters)])
+
+
+class ExplorerIndex(FilterIndex):
+    """
+    FilterIndex for the Star Rating Explorer. For every (year, plan type, state) combination it also
+    stores the contracts with enrollment there and their enrollment quartile, so the treemap filters
+    never scan the table or call pd.qcut. State enrollment comes from a StateEnrollment store.
+    """
+    def __init__(self, df, store):
+        super().__init__(df, ['year'])
+        self.states = list(store.states)
+        self.quartile_rows = {}
+
+        for year in self.postings['year']:
+            for plan_type in list(PLAN_TYPES) + ['All']:
+                rows = super().rows(year=year, plan_type=plan_type)
+                in_rows = np.zeros(self.n_rows, dtype=bool)
+                in_rows[rows] = True
+                for state in ['All'] + self.states:
+                    if state == 'All':
+                        state_rows, values = rows, store.state_enrollment('All', rows)
+                    else:
+                        #with a state selected only contracts with enrollment there are shown
+                        all_rows, all_values = store.state_rows(state)
+                        keep = in_rows[all_rows]
+                        state_rows, values = all_rows[keep], all_values[keep]
+                    quartiles = enrollment_quartiles(values)
+                    #the treemap cannot draw boxes for contracts without enrollment
+                    keep = values != 0
+                    self.quartile_rows[(year, plan_type, state)] = (state_rows[keep], quartiles[keep])
+
+    def explorer_rows(self, year, plan_type='All', state='All', quartile='All'):
+        """
+        Row positions of the contracts to show for the explorer's sidebar filters.
+        """
+        rows, quartiles = self.quartile_rows.get((year, plan_type, state), (np.empty(0, dtype=np.intp), None))
+        if quartile == 'All':
+            return rows
+        return rows[np.isin(quartiles, QUARTILES[quartile])]
+
+
+def _build_explorer_index(DATA_URL):
+    df = load_data(DATA_URL, columns=['year', 'has_part_c', 'has_part_d'])
+    return ExplorerIndex(df, state_enrollment(DATA_URL))
+
+
+def _build_filter_index(DATA_URL, columns):
+    df = load_data(DATA_URL, columns=list(columns) + ['has_part_c', 'has_part_d'])
+    return FilterIndex(df, columns)
+
+
+def explorer_index(DATA_URL):
+    """
+    The ExplorerIndex of the dataset at DATA_URL, built once per dataset version.
+    """
+    return derived(DATA_URL, 'explorer_index', _build_explorer_index, DATA_URL)
+
+
+def filter_index(DATA_URL, columns):
+    """
+    A FilterIndex over columns of the dataset at DATA_URL, built once per dataset version.
+    """
+    return derived(DATA_URL, 'filter_index', _build_filter_index, DATA_URL, tuple(columns))
@@ -0,0 +1,296 @@
+"""
+Forecasting engine: next-year measure scores of every contract.
+
+One ridge regression per measure predicts a contract's score from
+  - its score of that measure the previous year and the year before (filled with the measure's average,
+    with a flag, when the contract has no score two years back)
+  - its average standardized score over all measures the previous year
+  - whether it has Part C and Part D
+  - the state-level predictors of visualization_data_correlations.csv the previous year, averaged over the
+    states the contract has members in, weighted by its enrollment in each state
+
+The ridge penalty of each measure is picked with rolling-origin cross-validation (train on the years
+before a validation year, validate on that year), then the model is fit on every year and predicts the
+year after the last one. Features are built for all contracts, years and measures at once with array
+operations, and the models are fit in a process pool with one measure per worker.
+
+    python -m cms_stars.forecast        # cross-validate, train and write data/Complete_<year>_pred.csv
+
+The output has the same shape as Complete_2023_pred.csv: one row per contract, one column per measure.
+"""
+import argparse
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cms_stars.data import dataset_columns, load_data
+from cms_stars.predictions import prediction_url
+from cms_stars.schema import is_state_column
+
+DETAILS_URL = "data/visualization_data_contract_details.csv"
+ENROLLMENT_URL = "data/visualization_data.csv"
+PREDICTORS_URL = "data/visualization_data_correlations.csv"
+
+#ridge penalties tried in cross-validation, and the one used when a measure has too few years to validate
+ALPHAS = (0.1, 1.0, 10.0, 100.0, 1000.0)
+DEFAULT_ALPHA = 10.0
+
+#a measure needs at least this many training rows to get a model
+MIN_TRAIN_ROWS = 30
+
+
+def _codes(values, labels):
+    return pd.Index(labels).get_indexer(values)
+
+
+def score_cube(df, years, contracts, measures):
+    """
+    Given contract measure scores (year, contract_id, measure, score), return a (years x contracts x
+    measures) array of scores, NaN where there is none.
+    """
+    cube = np.full((len(years), len(contracts), len(measures)), np.nan)
+    y = _codes(df['year'], years)
+    c = _codes(df['contract_id'].astype(str), contracts)
+    m = _codes(df['measure'].astype(str), measures)
+    known = (y >= 0) & (c >= 0) & (m >= 0)
+    cube[y[known], c[known], m[known]] = df['score'].to_numpy(dtype=np.float64)[known]
+    return cube
+
+
+def standardized_quality(cube):
+    """
+    (years x contracts) average over measures of each contract's score standardized within its measure
+    and year. NaN for contracts without any score that year.
+    """
+    #measures and years without any score give all-NaN slices
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(cube, axis=1, keepdims=True)
+        std = np.nanstd(cube, axis=1, keepdims=True)
+        z = np.where(std > 0, (cube - mean) / std, 0.0)
+        z = np.where(np.isnan(cube), np.nan, z)
+        return np.nanmean(z, axis=2)
+
+
+def plan_flags(df, years, contracts):
+    """
+    (years x contracts x 2) has_part_c and has_part_d of every contract and year, 0 when unknown.
+    """
+    flags = np.zeros((len(years), len(contracts), 2))
+    y = _codes(df['year'], years)
+    c = _codes(df['contract_id'].astype(str), contracts)
+    known = (y >= 0) & (c >= 0)
+    for k, col in enumerate(['has_part_c', 'has_part_d']):
+        np.maximum.at(flags[:, :, k], (y[known], c[known]), df[col].to_numpy(dtype=np.float64)[known])
+    return flags
+
+
+def state_features(enrollment, predictors, predictor_cols, years, contracts):
+    """
+    (years x contracts x predictors) enrollment weighted average of the state-level predictors over the
+    states each contract has members in. A year without predictor data uses the latest earlier year. NaN
+    where the contract has no members in a state with data.
+    """
+    states = [c for c in enrollment.columns if is_state_column(c)]
+
+    #(years x states x predictors), carried forward over years without data
+    all_years = sorted(set(years) | set(predictors['year'].unique()))
+    P = np.full((len(all_years), len(states), len(predictor_cols)), np.nan)
+    y = _codes(predictors['year'], all_years)
+    s = _codes(predictors['state_id'].astype(str), states)
+    known = s >= 0
+    P[y[known], s[known]] = predictors[predictor_cols].to_numpy(dtype=np.float64)[known]
+    for i in range(1, len(all_years)):
+        P[i] = np.where(np.isnan(P[i]), P[i - 1], P[i])
+    P = P[_codes(years, all_years)]
+
+    #(years x contracts x states) enrollment
+    E = np.zeros((len(years), len(contracts), len(states)))
+    y = _codes(enrollment['year'], years)
+    c = _codes(enrollment['contract_id'].astype(str), contracts)
+    known = (y >= 0) & (c >= 0)
+    E[y[known], c[known]] = np.nan_to_num(enrollment[states].to_numpy(dtype=np.float64)[known])
+
+    #weighted average over the states that have data for each predictor
+    valid = ~np.isnan(P)
+    num = np.einsum('ycs,ysk->yck', E, np.where(valid, P, 0.0))
+    den = np.einsum('ycs,ysk->yck', E, valid.astype(np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(den > 0, num / den, np.nan)
+
+
+class ForecastData:
+    """
+    Every feature of every contract and year, built once for all measures.
+      - scores: (years x contracts x measures)
+      - common: (years x contracts x features) features shared by every measure of a contract and year
+    """
+    def __init__(self, details, enrollment, predictors, predictor_cols):
+        self.years = sorted(details['year'].unique())
+        self.contracts = sorted(details['contract_id'].astype(str).unique())
+        self.measures = list(pd.unique(details['measure'].astype(str)))
+        self.scores = score_cube(details, self.years, self.contracts, self.measures)
+
+        quality = standardized_quality(self.scores)[:, :, None]
+        flags = plan_flags(details, self.years, self.contracts)
+        states = state_features(enrollment, predictors, predictor_cols, self.years, self.contracts)
+        self.common = np.concatenate([quality, flags, states], axis=2)
+        self.common_names = ['quality', 'has_part_c', 'has_part_d'] + list(predictor_cols)
+
+    def features(self, m, t):
+        """
+        Features of measure m for predicting year index t (from year index t - 1 and earlier), for every
+        contract: (contracts x features) and the previous year's score.
+        """
+        lag1 = self.scores[t - 1, :, m]
+        lag2 = self.scores[t - 2, :, m] if t >= 2 else np.full(len(self.contracts), np.nan)
+        missing2 = np.isnan(lag2)
+        X = np.column_stack([lag1, lag2, missing2, self.common[t - 1]])
+        return X, lag1
+
+    def training_set(self, m):
+        """
+        Rows of measure m with a score and a previous year score: X, y and the year of each row, plus the
+        features for the year after the last one and which contracts can be predicted.
+        """
+        X, y, groups = [], [], []
+        for t in range(1, len(self.years)):
+            features, lag1 = self.features(m, t)
+            target = self.scores[t, :, m]
+            rows = ~np.isnan(target) & ~np.isnan(lag1)
+            X.append(features[rows])
+            y.append(target[rows])
+            groups.append(np.full(rows.sum(), self.years[t]))
+        X_next, lag1 = self.features(m, len(self.years))
+        width = X_next.shape[1]
+        return (np.concatenate(X) if X else np.empty((0, width)), np.concatenate(y) if y else np.empty(0),
+                np.concatenate(groups) if groups else np.empty(0), X_next, ~np.isnan(lag1))
+
+
+class Ridge:
+    """
+    Ridge regression on standardized features, with NaNs filled by the training means.
+    """
+    def fit(self, X, y, alpha):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.mean = np.nanmean(X, axis=0)
+        self.mean = np.where(np.isnan(self.mean), 0.0, self.mean)
+        X = self._fill(X)
+        self.std = X.std(axis=0)
+        self.std[self.std == 0] = 1.0
+        Xs = (X - self.mean) / self.std
+        self.intercept = y.mean()
+        self.coef = np.linalg.solve(Xs.T @ Xs + alpha * np.eye(Xs.shape[1]), Xs.T @ (y - self.intercept))
+        return self
+
+    def _fill(self, X):
+        return np.where(np.isnan(X), self.mean, X)
+
+    def predict(self, X):
+        return self.intercept + ((self._fill(X) - self.mean) / self.std) @ self.coef
+
+
+def _rmse(a, b):
+    return float(np.sqrt(np.mean((a - b) ** 2))) if len(a) else np.nan
+
+
+def cross_validate(X, y, groups, alphas=ALPHAS):
+    """
+    Rolling-origin cross-validation: every year after the first is validated with a model trained on the
+    years before it. Returns the RMSE of each alpha and of carrying the previous year's score forward.
+    """
+    errors = {alpha: [] for alpha in alphas}
+    baseline, n = [], []
+    for year in np.unique(groups)[1:]:
+        train, valid = groups < year, groups == year
+        if train.sum() < MIN_TRAIN_ROWS or valid.sum() == 0:
+            continue
+        for alpha in alphas:
+            model = Ridge().fit(X[train], y[train], alpha)
+            errors[alpha].append(_rmse(model.predict(X[valid]), y[valid]) ** 2 * valid.sum())
+        baseline.append(_rmse(X[valid, 0], y[valid]) ** 2 * valid.sum())
+        n.append(valid.sum())
+    if not n:
+        return {alpha: np.nan for alpha in alphas}, np.nan
+    total = sum(n)
+    return ({alpha: float(np.sqrt(sum(e) / total)) for alpha, e in errors.items()},
+            float(np.sqrt(sum(baseline) / total)))
+
+
+def fit_measure(task):
+    """
+    Cross-validate, train and predict one measure. task is (measure, X, y, groups, X_next, predictable);
+    runs in a worker process.
+    """
+    measure, X, y, groups, X_next, predictable = task
+    result = {'measure': measure, 'rows': len(y), 'alpha': np.nan, 'cv_rmse': np.nan, 'baseline_rmse': np.nan,
+              'predictions': np.full(len(X_next), np.nan)}
+    if len(y) < MIN_TRAIN_ROWS:
+        return result
+    cv, baseline = cross_validate(X, y, groups)
+    alpha = min(cv, key=lambda a: cv[a]) if not np.isnan(list(cv.values())).all() else DEFAULT_ALPHA
+    model = Ridge().fit(X, y, alpha)
+    result.update(alpha=alpha, cv_rmse=cv[alpha], baseline_rmse=baseline,
+                  predictions=np.where(predictable, model.predict(X_next), np.nan))
+    return result
+
+
+def load_forecast_data(details_url=DETAILS_URL, enrollment_url=ENROLLMENT_URL, predictors_url=PREDICTORS_URL):
+    """
+    ForecastData from the contract details, contract enrollment and state predictor datasets.
+    """
+    details = load_data(details_url, columns=['year', 'contract_id', 'measure', 'score', 'has_part_c', 'has_part_d'])
+    enrollment_cols = dataset_columns(enrollment_url)
+    enrollment = load_data(enrollment_url, columns=['year', 'contract_id'] + [c for c in enrollment_cols if is_state_column(c)])
+    #predictors are every column of the correlations dataset that is not a measure
+    predictor_cols = [c for c in dataset_columns(predictors_url)
+                      if c not in ('year', 'state_id') and not c.startswith(('C-', 'D-'))]
+    predictors = load_data(predictors_url, columns=['year', 'state_id'] + predictor_cols)
+    return ForecastData(details, enrollment, predictors, predictor_cols)
+
+
+def forecast(data, workers=None):
+    """
+    Train every measure of data and predict the year after its last year. Returns the predictions (one
+    row per contract with a score the last year, one column per measure) and a df of each measure's
+    training rows, alpha and cross-validated RMSE next to the RMSE of carrying the last score forward.
+    """
+    tasks = [(measure,) + data.training_set(m) for m, measure in enumerate(data.measures)]
+    if workers == 1:
+        results = [fit_measure(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(fit_measure, tasks))
+
+    predictions = pd.DataFrame({r['measure']: r['predictions'] for r in results}, index=data.contracts)
+    active = ~np.isnan(data.scores[-1]).all(axis=1)
+    predictions = predictions[active]
+    report = pd.DataFrame([{k: v for k, v in r.items() if k != 'predictions'} for r in results])
+    return predictions, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the measure score forecasts and predict next year.")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--output', help="where to write the predictions (default: data/Complete_<year>_pred.csv)")
+    parser.add_argument('--force', action='store_true', help="overwrite an existing predictions file")
+    args = parser.parse_args(argv)
+
+    data = load_forecast_data()
+    year = int(data.years[-1]) + 1
+    output = args.output or prediction_url(year)
+    if os.path.exists(output) and not args.force:
+        parser.error(f"{output} exists, pass --force to overwrite it")
+
+    predictions, report = forecast(data, args.workers)
+    print(report.to_string(index=False))
+    predictions.to_csv(output)
+    print(f"{output}: {len(predictions)} contracts, {predictions.notna().any().sum()} measures predicted for {year}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+Load test of the app with many concurrent sessions, without a browser or network.
+
+Each simulated session runs app.py with Streamlit's testing client and goes through a scripted sequence of
+widget interactions on all four pages (changing the explorer filters, opening and searching the measure
+PDFs, picking correlation measures and predictor groups, selecting a contract and simulating stars). Every
+interaction is one rerun of the script. The sessions of a concurrency level run in parallel threads of this
+process, sharing its dataset cache like the sessions of one server process, and the level reports the
+p50/p95/p99 rerun latency, the reruns per second and the peak resident memory.
+
+    python -m cms_stars.loadtest                         # 1, 2, 4 and 8 concurrent sessions
+    python -m cms_stars.loadtest --sessions 1 16 --rounds 2 --output benchmarks/loadtest.json
+
+Before the first level one session goes through the script once, so the levels measure a warm server; pass
+--cold to include the first loads of every dataset and index in the first level.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from cms_stars.profiling import resident_memory
+from cms_stars.warmup import PAGES
+
+APP_PATH = 'app.py'
+
+SESSIONS = (1, 2, 4, 8)
+
+#times each session goes through the script
+ROUNDS = 1
+
+#seconds a rerun may take before the testing client gives up on it
+TIMEOUT = 300
+
+#seconds between resident memory samples
+MEMORY_INTERVAL = 0.05
+
+#streamlit versions (major, minor) whose testing client _one_server() was checked against, as pinned in
+#requirements-loadtest.txt: [first, last]
+STREAMLIT_VERSIONS = ((1, 65), (1, 65))
+
+PERCENTILES = (50, 95, 99)
+
+
+def _pick(widget, rng):
+    #a random option of a selectbox or radio
+    return widget.set_value(widget.options[rng.integers(len(widget.options))])
+
+
+def _open(page):
+    return lambda at, rng: at.sidebar.selectbox[0].set_value(page)
+
+
+def _year(at, rng):
+    slider = at.sidebar.slider[0]
+    return slider.set_value(int(rng.integers(slider.min, slider.max + 1)))
+
+
+#the interactions of one session, in order: (page, step, action). Each action sets widgets on the testing
+#client and the harness then reruns the script.
+SCRIPT = [
+    (PAGES[0], 'open', _open(PAGES[0])),
+    (PAGES[0], 'year', _year),
+    (PAGES[0], 'plan type', lambda at, rng: _pick(at.sidebar.selectbox(key='1'), rng)),
+    (PAGES[0], 'state', lambda at, rng: _pick(at.sidebar.selectbox(key='3'), rng)),
+    (PAGES[0], 'quartile', lambda at, rng: _pick(at.sidebar.selectbox(key='2'), rng)),
+    (PAGES[0], 'group small contracts', lambda at, rng: at.sidebar.checkbox(key='fold').check()),
+    (PAGES[0], 'state shares', lambda at, rng: at.sidebar.checkbox(key='state_share').check()),
+    (PAGES[1], 'open', _open(PAGES[1])),
+    (PAGES[1], 'measure', lambda at, rng: _pick(at.sidebar.radio(key='pdf_measure'), rng)),
+    (PAGES[1], 'search', lambda at, rng: at.sidebar.text_input(key='pdf_query').input('diabetes')),
+    (PAGES[2], 'open', _open(PAGES[2])),
+    (PAGES[2], 'measure', lambda at, rng: _pick(at.sidebar.selectbox(key='1'), rng)),
+    (PAGES[2], 'predictor group', lambda at, rng: at.sidebar.checkbox(key=str(rng.integers(2, 11))).check()),
+    (PAGES[3], 'open', _open(PAGES[3])),
+    (PAGES[3], 'contract', lambda at, rng: _pick(at.sidebar.selectbox(key='3'), rng)),
+    (PAGES[3], 'simulation measure', lambda at, rng: _pick(at.selectbox(key='4'), rng)),
+    (PAGES[3], 'add to simulation', lambda at, rng: at.button(key='Store simulated value').click()),
+    (PAGES[3], 'trend measure', lambda at, rng: _pick(at.selectbox(key='trend_measure'), rng)),
+    (PAGES[3], 'clear simulation', lambda at, rng: at.button(key='Reset simulated value').click()),
+]
+
+
+def run_session(app_path=APP_PATH, rounds=ROUNDS, seed=0):
+    """
+    One session going through SCRIPT rounds times. Returns a list of {'page', 'step', 'seconds', 'error'}, one
+    per rerun; error is None or the message of the exception the app (or the step) raised.
+    """
+    from streamlit.testing.v1 import AppTest
+    rng = np.random.default_rng(seed)
+    reruns = []
+
+    at = AppTest.from_file(os.path.abspath(app_path), default_timeout=TIMEOUT)
+    start = time.perf_counter()
+    at.run()
+    reruns.append({'page': PAGES[0], 'step': 'new session', 'seconds': time.perf_counter() - start,
+                   'error': '; '.join(str(e.value) for e in at.exception) or None})
+
+    for _ in range(rounds):
+        for page, step, action in SCRIPT:
+            error = None
+            start = time.perf_counter()
+            try:
+                action(at, rng).run()
+                if len(at.exception):
+                    error = '; '.join(str(e.value) for e in at.exception)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            reruns.append({'page': page, 'step': step, 'seconds': time.perf_counter() - start, 'error': error})
+    return reruns
+
+
+def check_streamlit():
+    """
+    Raise a RuntimeError unless the installed streamlit is one of STREAMLIT_VERSIONS and has the private
+    testing client attributes _one_server() patches.
+    """
+    import streamlit
+    match = re.match(r'(\d+)\.(\d+)', streamlit.__version__)
+    first, last = STREAMLIT_VERSIONS
+    supported = f"{first[0]}.{first[1]} to {last[0]}.{last[1]}"
+    if match is None or not first <= (int(match[1]), int(match[2])) <= last:
+        raise RuntimeError(f"the load test supports streamlit {supported}, not {streamlit.__version__} "
+                           f"(pip install -r requirements-loadtest.txt)")
+    try:
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.scriptrunner import script_cache
+        from streamlit.testing.v1 import app_test, local_script_runner, util
+    except ImportError as e:
+        raise RuntimeError(f"streamlit {streamlit.__version__}'s testing client has changed: {e}") from e
+    patched = [(Runtime, '_instance'), (app_test, 'Runtime'), (local_script_runner, 'ScriptCache'),
+               (script_cache, 'ScriptCache'), (util, 'patch_config_options')]
+    missing = [f"{getattr(obj, '__name__', obj)}.{name}" for obj, name in patched if not hasattr(obj, name)]
+    if missing:
+        raise RuntimeError(f"streamlit {streamlit.__version__}'s testing client has changed: no {missing}")
+
+
+@contextmanager
+def _one_server():
+    """
+    Make the testing clients of concurrent sessions share what the sessions of one server share. Every run of
+    the testing client compiles app.py again, installs its own mock runtime as the process's runtime and turns
+    on a global test option, and clears the last two when it finishes, under the feet of the other sessions'
+    runs (concurrent compiles also race inside ast.parse on Python 3.11). Here all sessions use one compiled
+    script, and the first runtime installed and the test option stay in place until the level is over.
+    This patches private parts of the testing client, so check_streamlit() comes first.
+    """
+    check_streamlit()
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+    from streamlit.testing.v1.util import patch_config_options
+
+    class KeepRuntime(type):
+        def __setattr__(cls, name, value):
+            if name != '_instance':
+                super().__setattr__(name, value)
+            elif Runtime._instance is None:
+                Runtime._instance = value
+
+    class ServerRuntime(Runtime, metaclass=KeepRuntime):
+        pass
+
+    script_cache = ScriptCache()
+    originals = local_script_runner.ScriptCache, app_test.Runtime
+    local_script_runner.ScriptCache = lambda: script_cache
+    app_test.Runtime = ServerRuntime
+    try:
+        with patch_config_options({'global.appTest': True}):
+            yield
+    finally:
+        local_script_runner.ScriptCache, app_test.Runtime = originals
+        Runtime._instance = None
+
+
+class _MemoryMonitor:
+    """
+    Peak resident memory of the process while the monitor runs, sampled in a background thread.
+    """
+    def __init__(self, interval=MEMORY_INTERVAL):
+        self.interval = interval
+        self.peak = resident_memory()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            memory = resident_memory()
+            if memory is not None and (self.peak is None or memory > self.peak):
+                self.peak = memory
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def run_level(sessions, app_path=APP_PATH, rounds=ROUNDS, seed=0):
+    """
+    Run sessions concurrent sessions. Returns a df of every rerun (with its session) and a dict with the
+    wall time and the peak resident memory.
+    """
+    results = [None] * sessions
+
+    def session(i):
+        results[i] = run_session(app_path, rounds, seed + i)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    with _one_server(), _MemoryMonitor() as memory:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+    reruns = pd.DataFrame([dict(r, session=i) for i, rs in enumerate(results) for r in rs],
+                          columns=['session', 'page', 'step', 'seconds', 'error'])
+    return reruns, {'wall_s': wall, 'peak_rss': memory.peak}
+
+
+def summarize(reruns, level):
+    """
+    Given the reruns of a level and run_level()'s level info, return one row: reruns, errors, the latency
+    percentiles and max in ms, reruns per second and peak resident memory in MB.
+    """
+    ms = reruns['seconds'].to_numpy() * 1000
+    row = {'reruns': len(reruns), 'errors': int(reruns['error'].notna().sum())}
+    row.update({f'p{p}_ms': float(np.percentile(ms, p)) for p in PERCENTILES})
+    row['max_ms'] = float(ms.max())
+    row['reruns_per_s'] = len(reruns) / level['wall_s']
+    row['peak_rss_mb'] = level['peak_rss'] / 2**20 if level['peak_rss'] is not None else np.nan
+    return row
+
+
+def step_latencies(reruns):
+    """
+    Median and p95 latency in ms of each page and step.
+    """
+    ms = reruns.assign(ms=reruns['seconds'] * 1000).groupby(['page', 'step'], sort=False)['ms']
+    return pd.DataFrame({'median_ms': ms.median(), 'p95_ms': ms.quantile(0.95)}).reset_index()
+
+
+def load_test(levels=SESSIONS, app_path=APP_PATH, rounds=ROUNDS, cold=False):
+    """
+    Run every concurrency level in turn. Returns a df with one summarize() row per level, the reruns of
+    the last level, and the first error message seen (None if there was none).
+    """
+    if not cold:
+        run_level(1, app_path)
+
+    rows, reruns, first_error = [], None, None
+    for sessions in levels:
+        reruns, level = run_level(sessions, app_path, rounds)
+        rows.append({'sessions': sessions, **summarize(reruns, level)})
+        errors = reruns['error'].dropna()
+        if first_error is None and len(errors):
+            first_error = errors.iloc[0]
+    return pd.DataFrame(rows), reruns, first_error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the app with concurrent headless sessions.")
+    parser.add_argument('--sessions', type=int, nargs='+', default=list(SESSIONS), help="concurrency levels")
+    parser.add_argument('--rounds', type=int, default=ROUNDS, help="times each session goes through the script")
+    parser.add_argument('--app', default=APP_PATH, help="path of the Streamlit app")
+    parser.add_argument('--cold', action='store_true', help="do not warm up the process before the first level")
+    parser.add_argument('--output', help="also write the results as JSON to this path")
+    args = parser.parse_args(argv)
+    try:
+        check_streamlit()
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    summary, last, first_error = load_test(args.sessions, args.app, args.rounds, args.cold)
+    print(summary.to_string(index=False, float_format='{:.1f}'.format))
+    print(f"\nlatency by step with {args.sessions[-1]} sessions")
+    print(step_latencies(last).to_string(index=False, float_format='{:.1f}'.format))
+    if first_error is not None:
+        print(f"\nfirst error: {first_error}")
+
+    if args.output:
+        from cms_stars.benchmark import machine_info
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'created': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'machine': machine_info(),
+                       'rounds': args.rounds, 'levels': summary.to_dict('records')}, f, indent=1)
+        print(f"{args.output}: {len(summary)} levels")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Full-text search over the measure specification PDFs.
+
+The index is built offline from every static/measure_pdfs_<year>/ folder and saved as gzipped JSON. It
+holds, per PDF, its year, file signature and content hash, the word count of each page and an inverted
+index of the PDF (term -> [[page, count], ...]). Rebuilding only extracts text from PDFs that are new or
+whose content changed, and drops PDFs that were removed, so adding a new year's folder only indexes that
+folder.
+
+    python -m cms_stars.pdf_search                       # build or update the index
+    python -m cms_stars.pdf_search --search "hospice"    # query it from the command line
+
+The app loads the index lazily on the first search (and again only when the file changes) and ranks
+pages with BM25. Text extraction needs pypdf; searching an existing index does not.
+"""
+import argparse
+import glob
+import gzip
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from cms_stars.data import file_digest, file_signature
+from cms_stars.pdfs import STATIC_DIR
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+#folders of measure PDFs, one per year
+PDF_FOLDERS = os.path.join(STATIC_DIR, 'measure_pdfs_*')
+
+INDEX_PATH = 'data/pdf_index.json.gz'
+
+INDEX_VERSION = 1
+
+#BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_index_lock = threading.Lock()
+_index = {'signature': None, 'search': None}
+
+
+def tokenize(text):
+    """
+    Lowercase words and numbers of text, ignoring single characters.
+    """
+    return [t for t in re.findall(r'[a-z0-9]+', text.lower()) if len(t) > 1]
+
+
+def pdf_year(path):
+    """
+    Year of a PDF from its folder name (measure_pdfs_<year>), None if there is none.
+    """
+    match = re.search(r'_(\d{4})$', os.path.basename(os.path.dirname(path)))
+    return int(match.group(1)) if match else None
+
+
+def index_pdf(path):
+    """
+    Extract the text of every page of the PDF at path and return its page word counts and inverted index.
+    """
+    if pypdf is None:
+        raise ImportError("Building the PDF search index needs pypdf (pip install pypdf)")
+    page_lengths = []
+    postings = defaultdict(list)
+    for page, pdf_page in enumerate(pypdf.PdfReader(path).pages, start=1):
+        tokens = tokenize(pdf_page.extract_text() or '')
+        page_lengths.append(len(tokens))
+        for term, count in Counter(tokens).items():
+            postings[term].append([page, count])
+    return {'page_lengths': page_lengths, 'postings': dict(postings)}
+
+
+def read_index(index_path=INDEX_PATH):
+    """
+    The saved index, or an empty one if there is none (or it was written by another version).
+    """
+    if os.path.exists(index_path):
+        with gzip.open(index_path, 'rt', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == INDEX_VERSION:
+            return index
+    return {'version': INDEX_VERSION, 'documents': {}}
+
+
+def build_index(folders=PDF_FOLDERS, index_path=INDEX_PATH):
+    """
+    Build or update the index at index_path from the PDFs in folders (a glob pattern). PDFs whose size and
+    mtime, or failing that content hash, are unchanged are not read again.
+
+    Returns the lists of added, updated and removed PDFs.
+    """
+    index = read_index(index_path)
+    documents = index['documents']
+    paths = sorted(glob.glob(os.path.join(folders, '*.pdf')))
+    keys = {os.path.relpath(p, STATIC_DIR).replace(os.sep, '/'): p for p in paths}
+
+    added, updated, touched = [], [], []
+    for key, path in keys.items():
+        signature = list(file_signature(path))
+        document = documents.get(key)
+        if document is not None and document['signature'] == signature:
+            continue
+        digest = file_digest(path)
+        if document is not None and document['digest'] == digest:
+            #only the mtime moved, remember the new signature so the file is not hashed again
+            document['signature'] = signature
+            touched.append(key)
+            continue
+        (updated if document is not None else added).append(key)
+        documents[key] = {'file': os.path.basename(path), 'year': pdf_year(path),
+                          'signature': signature, 'digest': digest, **index_pdf(path)}
+
+    removed = [key for key in documents if key not in keys]
+    for key in removed:
+        del documents[key]
+
+    if added or updated or removed or touched or not os.path.exists(index_path):
+        _write_index(index, index_path)
+    return added, updated, removed
+
+
+def _write_index(index, index_path):
+    os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+    tmp_path = index_path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_path, index_path)
+
+
+class PdfSearch:
+    """
+    BM25 search over the pages of every indexed PDF.
+    """
+    def __init__(self, index):
+        self.documents = list(index['documents'].values())
+        self.page_lengths = {}
+        self.postings = defaultdict(list)
+        for doc_id, document in enumerate(self.documents):
+            for page, length in enumerate(document['page_lengths'], start=1):
+                self.page_lengths[doc_id, page] = length
+            for term, pages in document['postings'].items():
+                self.postings[term].extend((doc_id, page, count) for page, count in pages)
+        self.n_pages = len(self.page_lengths)
+        self.avg_length = sum(self.page_lengths.values()) / self.n_pages if self.n_pages else 0.0
+
+    def search_pages(self, query, year=None, limit=20):
+        """
+        Pages matching query, best first: a df with file, year, page and score.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            pages = [p for p in self.postings.get(term, ())
+                     if year is None or self.documents[p[0]]['year'] == year]
+            if not pages:
+                continue
+            idf = math.log(1 + (self.n_pages - len(pages) + 0.5) / (len(pages) + 0.5))
+            for doc_id, page, count in pages:
+                norm = K1 * (1 - B + B * self.page_lengths[doc_id, page] / self.avg_length)
+                scores[doc_id, page] += idf * count * (K1 + 1) / (count + norm)
+
+        best = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+        return pd.DataFrame([{'file': self.documents[doc_id]['file'], 'year': self.documents[doc_id]['year'],
+                              'page': page, 'score': score} for (doc_id, page), score in best],
+                            columns=['file', 'year', 'page', 'score'])
+
+    def search_documents(self, query, year=None, limit=10):
+        """
+        PDFs matching query, best first: a df with file, year, score (of the best page), page (the best
+        page) and pages (every matching page, best first).
+        """
+        pages = self.search_pages(query, year, limit=None)
+        if len(pages) == 0:
+            return pd.DataFrame(columns=['file', 'year', 'score', 'page', 'pages'])
+        result = pages.groupby(['file', 'year'], sort=False).agg(score=('score', 'first'), page=('page', 'first'),
+                                                                pages=('page', list)).reset_index()
+        return result.head(limit)
+
+
+def pdf_search(index_path=INDEX_PATH):
+    """
+    The PdfSearch of the saved index, loaded on first use and again only when the file changes. None when
+    the index has not been built.
+    """
+    if not os.path.exists(index_path):
+        return None
+    signature = file_signature(index_path)
+    with _index_lock:
+        if _index['signature'] != signature:
+            _index['search'] = PdfSearch(read_index(index_path))
+            _index['signature'] = signature
+        return _index['search']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the full-text search index of the measure PDFs.")
+    parser.add_argument('--folders', default=PDF_FOLDERS, help="glob of the PDF folders to index")
+    parser.add_argument('--index', default=INDEX_PATH, help="where to write the index")
+    parser.add_argument('--search', help="search the index instead of building it")
+    args = parser.parse_args(argv)
+
+    if args.search:
+        search = pdf_search(args.index)
+        if search is None:
+            parser.error(f"no index at {args.index}, build it first")
+        print(search.search_pages(args.search).to_string(index=False))
+        return
+
+    added, updated, removed = build_index(args.folders, args.index)
+    print(f"{args.index}: {len(added)} added, {len(updated)} updated, {len(removed)} removed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Serving the measure documentation PDFs.
+
+The PDFs live under static/, which the Streamlit server serves at app/static/ when static serving is on
+(see .streamlit/config.toml). The page then only sends an iframe pointing at that URL, and the browser's
+PDF viewer fetches the file itself with byte range requests and caching headers, so nothing about the PDF
+goes through the websocket.
+
+When static serving is off, the PDF is embedded as a base64 data URI as before. The encoded payloads of
+the most recently opened PDFs are kept in a small LRU, so reruns do not read and encode the file again.
+
+A first page thumbnail can be rendered with PyMuPDF when it is installed.
+"""
+import base64
+import os
+from functools import lru_cache
+
+from cms_stars.data import file_signature
+
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+#folder served by the Streamlit server at STATIC_URL
+STATIC_DIR = 'static'
+STATIC_URL = 'app/static/'
+
+#folder of the 2022 measure PDFs
+PDF_DIR = os.path.join(STATIC_DIR, 'measure_pdfs_2022')
+
+#number of encoded PDFs kept in memory when they have to be embedded
+PAYLOAD_CACHE_SIZE = 8
+
+
+def pdf_path(file_name):
+    """
+    Path of a measure PDF from its file name.
+    """
+    return os.path.join(PDF_DIR, file_name)
+
+
+def static_url(path):
+    """
+    URL the Streamlit server serves a file under STATIC_DIR at, relative to the app.
+    """
+    return STATIC_URL + os.path.relpath(path, STATIC_DIR).replace(os.sep, '/')
+
+
+@lru_cache(maxsize=PAYLOAD_CACHE_SIZE)
+def _encoded_pdf(path, signature):
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+
+def encoded_pdf(path):
+    """
+    The base64 encoded PDF at path, from the LRU of recently opened PDFs. Entries are keyed by the file's
+    mtime and size, so a replaced file is encoded again.
+    """
+    return _encoded_pdf(path, file_signature(path))
+
+
+def pdf_iframe(path, static_serving=True, page=None, width=700, height=1000):
+    """
+    HTML iframe displaying the PDF at path, opened at page if given. With static_serving, the iframe points
+    at the served file; otherwise the PDF is embedded as a data URI.
+    """
+    if static_serving:
+        src = static_url(path)
+    else:
+        src = f"data:application/pdf;base64,{encoded_pdf(path)}"
+    if page is not None:
+        src += f"#page={page}"
+    return f'<iframe src="{src}" width="{width}" height="{height}" type="application/pdf"></iframe>'
+
+
+def thumbnails_available():
+    """
+    Whether first page thumbnails can be rendered (PyMuPDF is installed).
+    """
+    return fitz is not None
+
+
+@lru_cache(maxsize=64)
+def _thumbnail(path, signature, width):
+    with fitz.open(path) as doc:
+        page = doc[0]
+        zoom = width / page.rect.width
+        return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).tobytes('png')
+
+
+def pdf_thumbnail(path, width=300):
+    """
+    PNG bytes of the first page of the PDF at path, width pixels wide. None when PyMuPDF is not installed.
+    """
+    if fitz is None:
+        return None
+    return _thumbnail(path, file_signature(path), width)
@@ -0,0 +1,168 @@
+"""
+Improvement planner: the least effort set of measure star increases that reaches a summary or overall star.
+
+The summary and overall stars are weighted averages of measure stars, so raising measure i by k stars adds
+weight_i * k to the weighted sum while the total weight stays the same. Each measure has one option per
+possible increase with an effort (how far the score is from the target star's cut point), which makes
+finding the cheapest plan for every reachable star a multiple-choice knapsack. It is solved exactly with
+dynamic programming over the (integer) weighted star gain, one vectorized step per measure.
+
+Effort is the score distance to the target star's cut point, divided by the distance between the measure's
+2 star and 5 star cut points. It is comparable across measures: moving a measure from the 2 star cut point
+to the 5 star cut point costs 1.
+"""
+import numpy as np
+import pandas as pd
+
+from cms_stars.cutpoints import use_pdp_cutpoints
+from cms_stars.stars import STAR_TYPES, star_type_mask
+
+#weights are multiples of 0.5, so weighted star gains are integers once doubled
+GAIN_SCALE = 2
+
+
+def improvement_options(df, thresholds):
+    """
+    Given a df of a single contract and year's measure stars and CutPointIndex.measure_thresholds(), return a
+    df with one row per measure and possible increase: measure, star (current), new_star, effort.
+    Measures without a score or star, or already at 5 stars, have no options.
+    """
+    rows = []
+    for measure, score, star in zip(df['measure'], df['score'], df['star']):
+        if measure not in thresholds or np.isnan(score) or np.isnan(star) or star >= 5:
+            continue
+        higher_is_better, cuts = thresholds[measure]
+        spread = abs(cuts[3] - cuts[0]) or 1.0
+        for new_star in range(int(star) + 1, 6):
+            gap = cuts[new_star - 2] - score if higher_is_better else score - cuts[new_star - 2]
+            rows.append({'measure': measure, 'star': star, 'new_star': new_star,
+                         'effort': max(gap, 0.0) / spread})
+    return pd.DataFrame(rows, columns=['measure', 'star', 'new_star', 'effort'])
+
+
+def _knapsack(gains, efforts, max_gain):
+    """
+    Multiple-choice knapsack over measures. gains/efforts are lists (one per measure) of arrays with the
+    integer gain and the effort of each option. Returns the minimum effort for every total gain (inf where
+    unreachable) and, per measure, the option picked for every total gain (-1 = no change).
+    """
+    best = np.full(max_gain + 1, np.inf)
+    best[0] = 0.0
+    choices = []
+    for option_gains, option_efforts in zip(gains, efforts):
+        new_best = best.copy()
+        choice = np.full(max_gain + 1, -1, dtype=np.int8)
+        for j, (g, e) in enumerate(zip(option_gains, option_efforts)):
+            if g <= 0:
+                continue
+            candidate = np.full(max_gain + 1, np.inf)
+            candidate[g:] = best[:-g] + e
+            better = candidate < new_best
+            new_best[better] = candidate[better]
+            choice[better] = j
+        best = new_best
+        choices.append(choice)
+    return best, choices
+
+
+def plan_improvements(df, thresholds, star_type='overall', star_col='star', weight_col='weight'):
+    """
+    Given a df of a single contract and year's measure stars and CutPointIndex.measure_thresholds(), return the
+    Pareto frontier of effort versus the resulting star_type star: one row per plan where no cheaper plan reaches an
+    equal or higher raw star.
+
+    Each row has the effort, the raw and rounded star_type star, the resulting rounded part_c, part_d and
+    overall stars, and the plan as {measure: new star}.
+    """
+    options = improvement_options(df, thresholds)
+    mask = star_type_mask(df, star_type)
+
+    stars = df[star_col].to_numpy(dtype=np.float64)
+    weights = df[weight_col].to_numpy(dtype=np.float64)
+    weight_of = dict(zip(df['measure'], weights))
+    starred = ~np.isnan(stars) & ~np.isnan(weights)
+
+    #measures that count towards star_type and can improve
+    in_type = set(df['measure'][mask & starred])
+    options = options[options['measure'].isin(in_type)]
+    measures = list(pd.unique(options['measure']))
+    gains, efforts, new_stars = [], [], []
+    for measure in measures:
+        o = options[options['measure'] == measure]
+        gains.append(np.rint((o['new_star'] - o['star']).to_numpy() * weight_of[measure] * GAIN_SCALE).astype(int))
+        efforts.append(o['effort'].to_numpy())
+        new_stars.append(o['new_star'].to_numpy())
+
+    max_gain = int(sum(g.max() for g in gains)) if gains else 0
+    best, choices = _knapsack(gains, efforts, max_gain)
+
+    #Pareto frontier: keep a gain only if every larger gain costs strictly more
+    later_min = np.minimum.accumulate(best[::-1])[::-1]
+    frontier = [g for g in range(max_gain + 1)
+                if np.isfinite(best[g]) and (g == max_gain or best[g] < later_min[g + 1])]
+
+    #star increase of every measure (columns, in df order) in every frontier plan (rows)
+    position = {m: i for i, m in enumerate(df['measure'])}
+    plans = [_backtrack(g, gains, choices, measures, new_stars) for g in frontier]
+    increases = np.zeros((len(plans), len(df)))
+    for row, plan in enumerate(plans):
+        for measure, new_star in plan.items():
+            increases[row, position[measure]] = new_star - stars[position[measure]]
+
+    result = pd.DataFrame({'effort': best[frontier]})
+    for t in STAR_TYPES:
+        weights_t = np.where(star_type_mask(df, t) & starred, weights, 0.0)
+        weight_total = weights_t.sum()
+        if weight_total > 0:
+            raw = (np.nansum(stars * weights_t) + increases @ weights_t) / weight_total
+        else:
+            raw = np.full(len(plans), np.nan)
+        if t == star_type:
+            result[t + '_raw'] = raw
+        result[t + '_rounded'] = np.round(raw * 2) / 2
+    result['plan'] = plans
+    return result
+
+
+def _backtrack(gain, gains, choices, measures, new_stars):
+    plan = {}
+    for i in range(len(measures) - 1, -1, -1):
+        j = choices[i][gain]
+        if j >= 0:
+            plan[measures[i]] = int(new_stars[i][j])
+            gain -= gains[i][j]
+    return plan
+
+
+def cheapest_plans(frontier, star_type='overall'):
+    """
+    From a plan_improvements() frontier, keep the cheapest plan for each reachable rounded star_type star.
+    """
+    if len(frontier) == 0:
+        return frontier
+    col = star_type + '_rounded'
+    return frontier.sort_values('effort').drop_duplicates(col).sort_values(col).reset_index(drop=True)
+
+
+def plan_portfolio(df, cut_index, year, target, star_type='overall'):
+    """
+    Given the measure stars of many contracts and a CutPointIndex, return one row per contract of year with its current rounded
+    star_type star and the effort and plan of the cheapest way to reach at least target stars (NaN effort
+    when target cannot be reached).
+    """
+    df = df[df['year'] == year]
+    thresholds = {use_PDP: cut_index.measure_thresholds(year, use_PDP) for use_PDP in (0, 1)}
+
+    rows = []
+    for contract, contract_df in df.groupby('contract_id', observed=True, sort=True):
+        use_PDP = use_pdp_cutpoints(contract_df['has_part_c'].iloc[0], contract_df['has_part_d'].iloc[0])
+        frontier = plan_improvements(contract_df, thresholds[use_PDP], star_type)
+        row = {'contract_id': contract, 'current': np.nan, 'effort': np.nan, 'plan': None}
+        if len(frontier) > 0:
+            row['current'] = frontier[star_type + '_rounded'].iloc[0]
+            reached = frontier[frontier[star_type + '_rounded'] >= target]
+            if len(reached) > 0:
+                row['effort'] = reached['effort'].iloc[0]
+                row['plan'] = reached['plan'].iloc[0]
+        rows.append(row)
+    return pd.DataFrame(rows)
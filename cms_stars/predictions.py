@@ -0,0 +1,109 @@
+"""
+Prediction store: predicted measure scores of every contract, one file per prediction year.
+
+data/Complete_<year>_pred.csv has one row per contract (contract id in the first column) and one column
+per measure. Each file is loaded once per version into a dense float matrix, with dicts mapping contract
+ids to rows and measures to columns, so every lookup is plain array indexing instead of a pandas label
+lookup. Files for new prediction years are picked up as soon as they are added to data/.
+"""
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from cms_stars.data import derived, load_data
+
+PREDICTIONS_PATTERN = 'data/Complete_{year}_pred.csv'
+
+
+def prediction_url(year):
+    """
+    Path of the predictions file of a prediction year.
+    """
+    return PREDICTIONS_PATTERN.format(year=year)
+
+
+def prediction_years():
+    """
+    Sorted prediction years that have a predictions file.
+    """
+    years = []
+    for path in glob.glob(prediction_url('*')):
+        match = re.search(r'(\d{4})', os.path.basename(path))
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+
+class PredictionStore:
+    """
+    Predicted score of every contract and measure of one prediction year.
+      - values: (contracts x measures) float matrix, NaN where there is no prediction
+      - contracts, measures: row and column labels
+      - contract_rows, measure_cols: label -> position
+    """
+    def __init__(self, df, year=None):
+        self.year = year
+        contract_col = df.columns[0]
+        self.contracts = df[contract_col].astype(str).to_numpy()
+        self.measures = np.asarray(df.columns[1:], dtype=object)
+        self.values = df[list(self.measures)].to_numpy(dtype=np.float64)
+        self.contract_rows = {c: i for i, c in enumerate(self.contracts)}
+        self.measure_cols = {m: j for j, m in enumerate(self.measures)}
+
+    def get(self, contract, measure):
+        """
+        Predicted score of one contract and measure, NaN when there is none.
+        """
+        i = self.contract_rows.get(contract)
+        j = self.measure_cols.get(measure)
+        if i is None or j is None:
+            return np.nan
+        return self.values[i, j]
+
+    def contract_predictions(self, contract):
+        """
+        Series of the predicted scores of one contract by measure (empty when the contract is unknown).
+        """
+        i = self.contract_rows.get(contract)
+        if i is None:
+            return pd.Series(dtype=np.float64)
+        return pd.Series(self.values[i], index=self.measures)
+
+    def measure_predictions(self, measure):
+        """
+        Series of the predicted scores of one measure by contract (empty when the measure is unknown).
+        """
+        j = self.measure_cols.get(measure)
+        if j is None:
+            return pd.Series(dtype=np.float64)
+        return pd.Series(self.values[:, j], index=self.contracts)
+
+    def lookup(self, contracts, measures):
+        """
+        Predicted scores of many (contract, measure) pairs given as two arrays of equal length, NaN for
+        unknown contracts or measures.
+        """
+        rows = np.fromiter((self.contract_rows.get(c, -1) for c in contracts), dtype=np.int64)
+        cols = np.fromiter((self.measure_cols.get(m, -1) for m in measures), dtype=np.int64)
+        known = (rows >= 0) & (cols >= 0)
+        result = np.full(len(rows), np.nan)
+        result[known] = self.values[rows[known], cols[known]]
+        return result
+
+
+def _build_prediction_store(DATA_URL, year):
+    return PredictionStore(load_data(DATA_URL), year)
+
+
+def prediction_store(year):
+    """
+    The PredictionStore of a prediction year, loaded once per version of its file. None when the year has
+    no predictions file.
+    """
+    url = prediction_url(year)
+    if not os.path.exists(url):
+        return None
+    return derived(url, 'prediction_store', _build_prediction_store, url, year)
@@ -0,0 +1,180 @@
+"""
+Opt-in timing of the named stages of each rerun.
+
+app.py creates one Profiler per rerun and wraps each stage of the selected page (loading data, filtering,
+building figures, rendering tables, ...) in profiler.span(name). When profiling is on, every span records
+its wall time and the change in the process's resident memory (RSS, which includes whatever the other
+sessions of the server allocated meanwhile), and the spans of the rerun are shown in a sidebar panel and
+optionally appended to a JSON lines log. Fragments rerun without the rest of the page, so each run of a
+fragment has its own Profiler (logged as page "<page> / <fragment>") and its panel in the fragment. When it is off, span() returns one shared context manager that
+does nothing, so the instrumented code costs a method call per stage.
+
+Profiling is turned on with the CMS_STARS_PROFILE environment variable or the ?profile=1 query parameter,
+and the log is written when CMS_STARS_PROFILE_LOG is set to a file path. To summarize a log:
+
+    python -m cms_stars.profiling profile.jsonl
+    python -m cms_stars.profiling profile.jsonl --page "Contract Star Details"
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PROFILE_ENV = 'CMS_STARS_PROFILE'
+LOG_ENV = 'CMS_STARS_PROFILE_LOG'
+
+#returned by span() when profiling is off
+_DISABLED = nullcontext()
+
+#appends from concurrent sessions go through one lock so their lines do not interleave
+_log_lock = threading.Lock()
+
+
+def profiling_requested(query_params=None):
+    """
+    Whether profiling was turned on, by the environment or by the profile query parameter.
+    """
+    if os.environ.get(PROFILE_ENV, '').lower() in ('1', 'true', 'yes'):
+        return True
+    return query_params is not None and query_params.get('profile') in ('1', 'true')
+
+
+def resident_memory():
+    """
+    Resident memory of this process in bytes, None where it cannot be measured.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class _Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.depth = len(self.profiler.stack)
+        self.profiler.stack.append(self.name)
+        self.memory = resident_memory()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        memory = resident_memory()
+        self.profiler.stack.pop()
+        self.profiler.spans.append({
+            'stage': self.name,
+            'depth': self.depth,
+            'start_s': self.start - self.profiler.start,
+            'seconds': seconds,
+            'memory_delta': None if memory is None or self.memory is None else memory - self.memory,
+        })
+        return False
+
+
+class Profiler:
+    """
+    Spans of the stages of one rerun of page. Spans can be nested; each records its depth in the nesting.
+    """
+    def __init__(self, page, enabled=False, log_path=None):
+        self.page = page
+        self.enabled = enabled
+        self.log_path = log_path
+        self.spans = []
+        self.stack = []
+        self.start = time.perf_counter()
+
+    def span(self, name):
+        """
+        Context manager timing the stage name, e.g. with profiler.span('treemap figure'): ...
+        """
+        if not self.enabled:
+            return _DISABLED
+        return _Span(self, name)
+
+    def table(self):
+        """
+        df of the recorded spans in the order they started, with stage names indented by depth. process_rss_mb
+        is the change in the process's resident memory during the span, not the span's own allocations.
+        """
+        df = pd.DataFrame(sorted(self.spans, key=lambda s: s['start_s']),
+                          columns=['stage', 'depth', 'start_s', 'seconds', 'memory_delta'])
+        df['stage'] = ['  ' * d + s for s, d in zip(df['stage'], df['depth'])]
+        df['ms'] = df['seconds'] * 1000
+        df['process_rss_mb'] = df['memory_delta'] / 2**20
+        return df[['stage', 'ms', 'process_rss_mb']]
+
+    def total(self):
+        """
+        Seconds since the rerun started.
+        """
+        return time.perf_counter() - self.start
+
+    def write_log(self):
+        """
+        Append one line per span to the log file, if there is one.
+        """
+        if not self.enabled or not self.log_path or not self.spans:
+            return
+        created = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+        lines = [json.dumps({'time': created, 'page': self.page, **s}) for s in self.spans]
+        with _log_lock, open(self.log_path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def rerun_profiler(page, query_params=None):
+    """
+    Profiler for a rerun of page, enabled when profiling_requested() and logging to CMS_STARS_PROFILE_LOG.
+    """
+    enabled = profiling_requested(query_params)
+    return Profiler(page, enabled, os.environ.get(LOG_ENV) if enabled else None)
+
+
+def read_log(path):
+    """
+    The spans appended to the log at path, one row per span.
+    """
+    return pd.read_json(path, lines=True)
+
+
+def summarize(spans):
+    """
+    Given a df of logged spans, return the number of calls and the median, p95 and max milliseconds of each
+    page and stage, slowest median first.
+    """
+    ms = spans.assign(ms=spans['seconds'] * 1000).groupby(['page', 'stage'])['ms']
+    summary = pd.DataFrame({'calls': ms.size(), 'median_ms': ms.median(), 'p95_ms': ms.quantile(0.95),
+                            'max_ms': ms.max()})
+    return summary.sort_values('median_ms', ascending=False).reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a profiling log of the app's reruns.")
+    parser.add_argument('log', help="JSON lines log written with CMS_STARS_PROFILE_LOG")
+    parser.add_argument('--page', help="only this page's stages")
+    args = parser.parse_args(argv)
+
+    spans = read_log(args.log)
+    if args.page:
+        spans = spans[spans['page'] == args.page]
+    print(summarize(spans).to_string(index=False, float_format='{:.1f}'.format))
+
+
+if __name__ == '__main__':
+    main()
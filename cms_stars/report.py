@@ -0,0 +1,294 @@
+"""
+Contract reports: the tables of the Contract Star Details page, without Streamlit.
+
+Every function here takes a df of a single contract and year's measure stars and returns plain DataFrames;
+app.py renders them with st.* calls and the command line below writes them to disk for many contracts.
+
+    python -m cms_stars.report --year 2022                  # every contract of 2022
+    python -m cms_stars.report --year 2022 --contracts H0028 H0104
+
+Contracts are split into chunks that run in a process pool. Each finished chunk is written as soon as it
+comes back: one folder per contract (reports/<year>/<contract_id>/<table>.csv) and one row per contract
+appended to reports/<year>/index.csv.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from cms_stars.cutpoints import cutpoint_index, use_pdp_cutpoints
+from cms_stars.data import load_data
+from cms_stars.drift import DRAWS, cutpoint_drift, star_probabilities
+from cms_stars.filter_index import filter_index
+from cms_stars.planner import cheapest_plans, plan_improvements
+from cms_stars.predictions import prediction_store
+from cms_stars.stars import overall_summary_star, star_type_mask
+
+DETAILS_URL = "data/visualization_data_contract_details.csv"
+CUTPOINTS_URL = "data/visualization_data_cutpoints.csv"
+OUTPUT_DIR = "reports"
+
+STAR_TYPE_NAMES = {'part_c': 'Part C Summary Star Rating',
+                   'part_d': 'Part D Summary Star Rating',
+                   'overall': 'Overall Star Rating'}
+
+#contracts sent to a worker at a time
+CHUNK_SIZE = 20
+
+
+def contract_measures(df):
+    """
+    Measures of a single contract that can be viewed and simulated: only Part C/D measures if the contract
+    has only that part.
+    """
+    has_c, has_d = df['has_part_c'].iloc[0], df['has_part_d'].iloc[0]
+    if has_c == 1 and has_d == 0:
+        return df[df['is_part_c'] == 1]['measure'].unique()
+    if has_c == 0 and has_d == 1:
+        return df[df['is_part_d'] == 1]['measure'].unique()
+    return df['measure'].unique()
+
+
+def measure_tables(df, cols=('measure', 'score', 'star')):
+    """
+    Given a df of a single contract and year, return a list of (part, domain, table) with the measures of
+    each domain of each part the contract has, sorted by domain.
+    """
+    tables = []
+    for part, has_col, is_col in [('Part C', 'has_part_c', 'is_part_c'), ('Part D', 'has_part_d', 'is_part_d')]:
+        if df[has_col].iloc[0] != 1:
+            continue
+        df_part = df[df[is_col] == 1].sort_values(by='domain_id')
+        for d in df_part['domain_id'].unique():
+            df_domain = df_part[df_part['domain_id'] == d]
+            tables.append((part, "Domain " + d + " - " + df_domain['domain_name'].iloc[0], df_domain[list(cols)]))
+    return tables
+
+
+def recommendations(df, cut_index):
+    """
+    Given a df of a single contract and year and a CutPointIndex, return the measures to focus on: scored
+    measures below 5 stars with their cut points and penetration, highest weight first and, within a weight,
+    highest penetration first.
+    """
+    #filter out measures not scored (if no score, we cannot know if it is worth recommending)
+    recommended = df.dropna(subset='score')
+    #filter to measures with less than 5 stars
+    recommended = recommended[recommended['star'] < 5]
+    #cut points and penetration of each measure's star, from the cut point index
+    cuts = cut_index.score_measures(recommended)
+    recommended = recommended.assign(lower=cuts['lower'].fillna(recommended['lower']),
+                                     upper=cuts['upper'].fillna(recommended['upper']),
+                                     penetration=cuts['penetration'].fillna(recommended['penetration']))
+    #sort highest weighted measures to the top then sort highest penetration to the top
+    recommended = recommended.sort_values(by=['weight', 'penetration'], ascending=False)
+    return recommended[['measure', 'score', 'star', 'weight', 'lower', 'upper', 'penetration']]
+
+
+def planner_star_type(df):
+    """
+    Star type to plan for: the overall star if the contract has both parts, otherwise its summary star.
+    """
+    if df['has_part_c'].iloc[0] == 0:
+        return 'part_d'
+    if df['has_part_d'].iloc[0] == 0:
+        return 'part_c'
+    return 'overall'
+
+
+def improvement_plans(df, cut_index, year, star_type=None):
+    """
+    Given a df of a single contract and year and a CutPointIndex, return the cheapest plan for each star_type
+    star above the current one: the target, effort, resulting stars and measure changes. Empty when no
+    measure improvement raises the star.
+    """
+    star_type = star_type or planner_star_type(df)
+    use_PDP = int(use_pdp_cutpoints(df['has_part_c'].iloc[0], df['has_part_d'].iloc[0]))
+    thresholds = cut_index.measure_thresholds(year, use_PDP)
+    stars_before = dict(zip(df['measure'], df['star']))
+    plans = cheapest_plans(plan_improvements(df, thresholds, star_type), star_type)
+
+    if len(plans) == 0:
+        return pd.DataFrame(columns=['Target', 'Effort', 'Part C', 'Part D', 'Overall', 'Measure changes'])
+    plans_df = pd.DataFrame({'Target': plans[star_type + '_rounded'],
+                             'Effort': plans['effort'],
+                             'Part C': plans['part_c_rounded'],
+                             'Part D': plans['part_d_rounded'],
+                             'Overall': plans['overall_rounded'],
+                             'Measure changes': [', '.join(f"{m} ({stars_before[m]:.0f} → {new})" for m, new in p.items())
+                                                 for p in plans['plan']]})
+    #the first plan is the current star
+    return plans_df.iloc[1:].reset_index(drop=True)
+
+
+def star_results(df, results=None):
+    """
+    Given a df of a single contract and year, return the rounded and raw star of each star type the contract
+    has an actual star for, next to the actual star. results maps star types to (raw, rounded) stars (e.g.
+    precomputed or simulated); the star types it does not have are calculated with overall_summary_star().
+    """
+    results = results or {}
+    single_contract = df.iloc[0]
+    rows = []
+    for star_type, star_type_name in STAR_TYPE_NAMES.items():
+        if np.isnan(single_contract[star_type + '_star']):
+            continue
+        if star_type in results:
+            raw, rounded = results[star_type]
+        #overall_summary_star() needs at least one starred measure to average
+        elif (star_type_mask(df, star_type) & df['star'].notna().to_numpy()).any():
+            raw, rounded = overall_summary_star(df, star_type)
+        else:
+            raw, rounded = np.nan, np.nan
+        rows.append({'Star Type': star_type_name, 'Rounded': rounded, 'Raw': raw,
+                     'Actual': single_contract[star_type + '_star']})
+    return pd.DataFrame(rows, columns=['Star Type', 'Rounded', 'Raw', 'Actual'])
+
+
+def probability_tables(measure_probs, summary_probs):
+    """
+    Given the results of star_probabilities(), return the summary star probabilities (one row per star type,
+    only the stars with at least a 0.5% chance) and the measure star probabilities, ready to display.
+    """
+    probs_df = pd.DataFrame({STAR_TYPE_NAMES[t]: p for t, p in summary_probs.items()}).T
+    #only show the stars with a chance of happening
+    probs_df = probs_df.loc[:, probs_df.max() >= 0.005]
+    probs_df.columns = [f"{s:.1f}" for s in probs_df.columns]
+    measure_df = measure_probs.copy()
+    measure_df.columns = [f"{s} star" for s in measure_df.columns]
+    return probs_df.rename_axis('Star Type').reset_index(), measure_df.rename_axis('measure').reset_index()
+
+
+def contract_report(df, cut_index, year, store=None, drift=None, draws=DRAWS):
+    """
+    Every table of a single contract and year's report: {name: df}. With a PredictionStore of the next year
+    (store) the measures get their predicted score, and with a CutPointDrift the next year's star
+    probabilities are simulated as well.
+    """
+    measures = df[['domain_id', 'domain_name', 'measure', 'score', 'star', 'weight']]
+    predicted = None
+    if store is not None:
+        predicted = store.lookup(df['contract_id'].astype(str), df['measure'].astype(str))
+        measures = measures.assign(predicted=predicted)
+
+    report = {'measures': measures.sort_values(by=['domain_id', 'measure']).reset_index(drop=True),
+              'recommendations': recommendations(df, cut_index).reset_index(drop=True),
+              'plans': improvement_plans(df, cut_index, year),
+              'stars': star_results(df)}
+    if predicted is not None and drift is not None and draws > 0 and not np.isnan(predicted).all():
+        report['summary_probabilities'], report['measure_probabilities'] = \
+            probability_tables(*star_probabilities(df, predicted, drift, year + 1, draws))
+    return report
+
+
+def report_chunk(task):
+    """
+    Reports of some contracts of one year. task is (details_url, cutpoints_url, year, contracts, draws); runs
+    in a worker process, where the datasets are loaded once and reused by every chunk. Returns a list of
+    (contract, report or None, error or None).
+    """
+    details_url, cutpoints_url, year, contracts, draws = task
+    df = load_data(details_url)
+    index = filter_index(details_url, ['year', 'contract_id'])
+    cut_index = cutpoint_index(cutpoints_url)
+    store = prediction_store(year + 1)
+    drift = cutpoint_drift(cutpoints_url, year) if store is not None and draws > 0 else None
+
+    results = []
+    for contract in contracts:
+        try:
+            df_contract = df.iloc[index.rows(year=year, contract_id=contract)]
+            results.append((contract, contract_report(df_contract, cut_index, year, store, drift, draws), None))
+        except Exception as e:
+            results.append((contract, None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def index_row(contract, report):
+    """
+    One row of index.csv: a contract and its calculated and actual stars.
+    """
+    row = {'contract_id': contract}
+    for star_type, name in STAR_TYPE_NAMES.items():
+        stars = report['stars'].set_index('Star Type')
+        row[star_type + '_rounded'] = stars.loc[name, 'Rounded'] if name in stars.index else np.nan
+        row[star_type + '_actual'] = stars.loc[name, 'Actual'] if name in stars.index else np.nan
+    row['recommendations'] = len(report['recommendations'])
+    row['next_star_effort'] = report['plans']['Effort'].iloc[0] if len(report['plans']) else np.nan
+    return row
+
+
+def write_report(folder, contract, report):
+    """
+    Write each table of a contract's report to folder/<contract>/<table>.csv.
+    """
+    contract_dir = os.path.join(folder, contract)
+    os.makedirs(contract_dir, exist_ok=True)
+    for name, table in report.items():
+        table.to_csv(os.path.join(contract_dir, name + '.csv'), index=False)
+
+
+def write_reports(year, contracts=None, output=OUTPUT_DIR, workers=None, draws=DRAWS,
+                  details_url=DETAILS_URL, cutpoints_url=CUTPOINTS_URL):
+    """
+    Write the reports of contracts (default: every contract) of year to output/<year>/, as chunks finish.
+    Returns the number of reports written and the {contract: error} of the ones that failed.
+    """
+    if contracts is None:
+        contracts = filter_index(details_url, ['year', 'contract_id']).values('contract_id', year=year)
+    contracts = [str(c) for c in contracts]
+    folder = os.path.join(output, str(year))
+    os.makedirs(folder, exist_ok=True)
+    index_path = os.path.join(folder, 'index.csv')
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    tasks = [(details_url, cutpoints_url, year, contracts[i:i + CHUNK_SIZE], draws)
+             for i in range(0, len(contracts), CHUNK_SIZE)]
+    written, errors = 0, {}
+
+    def write_chunk(results):
+        nonlocal written
+        rows = []
+        for contract, report, error in results:
+            if error is not None:
+                errors[contract] = error
+                continue
+            write_report(folder, contract, report)
+            rows.append(index_row(contract, report))
+        if rows:
+            pd.DataFrame(rows).to_csv(index_path, mode='a', index=False, header=not os.path.exists(index_path))
+        written += len(rows)
+        print(f"{written + len(errors)}/{len(contracts)} contracts", file=sys.stderr)
+
+    if workers == 1:
+        for task in tasks:
+            write_chunk(report_chunk(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for future in as_completed([pool.submit(report_chunk, task) for task in tasks]):
+                write_chunk(future.result())
+    return written, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the Contract Star Details tables of many contracts.")
+    parser.add_argument('--year', type=int, required=True, help="star rating year")
+    parser.add_argument('--contracts', nargs='+', help="contract ids (default: every contract of the year)")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="folder to write the reports to")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--draws', type=int, default=DRAWS,
+                        help="simulations for next year's star probabilities, 0 to skip them")
+    args = parser.parse_args(argv)
+
+    written, errors = write_reports(args.year, args.contracts, args.output, args.workers, args.draws)
+    for contract, error in errors.items():
+        print(f"{contract}: {error}", file=sys.stderr)
+    print(f"{os.path.join(args.output, str(args.year))}: {written} reports written, {len(errors)} failed")
+
+
+if __name__ == '__main__':
+    main()
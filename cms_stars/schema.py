@@ -0,0 +1,145 @@
+"""
+Declared column types for each dataset in data/.
+
+pandas infers every text column as a string column and every number as int64/float64. Most of these
+columns repeat a small set of values (contract ids, parent organizations, measure names) or hold small
+numbers, so storing them as categoricals and narrow numeric types cuts the memory of each dataset
+several times over.
+
+    python -m cms_stars.schema        # report bytes per dataset before and after the schema
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+#text CMS puts in the star columns when a contract did not get a star
+STAR_SENTINELS = ['Not Applicable', 'Not enough data available', 'Plan too new to be measured',
+                  'Plan too small to be measured', 'No data available']
+
+_CONTRACT_INFO = ['contract_id', 'contract_name', 'marketing_name', 'parent_org_name', 'org_type_name']
+_SUMMARY_STARS = ['part_c_star', 'part_d_star', 'overall_star']
+
+#for each dataset (CSV file name without extension):
+# category = repeated text values stored as categoricals
+# star = star columns, parsed as numbers with the STAR_SENTINELS turned into nulls
+# dtypes = explicit numeric types
+# state_enrollment = type of the two letter state enrollment columns
+# float = type of every other float column
+SCHEMAS = {
+    'visualization_data': {
+        'category': _CONTRACT_INFO + ['SNP'],
+        'star': _SUMMARY_STARS,
+        'dtypes': {'year': 'int16', 'has_part_c': 'int8', 'has_part_d': 'int8', 'total_enrollment': 'int32'},
+        'state_enrollment': 'int32',
+        'float': 'float32',
+    },
+    'visualization_data_contract_details': {
+        'category': _CONTRACT_INFO + ['domain_id', 'domain_name', 'measure'],
+        'star': _SUMMARY_STARS + ['star'],
+        'dtypes': {'year': 'int16', 'has_part_c': 'int8', 'has_part_d': 'int8',
+                   'is_part_c': 'int8', 'is_part_d': 'int8'},
+        'float': 'float32',
+    },
+    'visualization_data_cutpoints': {
+        'category': ['measure'],
+        'dtypes': {'year': 'int16', 'star': 'int8', 'higher_is_better': 'int8', 'is_MAPD': 'int8', 'is_PDP': 'int8'},
+        'float': 'float32',
+    },
+    #measures and predictors stay float64: rounding them to float32 ties values that differ, which moves the
+    #Spearman ranks of the Correlations Dashboard
+    'visualization_data_correlations': {
+        'category': ['state_id'],
+        'dtypes': {'year': 'int16'},
+    },
+    'visualization_data_correlations_disenrollment': {
+        'category': ['contract_id'],
+        'dtypes': {'year': 'int16'},
+    },
+    #predicted scores, one file per prediction year (Complete_<year>_pred)
+    'Complete_pred': {
+        'float': 'float32',
+    },
+}
+
+
+def dataset_name(path):
+    """
+    Schema key of a data file, e.g. data/arrow/visualization_data.arrow -> visualization_data. Yearly files
+    of one dataset share a key, e.g. data/Complete_2023_pred.csv -> Complete_pred
+    """
+    return re.sub(r'_\d{4}_', '_', os.path.splitext(os.path.basename(path))[0])
+
+
+def is_state_column(col):
+    """
+    State enrollment columns are named by their two letter postal code (AK, AL, ..., PR, VI).
+    """
+    return len(col) == 2 and col.isalpha() and col.isupper()
+
+
+def parse_stars(series):
+    """
+    Convert a star column holding numbers and sentinel text into floats with nulls for the sentinels.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    text = series.astype(str).str.strip()
+    text = text.where(~text.isin(STAR_SENTINELS), None)
+    return pd.to_numeric(text)
+
+
+def apply_schema(df, name):
+    """
+    Given a freshly read dataset df and its schema name, return df converted to the declared types.
+    Datasets without a schema are returned unchanged.
+    """
+    schema = SCHEMAS.get(name)
+    if schema is None:
+        return df
+
+    converted = {}
+    for col in df.columns:
+        series = df[col]
+        if col in schema.get('category', []):
+            series = series.astype('category')
+        elif col in schema.get('star', []):
+            series = parse_stars(series).astype(schema.get('float', 'float64'))
+        elif col in schema.get('dtypes', {}):
+            series = series.astype(schema['dtypes'][col])
+        elif 'state_enrollment' in schema and is_state_column(col):
+            series = series.astype(schema['state_enrollment'])
+        elif 'float' in schema and pd.api.types.is_float_dtype(series):
+            series = series.astype(schema['float'])
+        converted[col] = series
+
+    return pd.DataFrame(converted, index=df.index)
+
+
+def read_csv(path):
+    """
+    Read a CSV from data/ and apply its declared schema.
+    """
+    return apply_schema(pd.read_csv(path), dataset_name(path))
+
+
+def memory_report(paths):
+    """
+    Return a df with the in-memory size of each dataset with pandas' inferred types and with the schema.
+    """
+    rows = []
+    for path in paths:
+        raw = pd.read_csv(path)
+        typed = apply_schema(raw, dataset_name(path))
+        raw_bytes = raw.memory_usage(deep=True).sum()
+        typed_bytes = typed.memory_usage(deep=True).sum()
+        rows.append({'dataset': os.path.splitext(os.path.basename(path))[0], 'inferred_bytes': raw_bytes, 'schema_bytes': typed_bytes,
+                     'reduction': raw_bytes / typed_bytes if typed_bytes else np.nan})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    import glob
+    report = memory_report(sorted(glob.glob('data/*.csv')))
+    print(report.to_string(index=False, formatters={'reduction': '{:.1f}x'.format}))
@@ -0,0 +1,86 @@
+"""
+What-if simulation of measure stars for one contract and year.
+
+The summary and overall stars are weighted averages of the measure stars, so the simulation keeps the
+weighted sum and the weight total of each star type. Changing one measure star only moves that measure's
+contribution in and out of those sums, and the measure stars frame is never copied or modified.
+"""
+import numpy as np
+
+from cms_stars.stars import STAR_TYPES, star_type_mask
+
+
+class StarSimulation:
+    """
+    Simulated summary and overall stars for the measure stars df of a single contract and year.
+    key identifies the contract and year the simulation was built for.
+    """
+    def __init__(self, df, key=None, star_col='star', weight_col='weight'):
+        self.key = key
+        self.overrides = {}
+
+        #per measure: actual star, weight and whether it counts towards each star type
+        self.measures = {}
+        masks = {t: star_type_mask(df, t) for t in STAR_TYPES}
+        stars = df[star_col].to_numpy(dtype=np.float64)
+        weights = df[weight_col].to_numpy(dtype=np.float64)
+        for i, measure in enumerate(df['measure']):
+            if measure not in self.measures:
+                self.measures[measure] = (stars[i], weights[i], [t for t in STAR_TYPES if masks[t][i]])
+
+        self.weighted_sum = dict.fromkeys(STAR_TYPES, 0.0)
+        self.weight_total = dict.fromkeys(STAR_TYPES, 0.0)
+        for measure, (star, weight, star_types) in self.measures.items():
+            self._add(star, weight, star_types, 1)
+
+    def _add(self, star, weight, star_types, sign):
+        #measures where star was not assigned are left out of the weighted average
+        if np.isnan(star) or np.isnan(weight):
+            return
+        for t in star_types:
+            self.weighted_sum[t] += sign * star * weight
+            self.weight_total[t] += sign * weight
+
+    def star(self, measure):
+        """
+        The simulated star of measure if there is one, otherwise its actual star.
+        """
+        return self.overrides.get(measure, self.measures[measure][0])
+
+    def set_star(self, measure, star):
+        """
+        Simulate star for measure. Measures the contract does not have are ignored.
+        """
+        if measure not in self.measures:
+            return
+        _, weight, star_types = self.measures[measure]
+        self._add(self.star(measure), weight, star_types, -1)
+        self.overrides[measure] = float(star)
+        self._add(float(star), weight, star_types, 1)
+
+    def remove(self, measure):
+        """
+        Go back to the actual star of measure.
+        """
+        if measure not in self.overrides:
+            return
+        _, weight, star_types = self.measures[measure]
+        self._add(self.overrides.pop(measure), weight, star_types, -1)
+        self._add(self.star(measure), weight, star_types, 1)
+
+    def clear(self):
+        """
+        Remove every simulated star.
+        """
+        for measure in list(self.overrides):
+            self.remove(measure)
+
+    def result(self, star_type='overall'):
+        """
+        Simulated raw weighted average star and the star rounded to the nearest 0.5 for star_type
+        (overall, part_c, part_d). Both are NaN if no measure of that type has a star.
+        """
+        if self.weight_total[star_type] <= 0:
+            return np.nan, np.nan
+        raw_star = self.weighted_sum[star_type] / self.weight_total[star_type]
+        return raw_star, round(raw_star * 2) / 2
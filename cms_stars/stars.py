@@ -0,0 +1,132 @@
+"""
+Summary and overall star calculations.
+
+overall_summary_star() calculates one star type for one contract and year. summary_star_table() does the
+same calculation for every contract and year at once, with one grouped pass over the measure stars.
+
+    python -m cms_stars.stars     # compare the calculated stars with the actual CMS stars
+"""
+import numpy as np
+import pandas as pd
+
+from cms_stars.data import derived, load_data
+
+STAR_TYPES = ['part_c', 'part_d', 'overall']
+
+#measures counted in both Part C and Part D, left out of the overall star so they are not double counted
+OVERALL_EXCLUDED_MEASURES = ['D-Members Choosing to Leave the Plan', 'D-Complaints about the Drug Plan']
+
+
+def round_star(raw_star):
+    """
+    Round a raw weighted average star to the nearest 0.5
+    """
+    return np.round(raw_star * 2) / 2
+
+
+def star_type_mask(df, star_type):
+    """
+    Boolean array of the measures of df that count towards star_type (overall, part_c, part_d).
+    """
+    #for overall star rating, don't double count these measures
+    if star_type == 'overall':
+        return ~df['measure'].isin(OVERALL_EXCLUDED_MEASURES).to_numpy()
+    #for part c summary star, keep only part c measures
+    elif star_type == 'part_c':
+        return df['is_part_c'].to_numpy() == 1
+    #for part d summary star, keep only part d measures
+    elif star_type == 'part_d':
+        return df['is_part_d'].to_numpy() == 1
+    raise ValueError(f"Unknown star type: {star_type}")
+
+
+#calculate the overall or summary star rating
+def overall_summary_star(df, star_type='overall', star_col='star', weight_col='weight'):
+    """
+    Given a dataframe df for a single contract and year, calculate the chosen star_type (overall, part_c, part_d) using
+    weighted average of the individual measure stars.
+
+    Returns both the raw weighted average star and the star rounded to the nearest 0.5
+    """
+    df = df[star_type_mask(df, star_type)]
+
+    #remove measures where star was not assigned
+    df = df.dropna(subset = star_col)
+
+    #calculate weighted average
+    raw_star = np.average(df[star_col], weights= df[weight_col])
+
+    #perform rounding to nearest 0.5
+    rounded_star = round(raw_star * 2) / 2
+
+    return raw_star, rounded_star
+
+
+def summary_star_table(df, star_col='star', weight_col='weight'):
+    """
+    Given the measure stars of many contracts and years (one row per contract, year and measure), calculate
+    every star type for every contract and year in one vectorized pass.
+
+    Returns a df with one row per contract_id and year, holding <star_type>_raw and <star_type>_rounded for
+    each star type (NaN when the contract has no starred measure of that type) and the actual CMS stars.
+    """
+    groups = df.groupby(['contract_id', 'year'], observed=True, sort=True)
+    codes = groups.ngroup().to_numpy()
+    n_groups = groups.ngroups
+
+    star = df[star_col].to_numpy(dtype=np.float64)
+    weight = df[weight_col].to_numpy(dtype=np.float64)
+    #remove measures where star was not assigned
+    valid = ~np.isnan(star) & ~np.isnan(weight)
+    weighted = np.where(valid, star * weight, 0.0)
+    weight = np.where(valid, weight, 0.0)
+
+    #one row per group with the contract info and the actual stars
+    result = groups[['part_c_star', 'part_d_star', 'overall_star']].first().reset_index()
+
+    for star_type in STAR_TYPES:
+        mask = star_type_mask(df, star_type)
+        weighted_sum = np.bincount(codes, weights=weighted * mask, minlength=n_groups)
+        weight_total = np.bincount(codes, weights=weight * mask, minlength=n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            raw = np.where(weight_total > 0, weighted_sum / weight_total, np.nan)
+        result[star_type + '_raw'] = raw
+        result[star_type + '_rounded'] = round_star(raw)
+
+    return result
+
+
+def _build_star_table(DATA_URL):
+    cols = ['contract_id', 'year', 'measure', 'star', 'weight', 'is_part_c', 'is_part_d',
+            'part_c_star', 'part_d_star', 'overall_star']
+    table = summary_star_table(load_data(DATA_URL, columns=cols))
+    return table.set_index(['contract_id', 'year']).sort_index()
+
+
+def star_table(DATA_URL):
+    """
+    summary_star_table() of the contract details dataset at DATA_URL, indexed by (contract_id, year) and
+    built once per dataset version.
+    """
+    return derived(DATA_URL, 'star_table', _build_star_table, DATA_URL)
+
+
+def validate_star_table(table):
+    """
+    Compare the calculated rounded stars with the actual CMS stars. Returns a df with, for each star type,
+    the number of contracts with both stars and the share where they agree.
+    """
+    rows = []
+    for star_type in STAR_TYPES:
+        actual = table[star_type + '_star'].to_numpy(dtype=np.float64)
+        rounded = table[star_type + '_rounded'].to_numpy(dtype=np.float64)
+        both = ~np.isnan(actual) & ~np.isnan(rounded)
+        rows.append({'star_type': star_type,
+                     'contracts': int(both.sum()),
+                     'match': (actual[both] == rounded[both]).mean() if both.any() else np.nan,
+                     'mean_abs_diff': np.abs(actual[both] - rounded[both]).mean() if both.any() else np.nan})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    print(validate_star_table(star_table("data/visualization_data_contract_details.csv")).to_string(index=False))
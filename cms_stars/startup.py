@@ -0,0 +1,118 @@
+"""
+Cold start times of each page of the app.
+
+Every page is rendered once in a fresh Python process, the way the first session of a restarted server
+sees it: the app is run headlessly with Streamlit's testing client, opened on that page (?page=<name>),
+with profiling turned on. The time to first render of each page is compared with the startup budget and
+broken down into the stages the profiler records (imports, loading data, indexes, figures, ...).
+
+    python -m cms_stars.startup
+    python -m cms_stars.startup --pages "Contract Star Details" --budget 3
+
+Exits with status 1 when a page takes longer than the budget or fails to render.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from cms_stars.profiling import LOG_ENV, PROFILE_ENV, read_log
+from cms_stars.warmup import PAGES
+
+APP_PATH = 'app.py'
+
+#seconds from the start of the script run to the first page being fully rendered
+STARTUP_BUDGET = 3.0
+
+#seconds a page may take before the testing client gives up on it
+TIMEOUT = 300
+
+
+def first_render(page, app_path=APP_PATH):
+    """
+    Render page once in this process and return {'streamlit_s': seconds to import Streamlit's testing client,
+    'render_s': seconds of the first script run, 'errors': [...]}.
+    """
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    loaded = time.perf_counter()
+
+    at = AppTest.from_file(os.path.abspath(app_path), default_timeout=TIMEOUT)
+    at.query_params['page'] = page
+    at.run()
+    done = time.perf_counter()
+    return {'streamlit_s': loaded - start, 'render_s': done - loaded, 'errors': [str(e.value) for e in at.exception]}
+
+
+def measure_page(page, app_path=APP_PATH):
+    """
+    Cold start of page in a new process. Returns first_render()'s result with 'process_s' (wall time of the
+    whole process) and 'stages' (seconds of each top level profiler stage).
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        log_path = os.path.join(folder, 'profile.jsonl')
+        env = dict(os.environ, **{PROFILE_ENV: '1', LOG_ENV: log_path})
+        start = time.perf_counter()
+        done = subprocess.run([sys.executable, '-m', 'cms_stars.startup', '--child', page, '--app', app_path],
+                              env=env, capture_output=True, text=True)
+        process_s = time.perf_counter() - start
+        if done.returncode != 0:
+            return {'process_s': process_s, 'render_s': float('nan'), 'streamlit_s': float('nan'),
+                    'errors': [done.stderr.strip().splitlines()[-1] if done.stderr.strip() else 'failed'], 'stages': {}}
+        result = json.loads(done.stdout.strip().splitlines()[-1])
+        spans = read_log(log_path) if os.path.exists(log_path) else pd.DataFrame(columns=['stage', 'depth', 'seconds'])
+
+    top = spans[spans['depth'] == 0]
+    result['process_s'] = process_s
+    result['stages'] = top.groupby('stage', sort=False)['seconds'].sum().to_dict()
+    return result
+
+
+def startup_report(pages=PAGES, app_path=APP_PATH, budget=STARTUP_BUDGET):
+    """
+    Cold start every page. Returns a df with one row per page (times to first render, over budget, errors) and
+    a df of the top level stages of each page's first render.
+    """
+    rows, stages = [], []
+    for page in pages:
+        result = measure_page(page, app_path)
+        rows.append({'page': page, 'process_s': result['process_s'], 'streamlit_s': result['streamlit_s'],
+                     'render_s': result['render_s'], 'over_budget': not result['render_s'] <= budget,
+                     'errors': '; '.join(result['errors'])})
+        stages.extend({'page': page, 'stage': s, 'seconds': v} for s, v in result['stages'].items())
+    return pd.DataFrame(rows), pd.DataFrame(stages, columns=['page', 'stage', 'seconds'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start time of each page of the app.")
+    parser.add_argument('--pages', nargs='+', choices=PAGES, default=PAGES, help="pages to measure (default: all)")
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET, help="seconds allowed for a page's first render")
+    parser.add_argument('--app', default=APP_PATH, help="path of the Streamlit app")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        #inside the fresh process started by measure_page()
+        print(json.dumps(first_render(args.child, args.app)))
+        return
+
+    summary, stages = startup_report(args.pages, args.app, args.budget)
+    print(summary.to_string(index=False, float_format='{:.2f}'.format))
+    for page, page_stages in stages.groupby('page', sort=False):
+        print(f"\n{page}")
+        print(page_stages[['stage', 'seconds']].sort_values('seconds', ascending=False)
+              .to_string(index=False, float_format='{:.3f}'.format))
+
+    failed = summary[summary['over_budget'] | (summary['errors'] != '')]
+    if len(failed):
+        print(f"\n{len(failed)} pages over the {args.budget}s budget or failing")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Sparse store of the state enrollment of each contract.
+
+visualization_data.csv has one enrollment column per state on every contract-year row, and most of them
+are zero. The store keeps only the non-zero (row, state, enrollment) entries, sorted by row, along with the
+entries of each state sorted by row and the total enrollment of each year and state and of each year,
+parent organization and state. State filters, state-sized treemaps and state-level views read the store
+instead of scanning the wide columns, and the top states text of a contract is derived from its entries.
+"""
+import numpy as np
+import pandas as pd
+
+from cms_stars.data import dataset_columns, derived, load_data
+from cms_stars.schema import is_state_column
+
+#number of states listed by top_states() before the rest are summed up as Others
+TOP_STATES = 6
+
+
+def state_columns(columns):
+    """
+    The state enrollment columns among columns, in order.
+    """
+    return [c for c in columns if is_state_column(c)]
+
+
+class StateEnrollment:
+    """
+    Non-zero state enrollment of every row of the contract enrollment dataset.
+      - states: state codes; entries refer to them by position
+      - rows, state_codes, enrollment: one entry per row and state with enrollment, sorted by row then state
+      - row_ptr: the entries of row i are row_ptr[i]:row_ptr[i + 1]
+      - row_totals: enrollment of each row summed over its states
+      - state_entries: state -> positions of its entries, sorted by row
+      - state_totals: (year x state) df of total enrollment
+      - parent_totals: total enrollment indexed by (year, parent_org_name, state)
+    """
+    def __init__(self, df, states):
+        self.states = list(states)
+        self.n_rows = len(df)
+        self.years = df['year'].to_numpy()
+
+        values = df[self.states].to_numpy()
+        rows, codes = np.nonzero(values > 0)
+        self.rows = rows
+        self.state_codes = codes.astype(np.int16)
+        self.enrollment = values[rows, codes].astype(np.int64)
+        self.row_ptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=self.n_rows))])
+        self.row_totals = np.bincount(rows, weights=self.enrollment, minlength=self.n_rows).astype(np.int64)
+
+        by_state = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[by_state], np.arange(len(self.states) + 1))
+        self.state_entries = {s: by_state[bounds[i]:bounds[i + 1]] for i, s in enumerate(self.states)}
+
+        entries = pd.DataFrame({'year': self.years[rows],
+                                'parent_org_name': df['parent_org_name'].to_numpy()[rows],
+                                'state': pd.Categorical.from_codes(codes, self.states),
+                                'enrollment': self.enrollment})
+        self.state_totals = (entries.pivot_table(index='year', columns='state', values='enrollment', aggfunc='sum',
+                                                 observed=False, fill_value=0))
+        self.parent_totals = entries.groupby(['year', 'parent_org_name', 'state'], observed=True)['enrollment'].sum()
+
+    def state_rows(self, state):
+        """
+        Sorted positions of the rows with enrollment in state, and their enrollment there.
+        """
+        entries = self.state_entries[state]
+        return self.rows[entries], self.enrollment[entries]
+
+    def state_enrollment(self, state, rows):
+        """
+        Enrollment in state of each of rows (0 where the row has none there). 'All' gives the row totals.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        if state == 'All':
+            return self.row_totals[rows]
+        state_rows, enrollment = self.state_rows(state)
+        if len(state_rows) == 0:
+            return np.zeros(len(rows), dtype=np.int64)
+        pos = np.minimum(np.searchsorted(state_rows, rows), len(state_rows) - 1)
+        return np.where(state_rows[pos] == rows, enrollment[pos], 0)
+
+    def top_states(self, rows, top=TOP_STATES):
+        """
+        Text listing the share of enrollment in each row's largest states, e.g. 'PA-91.8%, FL-3.5%, Others-4.7%'.
+        Shares are rounded to 0.1% and states rounding to 0.0% are left out.
+        """
+        texts = []
+        for row in np.asarray(rows, dtype=np.intp):
+            start, end = self.row_ptr[row], self.row_ptr[row + 1]
+            total = self.row_totals[row]
+            enrollment = self.enrollment[start:end]
+            order = np.argsort(-enrollment, kind='stable')[:top]
+            shares = np.round(enrollment[order] / total * 100, 1) if total else np.zeros(len(order))
+            parts = [f"{self.states[self.state_codes[start + i]]}-{s:.1f}%" for i, s in zip(order, shares) if s > 0]
+            others = max(100 - shares[shares > 0].sum(), 0.0) if total else 0.0
+            texts.append(', '.join(parts + [f"Others-{others:.1f}%"]))
+        return texts
+
+    def entries(self, rows):
+        """
+        Positions of the entries of rows, in the order of rows.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        starts = self.row_ptr[rows]
+        lengths = self.row_ptr[rows + 1] - starts
+        #each entry's offset within its row, added to the start of the row
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(starts, lengths) + offsets
+
+    def share_by_state(self, rows, selected):
+        """
+        Given row positions and a boolean array marking some of them (e.g. contracts with 4 or more stars),
+        return a series with the share of each state's enrollment in rows that is in the marked rows. States
+        without enrollment in rows are left out.
+        """
+        lengths = self.row_ptr[np.asarray(rows, dtype=np.intp) + 1] - self.row_ptr[rows]
+        entries = self.entries(rows)
+        codes = self.state_codes[entries]
+        enrollment = self.enrollment[entries]
+        total = np.bincount(codes, weights=enrollment, minlength=len(self.states))
+        marked = np.bincount(codes, weights=enrollment * np.repeat(selected, lengths), minlength=len(self.states))
+        has_enrollment = total > 0
+        return pd.Series(marked[has_enrollment] / total[has_enrollment], index=np.array(self.states)[has_enrollment],
+                         name='share')
+
+
+def _build_state_enrollment(DATA_URL):
+    states = state_columns(dataset_columns(DATA_URL))
+    df = load_data(DATA_URL, columns=['year', 'parent_org_name'] + states)
+    return StateEnrollment(df, states)
+
+
+def state_enrollment(DATA_URL):
+    """
+    The StateEnrollment of the contract enrollment dataset at DATA_URL, built once per dataset version.
+    """
+    return derived(DATA_URL, 'state_enrollment', _build_state_enrollment, DATA_URL)
@@ -0,0 +1,142 @@
+"""
+Figure of the Star Rating Explorer: one treemap box per contract, grouped by parent organization.
+
+Building the figure with plotly express takes far longer than sending it, so the figures of the explorer's
+filter combinations are kept in an LRU keyed by the dataset version and the filters, and shared by every
+session.
+
+Optionally, the contracts of each parent organization that are smaller than a share of the total shown are
+folded into one "Other contracts" box. Most contracts are too small to see in the treemap anyway, and
+folding them makes the figure much smaller while the large contracts stay exact.
+"""
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from cms_stars.data import dataset_columns, dataset_version, load_data
+from cms_stars.filter_index import explorer_index
+from cms_stars.schema import is_state_column
+from cms_stars.states import state_enrollment
+
+#columns shown in the hover text, in the order of the hovertemplate's customdata
+HOVER_COLUMNS = ['contract_id', 'contract_name', 'marketing_name', 'parent_org_name',
+                 'overall_star', 'part_c_star', 'part_d_star',
+                 'top_states', None, 'org_type_name', 'SNP']
+
+#label of the box of a parent organization's folded contracts
+OTHER_CONTRACTS = 'Other contracts'
+
+#number of explorer figures kept in memory
+FIGURE_CACHE_SIZE = 32
+
+
+def fold_small_contracts(df, size, min_share):
+    """
+    Given a df of contracts, return it with the contracts whose size is below min_share of the total size
+    replaced by one row per parent organization. The folded row is sized by the sum of its contracts and
+    colored by their size-weighted average Rating. Parents with a single small contract keep it as is.
+    """
+    values = df[size].to_numpy(dtype=np.float64)
+    small = values < min_share * values.sum()
+    parents = df['parent_org_name'].astype(str).to_numpy()
+    #only fold where a parent has at least 2 small contracts
+    small_parents, counts = np.unique(parents[small], return_counts=True)
+    small &= np.isin(parents, small_parents[counts > 1])
+    if not small.any():
+        return df
+
+    folded = pd.DataFrame({'parent_org_name': parents[small], 'size': values[small],
+                           'Rating': df['Rating'].to_numpy(dtype=np.float64)[small]})
+    #contracts without a rating are left out of the average
+    folded['weighted'] = folded['Rating'] * folded['size']
+    folded['rated'] = folded['size'].where(folded['Rating'].notna(), 0)
+    groups = folded.groupby('parent_org_name', sort=False).agg(
+        contracts=('size', 'size'), size=('size', 'sum'), weighted=('weighted', 'sum'), rated=('rated', 'sum'))
+
+    other = pd.DataFrame({c: 'N/A' for c in HOVER_COLUMNS if c is not None}, index=range(len(groups)))
+    other['contract_id'] = OTHER_CONTRACTS
+    other['contract_name'] = [f"{n} contracts" for n in groups['contracts']]
+    other['parent_org_name'] = groups.index
+    other[size] = groups['size'].to_numpy().astype(df[size].dtype)
+    other['Rating'] = (groups['weighted'] / groups['rated'].replace(0, np.nan)).to_numpy()
+
+    #text columns are categorical, the folded rows are plain labels
+    kept = df[~small]
+    kept = kept.assign(**{c: kept[c].astype(object) for c in other.columns if c not in (size, 'Rating')})
+    return pd.concat([kept[other.columns], other], ignore_index=True)
+
+
+def treemap_figure(df, size, min_share=None):
+    """
+    Given a df of contracts (one row per contract), return the treemap figure with box sizes from the size
+    column and colors from the Rating column. With min_share, contracts smaller than that share of the total
+    size are folded per parent organization (see fold_small_contracts).
+    """
+    extra_cols = [size if c is None else c for c in HOVER_COLUMNS]
+    if min_share:
+        df = fold_small_contracts(df, size, min_share)
+
+    #stars that were not assigned show as N/A instead of blank in the hover text
+    stars = ['overall_star', 'part_c_star', 'part_d_star']
+    df = df.assign(**{c: df[c].astype(object).where(df[c].notna(), 'N/A') for c in stars})
+
+    #create the plotly treemap object
+    fig = px.treemap(
+        data_frame = df,
+        path=['parent_org_name', 'contract_id'],     # how the blocks are organized   
+        values = size,      # value determining block size
+        custom_data = extra_cols,
+        color='Rating',
+        color_continuous_scale ='rdylgn',
+        range_color = [0,5]
+    )
+
+    #basic display formatting
+    fig.update_traces(root_color="lightgrey")
+    fig.update_layout(margin = dict(t=10, l=10, r=10, b=10))
+
+    #set up hover display
+    fig.update_traces(
+        hovertemplate ='<b>%{customdata[0]} - %{customdata[1]}</b><br><br>' +
+            'Marketing Name: %{customdata[2]}<br>'
+            'Parent: %{customdata[3]}<br>' +
+            'Overall: %{customdata[4]}<br>' +
+            'Part C: %{customdata[5]}<br>' +
+            'Part D: %{customdata[6]}<br>' +
+            'States: %{customdata[7]}<br>' +
+            'Enrollment: %{customdata[8]}<br>' +
+            'Organization type: %{customdata[9]}<br>' +
+            'SNP: %{customdata[10]}<br>'
+    )
+    #customize hoverlabel appearance
+    fig.update_layout(
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=16,
+            font_family="Arial"
+        )  
+    )
+    return fig
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def _explorer_treemap(DATA_URL, version, year, plan_type, state, quartile, min_share):
+    rows = explorer_index(DATA_URL).explorer_rows(year, plan_type, state, quartile)
+    #the contract columns; enrollment and top states come from the state enrollment store below
+    columns = [c for c in dataset_columns(DATA_URL) if not is_state_column(c) and c not in ('top_states', 'total_enrollment')]
+    df = load_data(DATA_URL, columns=columns).iloc[rows]
+    store = state_enrollment(DATA_URL)
+    size = state if state != 'All' else 'total_enrollment'
+    df = df.assign(**{size: store.state_enrollment(state, rows), 'top_states': store.top_states(rows)})
+    return treemap_figure(df, size, min_share)
+
+
+def explorer_treemap(DATA_URL, year, plan_type='All', state='All', quartile='All', min_share=None):
+    """
+    The treemap figure of the Star Rating Explorer for its sidebar filters, from the LRU of recent figures.
+    Entries are keyed by the dataset's content hash, so a changed file gets new figures. The figure is
+    shared: callers must not modify it.
+    """
+    return _explorer_treemap(DATA_URL, dataset_version(DATA_URL), year, plan_type, state, quartile, min_share)
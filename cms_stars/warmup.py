@@ -0,0 +1,105 @@
+"""
+Background warm-up of the app's pages.
+
+app.py only imports the modules of the page being shown, so a new server process renders its first page
+without paying for the imports (scipy, plotly express, ...) of the others. Once that first page has been
+sent, warm_up() starts one thread per process that imports every page's modules and builds the shared
+datasets, indexes and default figures through the process-wide cache, so the next pages a user opens are
+already warm. Everything built here goes through derived() and load_data(), so a session asking for the
+same object while it is being built simply waits for it.
+"""
+import importlib
+import threading
+
+#pages of the app, in the order of the page selector
+PAGES = ['Star Rating Explorer', 'Star Measure Details (2022)', 'Correlations Dashboard', 'Contract Star Details']
+
+ENROLLMENT_URL = "data/visualization_data.csv"
+DETAILS_URL = "data/visualization_data_contract_details.csv"
+CUTPOINTS_URL = "data/visualization_data_cutpoints.csv"
+CORRELATIONS_URL = "data/visualization_data_correlations.csv"
+
+#modules imported by each page
+PAGE_MODULES = {
+    'Star Rating Explorer': ['plotly.graph_objects', 'cms_stars.filter_index', 'cms_stars.states', 'cms_stars.treemap'],
+    'Star Measure Details (2022)': ['cms_stars.pdfs', 'cms_stars.pdf_search'],
+    'Correlations Dashboard': ['plotly.graph_objects', 'cms_stars.correlations'],
+    'Contract Star Details': ['plotly.graph_objects', 'cms_stars.cutpoints', 'cms_stars.drift', 'cms_stars.filter_index',
+                              'cms_stars.predictions', 'cms_stars.report', 'cms_stars.simulation', 'cms_stars.stars'],
+}
+
+_started = False
+_lock = threading.Lock()
+
+
+def _warm_explorer():
+    from cms_stars.filter_index import explorer_index
+    from cms_stars.treemap import explorer_treemap
+    index = explorer_index(ENROLLMENT_URL)
+    #the figure shown with the default filters
+    explorer_treemap(ENROLLMENT_URL, int(max(index.postings['year'])), 'All', 'All', 'All', None)
+
+
+def _warm_pdfs():
+    from cms_stars.pdf_search import pdf_search
+    pdf_search()
+
+
+def _warm_correlations():
+    from cms_stars.data import load_data
+    load_data(CORRELATIONS_URL)
+
+
+def _warm_contract():
+    from cms_stars.cutpoints import cutpoint_index
+    from cms_stars.data import load_data
+    from cms_stars.filter_index import filter_index
+    from cms_stars.stars import star_table
+    load_data(DETAILS_URL)
+    load_data(CUTPOINTS_URL)
+    cutpoint_index(CUTPOINTS_URL)
+    #the same columns as the Contract Star Details page, so the page finds this index
+    filter_index(DETAILS_URL, ['year', 'parent_org_name', 'contract_id', 'measure'])
+    star_table(DETAILS_URL)
+
+
+PAGE_WARMERS = {
+    'Star Rating Explorer': _warm_explorer,
+    'Star Measure Details (2022)': _warm_pdfs,
+    'Correlations Dashboard': _warm_correlations,
+    'Contract Star Details': _warm_contract,
+}
+
+
+def warm_page(page):
+    """
+    Import the modules of page and build the shared objects it reads first. Failures are left for the page
+    itself to report when it is opened.
+    """
+    try:
+        for module in PAGE_MODULES[page]:
+            importlib.import_module(module)
+        PAGE_WARMERS[page]()
+    except Exception:
+        pass
+
+
+def _warm_all(current):
+    #the page already shown is mostly warm, so it goes last
+    for page in [p for p in PAGES if p != current] + [current]:
+        warm_page(page)
+
+
+def warm_up(current=PAGES[0]):
+    """
+    Start warming every page in a background thread, the current page last, once per process.
+    Returns the thread, or None if warming already started.
+    """
+    global _started
+    with _lock:
+        if _started:
+            return None
+        _started = True
+    thread = threading.Thread(target=_warm_all, args=(current,), name='cms-stars-warmup', daemon=True)
+    thread.start()
+    return thread